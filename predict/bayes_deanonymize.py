@@ -4,8 +4,8 @@ from heapq import nlargest
 # import pyximport; pyximport.install()
 import numpy as np
 
-from classify_relationship import (LengthClassifier,
-                                   shared_segment_length_genomes)
+from classify_relationship import LengthClassifier
+from founder_index import founder_index_from_genomes
 from data_logging import write_log
 from util import first_missing_ancestor
 
@@ -23,8 +23,25 @@ class BayesDeanonymize:
             self._length_classifier = LengthClassifier(population, 1000)
         else:
             self._length_classifier = classifier
+        # Labeled node ids and a FounderIndex over their genomes,
+        # built on the first call to identify.
+        self._labeled_genomes = None
         # self.__remove_erroneous_labeled()
 
+    def _labeled_founder_index(self):
+        """
+        Returns a tuple of the labeled node ids and a FounderIndex over
+        their genomes, in the same order.
+        """
+        if self._labeled_genomes is None:
+            id_map = self._population.id_mapping
+            labeled_ids = list(self._length_classifier._labeled_nodes)
+            index = founder_index_from_genomes(id_map[labeled_node_id].genome
+                                               for labeled_node_id
+                                               in labeled_ids)
+            self._labeled_genomes = (labeled_ids, index)
+        return self._labeled_genomes
+
     def __remove_erroneous_labeled(self):
         print("Removing erroneous labeled nodes")
         id_map = self._population.id_mapping
@@ -43,14 +60,10 @@ class BayesDeanonymize:
 
     def identify(self, genome, actual_node, ibd_threshold = 5000000):
         node_probabilities = dict() # Probability that a node is a match
-        id_map = self._population.id_mapping
         length_classifier = self._length_classifier
-        shared_list = []
-        for labeled_node_id in length_classifier._labeled_nodes:
-            labeled_node = id_map[labeled_node_id]
-            s = shared_segment_length_genomes(genome, labeled_node.genome,
-                                              ibd_threshold)
-            shared_list.append((labeled_node_id, s))
+        labeled_ids, labeled_index = self._labeled_founder_index()
+        shared = labeled_index.shared_lengths(genome, ibd_threshold)
+        shared_list = list(zip(labeled_ids, shared.tolist()))
 
         node_data = dict()
         batch_node_id = []
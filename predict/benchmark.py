@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from datetime import datetime
+from itertools import chain
+from os import cpu_count
+from os.path import abspath, basename, dirname, join
+from random import choice, sample
+from subprocess import check_output, CalledProcessError, DEVNULL
+from time import perf_counter
+import json
+import platform
+import random
+
+import numpy as np
+
+import data_logging
+from bayes_deanonymize import BayesDeanonymize
+from classify_relationship import LengthClassifier, HurdleGammaParams
+from common_segments import common_segment_lengths
+from island_model import tree_from_file
+from node import NodeGenerator
+from population import HierarchicalIslandPopulation
+from population_genomes import generate_genomes, generate_genomes_for, mate
+from recomb_genome import (recombinators_from_directory,
+                           RecombGenomeGenerator, Recombinator,
+                           CHROMOSOME_ORDER, MEGABASE)
+from sex import Sex
+
+DATA_DIR = join(dirname(abspath(__file__)), "..", "data")
+
+# Autosome lengths of GRCh37, used for the synthetic recombination
+# maps when no HapMap data is given.
+CHROMOSOME_LENGTHS = [249250621, 243199373, 198022430, 191154276,
+                      180915260, 171115067, 159138663, 146364022,
+                      141213431, 135534747, 135006516, 133851895,
+                      115169878, 107349540, 102531392, 90354753,
+                      81195210, 78077248, 59128983, 63025520,
+                      48129895, 51304566]
+# Mean sex averaged recombination rate in cM / Mb, and the female and
+# male rates relative to it.
+MEAN_RATE = 1.2
+SEX_RATE_MULTIPLIER = {Sex.Female: 1.3, Sex.Male: 0.7}
+
+def synthetic_recombinators(seed, interval = MEGABASE):
+    """
+    Returns recombinators for both sexes built from a synthetic map
+    with a recombination rate drawn for every interval bases. Both
+    maps have the same positions, so genomes from either recombinator
+    have the same chromosome offsets.
+    """
+    random_state = np.random.RandomState(seed)
+    rates = dict()
+    positions = dict()
+    for chrom, length in zip(CHROMOSOME_ORDER, CHROMOSOME_LENGTHS):
+        chrom_positions = np.append(np.arange(0, length, interval), length)
+        positions[chrom] = chrom_positions
+        rates[chrom] = random_state.gamma(2.0, MEAN_RATE / 2.0,
+                                          len(chrom_positions))
+    recombinators = dict()
+    for sex, multiplier in SEX_RATE_MULTIPLIER.items():
+        data = dict()
+        for chrom in CHROMOSOME_ORDER:
+            chrom_positions = positions[chrom]
+            chrom_rates = rates[chrom] * multiplier
+            centimorgans = np.zeros(len(chrom_positions))
+            np.cumsum(np.diff(chrom_positions) / MEGABASE * chrom_rates[1:],
+                      out = centimorgans[1:])
+            data[chrom] = [[int(position), float(rate), float(cm)]
+                           for position, rate, cm
+                           in zip(chrom_positions, chrom_rates, centimorgans)]
+        recombinators[sex] = Recombinator(data)
+    return recombinators
+
+def build_population(tree_file, generation_size, num_generations):
+    """
+    Builds a population without genomes from the given island tree
+    file, as generate_population.py does.
+    """
+    node_generator = NodeGenerator()
+    founders = [node_generator.generate_node()
+                for _ in range(generation_size)]
+    tree = tree_from_file(tree_file)
+    leaves = tree.leaves
+    for person in founders:
+        tree.add_individual(choice(leaves), person)
+    population = HierarchicalIslandPopulation(tree)
+    for _ in range(num_generations - 1):
+        population.new_generation()
+    return population
+
+def synthetic_classifier(population, labeled_nodes, relatives):
+    """
+    Returns a LengthClassifier with a fixed hurdle gamma distribution
+    for relatives randomly picked members with genomes for each
+    labeled node. Every other pair is treated as cryptic.
+    """
+    with_genomes = [node._id for node in population.members
+                    if node.genome is not None]
+    params = HurdleGammaParams(1.5, 2e7, 0.3)
+    distributions = dict()
+    for labeled_node in labeled_nodes:
+        for node_id in sample(with_genomes, min(relatives,
+                                                len(with_genomes))):
+            distributions[node_id, labeled_node._id] = params
+    return LengthClassifier(distributions,
+                            [node._id for node in labeled_nodes])
+
+def _seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+def _time(function, repeat):
+    """
+    Calls function repeat times, returning the wall clock time of
+    each call.
+    """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return times
+
+def _process_counts(processes):
+    """
+    Returns the numbers of processes to time generate_genomes with:
+    the powers of 2 from 2 up to processes, and processes itself.
+    """
+    counts = []
+    count = 2
+    while count < processes:
+        counts.append(count)
+        count *= 2
+    if processes > 1:
+        counts.append(processes)
+    return counts
+
+def _git_revision():
+    try:
+        return check_output(["git", "describe", "--always", "--dirty",
+                             "--abbrev=40"],
+                            cwd = dirname(abspath(__file__)),
+                            stderr = DEVNULL).decode().strip()
+    except (CalledProcessError, OSError):
+        return None
+
+def run_benchmarks(tree_file, generation_size, args, recombinators):
+    """
+    Runs every benchmark for one population, returning a list of
+    result dicts.
+    """
+    def result(name, calls, times):
+        print("{:>26} {:>8} calls {:10.4f}s".format(name, calls, min(times)))
+        return {"benchmark": name,
+                "tree": basename(tree_file),
+                "generation_size": generation_size,
+                "calls": calls,
+                "seconds": times}
+
+    _seed(args.seed)
+    print("Building population of {} per generation from {}".format(generation_size, tree_file))
+    population = build_population(tree_file, generation_size,
+                                  args.num_generations)
+    genome_generator = RecombGenomeGenerator(recombinators[Sex.Male]._num_bases)
+    results = []
+
+    def generate(batch, processes = 1):
+        _seed(args.seed)
+        population.clean_genomes()
+        genome_generator.reset()
+        generate_genomes(population, genome_generator, recombinators, 3,
+                         batch = batch, processes = processes)
+    results.append(result("generate_genomes", 1,
+                          _time(lambda: generate(False), args.repeat)))
+    batch_times = _time(lambda: generate(True), args.repeat)
+    results.append(result("generate_genomes_batch", 1, batch_times))
+    # Scaling of batch generation with the number of processes.
+    for processes in _process_counts(args.processes):
+        times = _time(lambda: generate(True, processes), args.repeat)
+        results.append(result("generate_genomes_processes_{}"
+                              .format(processes), 1, times))
+        print("{:>26} {:>8} processes {:10.2f}x".format("speedup", processes,
+                                                     min(batch_times) /
+                                                     min(times)))
+
+    last_generation = population.generations[-1].members
+    _seed(args.seed)
+    genomes = [node.genome for node
+               in sample(last_generation, min(args.calls,
+                                              len(last_generation)))]
+    recombinator = recombinators[Sex.Male]
+    def recombine():
+        for genome in genomes:
+            recombinator.recombination(genome)
+    results.append(result("recombination", len(genomes),
+                          _time(recombine, args.repeat)))
+
+    parents = [(choice(genomes), choice(genomes)) for _ in genomes]
+    def mate_all():
+        for mother, father in parents:
+            mate(mother, father, recombinators[Sex.Female],
+                 recombinators[Sex.Male])
+    results.append(result("mate", len(parents), _time(mate_all, args.repeat)))
+
+    _seed(args.seed)
+    pairs = [tuple(sample(last_generation, 2)) for _ in range(args.calls)]
+    def segment_lengths():
+        for node_a, node_b in pairs:
+            common_segment_lengths(node_a.genome, node_b.genome)
+    results.append(result("common_segment_lengths", len(pairs),
+                          _time(segment_lengths, args.repeat)))
+
+    _seed(args.seed)
+    labeled_nodes = sample(last_generation, min(args.num_labeled,
+                                                len(last_generation)))
+    classifier = synthetic_classifier(population, labeled_nodes,
+                                      args.relatives)
+    batch_pairs = list(classifier._distributions.keys())
+    query_nodes = [pair[0] for pair in batch_pairs]
+    batch_labeled = [pair[1] for pair in batch_pairs]
+    lengths = np.random.gamma(1.5, 2e7, len(batch_pairs)).astype(np.uint32)
+    lengths[np.random.random(len(batch_pairs)) < 0.3] = 0
+    def batch_probability():
+        classifier.get_batch_probability(lengths, query_nodes, batch_labeled)
+    results.append(result("get_batch_probability", len(batch_pairs),
+                          _time(batch_probability, args.repeat)))
+
+    bayes = BayesDeanonymize(population, classifier)
+    unlabeled = sample(last_generation, min(args.identify_calls,
+                                            len(last_generation)))
+    # The first call builds the index over the labeled genomes.
+    bayes.identify(unlabeled[0].genome, unlabeled[0])
+    def identify():
+        for node in unlabeled:
+            bayes.identify(node.genome, node)
+    results.append(result("identify", len(unlabeled),
+                          _time(identify, args.repeat)))
+
+    # Only the labeled nodes and their ancestors are simulated.
+    def generate_labeled():
+        _seed(args.seed)
+        population.clean_genomes()
+        genome_generator.reset()
+        generate_genomes_for(population, labeled_nodes, genome_generator,
+                             recombinators, batch = True)
+    results.append(result("generate_genomes_for", len(labeled_nodes),
+                          _time(generate_labeled, args.repeat)))
+    return results
+
+def compare(results, previous_file):
+    """
+    Prints the ratio of the best time of each benchmark to the best
+    time of the same benchmark in a previous results file.
+    """
+    with open(previous_file, "r") as json_file:
+        previous = json.load(json_file)
+    def key(result):
+        return (result["benchmark"], result["tree"],
+                result["generation_size"], result["calls"])
+    previous_times = {key(result): min(result["seconds"])
+                      for result in previous["results"]}
+    print("Compared to {}".format(previous.get("revision")))
+    for result in results:
+        if key(result) not in previous_times:
+            continue
+        ratio = min(result["seconds"]) / previous_times[key(result)]
+        print("{:>26} {:>8} {:>8.3f}x".format(result["benchmark"],
+                                              result["generation_size"],
+                                              ratio))
+
+parser = ArgumentParser(description = "Time genome simulation and shared segment calculations on synthetic populations.")
+parser.add_argument("--tree_files", nargs = "+",
+                    default = [join(DATA_DIR, "two_islands")],
+                    help = "Island tree files to build populations from.")
+parser.add_argument("--sizes", default = "1000,10000,100000",
+                    help = "Comma separated list of generation sizes.")
+parser.add_argument("--num_generations", type = int, default = 5)
+parser.add_argument("--recombination_dir", default = None,
+                    help = "Directory containing Hapmap and decode data. If not given a synthetic recombination map is used.")
+parser.add_argument("--seed", type = int, default = 0)
+parser.add_argument("--repeat", type = int, default = 3,
+                    help = "Number of times to time each benchmark.")
+parser.add_argument("--calls", type = int, default = 1000,
+                    help = "Number of genomes or pairs for recombination, mate and common_segment_lengths.")
+parser.add_argument("--num_labeled", type = int, default = 100)
+parser.add_argument("--relatives", type = int, default = 50,
+                    help = "Number of pairs with a distribution for each labeled node.")
+parser.add_argument("--identify_calls", type = int, default = 3)
+parser.add_argument("--processes", type = int, default = 1,
+                    help = "If more than 1, also time generate_genomes with 2, 4, ... and this many processes, to show how it scales.")
+parser.add_argument("--output_file", default = None,
+                    help = "JSON file to write results to. Defaults to benchmark_<revision>.json")
+parser.add_argument("--compare", default = None,
+                    help = "Previous results file to compare against.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.num_generations < 1:
+        parser.error("num_generations must be >= 1")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    # identify logs every call, which would dominate its timing.
+    data_logging.logging = False
+
+    if args.recombination_dir is None:
+        recombinators = synthetic_recombinators(args.seed)
+    else:
+        recombinators = recombinators_from_directory(args.recombination_dir)
+
+    revision = _git_revision()
+    results = list(chain.from_iterable(run_benchmarks(tree_file, size, args,
+                                                      recombinators)
+                                       for tree_file in args.tree_files
+                                       for size in sizes))
+    output = {"revision": revision,
+              "timestamp": datetime.now().isoformat(),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "machine": platform.machine(),
+              "cpus": cpu_count(),
+              "args": vars(args),
+              "results": results}
+    output_file = args.output_file
+    if output_file is None:
+        output_file = "benchmark_{}.json".format((revision or "unknown")[:12])
+    with open(output_file, "w") as json_file:
+        json.dump(output, json_file, indent = 2)
+    print("Wrote results to {}".format(output_file))
+    if args.compare is not None:
+        compare(results, args.compare)
@@ -0,0 +1,115 @@
+from os import fsync, replace
+from os.path import exists, join
+from tempfile import NamedTemporaryFile
+import json
+import pickle
+import random
+
+import numpy as np
+
+from pair_statistics import PairStatistics
+
+CHECKPOINT_FILENAME = "checkpoint.npz"
+
+class Checkpoint:
+    """
+    The state of shared_to_directory after its last completed batch of
+    iterations: the pair statistics, the number of iterations and
+    stored samples so far, the labeled node ids and the parameters of
+    the run, and the random state needed to continue it.
+
+    A checkpoint is written to a temporary file which then replaces
+    the previous checkpoint, so the checkpoint in a directory is
+    always complete, whenever the run was stopped.
+    """
+    def __init__(self, labeled_nodes, parameters, statistics, rng):
+        """
+        labeled_nodes are the ids of the labeled nodes, parameters a
+        JSON serializable dict of the run's parameters and rng the
+        Generator or None given to the run, before any streams are
+        spawned from it.
+        """
+        self.labeled_nodes = sorted(labeled_nodes)
+        self.parameters = parameters
+        self.statistics = statistics
+        self.completed_iterations = 0
+        self.num_samples = 0
+        # Pickled now, as spawning streams changes the Generator.
+        self._rng = pickle.dumps(rng)
+        self._global_state = None
+
+    @property
+    def rng(self):
+        """
+        Returns a copy of the rng the checkpoint was created with.
+        """
+        return pickle.loads(self._rng)
+
+    def check(self, labeled_nodes, parameters, unlabeled, labeled):
+        """
+        Raises ValueError unless the checkpoint is for the given
+        labeled node ids, run parameters and pairs of ids.
+        """
+        if sorted(labeled_nodes) != self.labeled_nodes:
+            raise ValueError("Checkpoint is for different labeled nodes.")
+        if parameters != self.parameters:
+            error_string = "Checkpoint is for parameters {}, not {}."
+            raise ValueError(error_string.format(self.parameters, parameters))
+        if not (np.array_equal(self.statistics.unlabeled, unlabeled) and
+                np.array_equal(self.statistics.labeled, labeled)):
+            raise ValueError("Checkpoint is for different pairs.")
+
+    def restore_global_state(self):
+        """
+        Sets the random and np.random states to those at the last
+        commit.
+        """
+        if self._global_state is not None:
+            python_state, numpy_state = self._global_state
+            random.setstate(python_state)
+            np.random.set_state(numpy_state)
+
+    def commit(self, directory, completed_iterations, num_samples):
+        """
+        Records that completed_iterations iterations and num_samples
+        stored samples are done, along with the current random and
+        np.random states, and saves the checkpoint to directory.
+        """
+        self.completed_iterations = completed_iterations
+        self.num_samples = num_samples
+        self._global_state = (random.getstate(), np.random.get_state())
+        random_state = pickle.dumps((self._rng, self._global_state))
+        with NamedTemporaryFile(dir = directory, suffix = ".npz",
+                                delete = False) as checkpoint_file:
+            np.savez(checkpoint_file,
+                     labeled_nodes = np.array(self.labeled_nodes,
+                                              dtype = np.uint32),
+                     parameters = json.dumps(self.parameters),
+                     completed_iterations = completed_iterations,
+                     num_samples = num_samples,
+                     random_state = np.frombuffer(random_state,
+                                                  dtype = np.uint8),
+                     **self.statistics.arrays())
+            checkpoint_file.flush()
+            fsync(checkpoint_file.fileno())
+        replace(checkpoint_file.name, join(directory, CHECKPOINT_FILENAME))
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Returns the checkpoint saved to directory, or None if there is
+        none.
+        """
+        filename = join(directory, CHECKPOINT_FILENAME)
+        if not exists(filename):
+            return None
+        with np.load(filename) as data:
+            statistics = PairStatistics.from_arrays(data)
+            checkpoint = cls(data["labeled_nodes"].tolist(),
+                             json.loads(str(data["parameters"])), statistics,
+                             None)
+            checkpoint.completed_iterations = int(data["completed_iterations"])
+            checkpoint.num_samples = int(data["num_samples"])
+            random_state = data["random_state"].tobytes()
+        checkpoint._rng, checkpoint._global_state = pickle.loads(random_state)
+        return checkpoint
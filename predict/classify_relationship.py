@@ -1,7 +1,9 @@
 from collections import namedtuple, defaultdict
-from itertools import chain, product, combinations
-from os import listdir, makedirs
-from os.path import join, exists
+from multiprocessing import Pool
+from itertools import chain
+from math import isnan
+from os import makedirs
+from os.path import exists, join
 from random import sample, random
 from shutil import rmtree
 from warnings import warn
@@ -12,14 +14,27 @@ from statsmodels.distributions.empirical_distribution import ECDF
 import numpy as np
 # import pyximport; pyximport.install()
 
-from common_segments import common_segment_lengths
+from checkpoint import Checkpoint
+from common_segments import (shared_segment_length, shared_segment_stats,
+                             may_share_founder)
 from data_logging import write_log
-from population_genomes import generate_genomes
-from population_statistics import ancestors_of, all_ancestors_of
-from gamma import fit_hurdle_gamma
+from founder_index import founder_index_from_genomes
+from genome_replicates import generate_genome_replicates
+from population_statistics import ancestors_of
+from gamma import fit_hurdle_gamma_batch
+from pair_statistics import PairStatistics
+from random_streams import spawn
+from sample_store import SampleStore
+from shared_meiosis import SharedArrays
 
 # ZERO_REPLACE = 1e-20
 ZERO_REPLACE = 0.03
+# Number of pairs distributions_from_directory fits at a time.
+FIT_CHUNK_PAIRS = 4096
+# Subdirectory of the work directory for each shard.
+SHARD_DIRECTORY = "shard_{}"
+# Number of sample rows merge_shards copies at a time.
+MERGE_CHUNK_ROWS = 1 << 24
 
 GammaParams = namedtuple("GammaParams", ["shape", "scale"])
 HurdleGammaParams = namedtuple("HurdleGammaParams", ["shape", "scale", "zero_prob"])
@@ -185,20 +200,70 @@ def related_pairs(unlabeled_nodes, labeled_nodes, population, generations):
     (unlabeled node, labeled node)
     where the labeled node and unlabeled node share at least 1 common ancestor
     going back generation generations from the latest generation.
+    Suspected parents are used, and the parents of the generation
+    generations back are ignored, as for shared_ancestry_founders.
     """
-    generation_map = population.node_to_generation
-    num_generations = population.num_generations
-    if type(labeled_nodes) != set:
-        labeled_nodes = set(labeled_nodes)
-    ancestors = dict()
-    ancestors = {node: all_ancestors_of(node)
-                 for node
-                 in chain(unlabeled_nodes, labeled_nodes)}
+    unlabeled_nodes = list(dict.fromkeys(unlabeled_nodes))
+    labeled_nodes = list(dict.fromkeys(labeled_nodes))
+    founders = shared_ancestry_founders(population, generations)
+    ancestors = _ancestor_sets(chain(unlabeled_nodes, labeled_nodes),
+                               founders)
+    # Only pairs with a common ancestor are ever looked at, rather
+    # than every unlabeled and labeled pair.
+    labeled_by_ancestor = defaultdict(list)
+    for labeled in labeled_nodes:
+        for ancestor in ancestors[labeled]:
+            labeled_by_ancestor[ancestor].append(labeled)
+    pairs = []
+    for unlabeled in unlabeled_nodes:
+        related = set()
+        for ancestor in ancestors[unlabeled]:
+            related.update(labeled_by_ancestor.get(ancestor, ()))
+        related.discard(unlabeled)
+        pairs.extend((unlabeled, labeled) for labeled in related)
+    return pairs
 
-    return [(unlabeled, labeled) for unlabeled, labeled
-            in product(unlabeled_nodes, labeled_nodes)
-            if (unlabeled != labeled and
-                not ancestors[unlabeled].isdisjoint(ancestors[labeled]))]
+def shared_ancestry_founders(population, generations_back_shared):
+    """
+    Returns the set of members of the generation generations_back_shared
+    generations back from the latest generation. Treating them as
+    having no parents ignores common ancestry further back.
+    """
+    clear_index = population.num_generations - generations_back_shared
+    if not 0 <= clear_index < population.num_generations:
+        return frozenset()
+    return frozenset(population.generations[clear_index].members)
+
+def _ancestor_sets(nodes, founders):
+    """
+    Returns a dict from each of nodes and their suspected ancestors
+    to the set of their suspected ancestors, including the node
+    itself. Nodes in founders are treated as having no parents.
+    Ancestors shared by many nodes are only visited once.
+    """
+    ancestors = dict()
+    to_visit = list(nodes)
+    while len(to_visit) > 0:
+        node = to_visit[-1]
+        if node in ancestors:
+            to_visit.pop()
+            continue
+        if node in founders:
+            parents = []
+        else:
+            parents = [parent for parent in (node.suspected_mother,
+                                             node.suspected_father)
+                       if parent is not None]
+        missing = [parent for parent in parents if parent not in ancestors]
+        if len(missing) > 0:
+            to_visit.extend(missing)
+            continue
+        to_visit.pop()
+        node_ancestors = {node}
+        for parent in parents:
+            node_ancestors.update(ancestors[parent])
+        ancestors[node] = node_ancestors
+    return ancestors
 
 
 # At some point this should probably be turned into a "builder" class,
@@ -206,27 +271,30 @@ def related_pairs(unlabeled_nodes, labeled_nodes, population, generations):
 def generate_classifier(population, labeled_nodes, genome_generator,
                         recombinators, directory, clobber = True,
                         iterations = 1000, generations_back_shared = 7,
-                        min_segment_length = 0, non_paternity = 0.0):    
-    if not exists(directory):
-        makedirs(directory)
-    elif clobber:
-        rmtree(directory)
-        makedirs(directory)
-    num_generations = population.num_generations
-    clear_index = num_generations - generations_back_shared
-    to_clear = population.generations[clear_index].members
-    for node in to_clear:
-        node.suspected_mother = None
-        node.suspected_mother_id = None
-        node.suspected_father = None
-        node.suspected_father_id = None
+                        min_segment_length = 0, non_paternity = 0.0,
+                        rng = None, replicates = 1, processes = 1,
+                        keep_samples = False):
+    """
+    If rng, a numpy Generator, is given, the simulations and the fits
+    draw from streams spawned from it, so the classifier depends only
+    on the state of rng. replicates iterations are simulated at a
+    time, as for shared_to_directory. If keep_samples is True every
+    simulated shared length is kept in directory as well as their
+    statistics. If processes is more than 1, the distributions are
+    fit by a pool of that many processes, as for
+    distributions_from_directory.
+    """
+    simulation_rng, fit_rng = spawn(rng, 2)
+    _make_directory(directory, clobber)
     if 0 < iterations:
         shared_to_directory(population, labeled_nodes, genome_generator,
                             recombinators, directory, clobber = clobber,
                             iterations = iterations,
                             min_segment_length = min_segment_length,
                             generations_back_shared = generations_back_shared,
-                            non_paternity = non_paternity)
+                            non_paternity = non_paternity,
+                            rng = simulation_rng, replicates = replicates,
+                            keep_samples = keep_samples)
     # print("Generating cryptic relative parameters")
     # population.clean_genomes()
     # generate_genomes(population, genome_generator, recombinators, 3,
@@ -242,7 +310,8 @@ def generate_classifier(population, labeled_nodes, genome_generator,
     # keep the option of switching back in the future easier.
     # cryptic_params = HurdleGammaParams(*fit_hurdle_gamma(cryptic_lens))
     print("Generating classifiers.")
-    classifier = classifier_from_directory(directory, population.id_mapping)
+    classifier = classifier_from_directory(directory, population.id_mapping,
+                                           fit_rng, processes)
     # classifier._cryptic_distribution = cryptic_params
     # print("Generating ecdf")
     # classifier._empirical_cryptic_distribution = ECDF(cryptic_lens, "left")
@@ -256,25 +325,26 @@ def labeled_cryptic_ecdf(population, labeled_nodes, generations_back_shared,
                             min_segment_length = 0):
     unlabeled = [node for node in population.members
                  if node.genome is not None]
-    unlabeled = set(sample(unlabeled, len(unlabeled) // 2))
+    unlabeled = sample(unlabeled, len(unlabeled) // 2)
     related = related_pairs(unlabeled, labeled_nodes, population,
                             generations_back_shared)
     related_map = defaultdict(set)
     for node_a, node_b in related:
         related_map[node_a].add(node_b)
         related_map[node_b].add(node_a)
-        
+
+    # Each labeled node is compared against every unlabeled node, so
+    # index the unlabeled genomes once.
+    unlabeled_index = founder_index_from_genomes(node.genome
+                                                 for node in unlabeled)
     cryptic_ecdf = dict()    
     for labeled_node in labeled_nodes:
         labeled_related = related_map[labeled_node]
-        unrelated_pairs = ((unlabeled_node, labeled_node)
-                           for unlabeled_node in unlabeled
-                           if unlabeled_node not in labeled_related)
-        lengths_iter = (shared_segment_length_genomes(node_a.genome,
-                                                      node_b.genome,
-                                                      min_segment_length)
-                        for node_a, node_b in unrelated_pairs)
-        lengths = np.fromiter(lengths_iter, dtype = np.uint32)
+        unrelated_i = [i for i, unlabeled_node in enumerate(unlabeled)
+                       if unlabeled_node not in labeled_related]
+        shared = unlabeled_index.shared_lengths(labeled_node.genome,
+                                                min_segment_length)
+        lengths = shared[unrelated_i].astype(np.uint32)
         nonzero_i = (lengths != 0)
         frac_zero = (len(lengths) - np.sum(nonzero_i)) / len(lengths)
         ecdf = ECDF(lengths[nonzero_i], "left")
@@ -295,21 +365,189 @@ def cryptic_lengths(population, labeled_nodes, generations_back_shared,
         related_map[node_a].add(node_b)
         related_map[node_b].add(node_a)
 
-    # labeled_pairs = combinations(labeled_nodes, 2)
-    labeled_pairs = combinations(nodes, 2)
-    unrelated_pairs = ((a, b) for a, b in labeled_pairs
-                       if a not in related_map[b])
-    shared_iter = (shared_segment_length_genomes(node_a.genome,
-                                                 node_b.genome,
-                                                 min_segment_length)
-                   for node_a, node_b in unrelated_pairs)
-    return np.fromiter(shared_iter, dtype = np.uint32)
+    # Lengths are gathered in the same order as combinations(nodes, 2)
+    index = founder_index_from_genomes(node.genome for node in nodes)
+    lengths = []
+    for i, node_a in enumerate(nodes):
+        shared = index.shared_lengths(node_a.genome, min_segment_length)
+        unrelated_i = [j for j in range(i + 1, len(nodes))
+                       if node_a not in related_map[nodes[j]]]
+        lengths.append(shared[unrelated_i])
+    return np.concatenate(lengths).astype(np.uint32)
+
+def clear_suspected_parents(population, generations_back_shared):
+    """
+    Removes the suspected parents of the members of
+    shared_ancestry_founders, so that common ancestry further back is
+    ignored by anything using the population. Nothing is removed if
+    there is no such generation. related_pairs and shared_to_directory
+    do not need this, as they ignore it themselves.
+    """
+    for node in shared_ancestry_founders(population,
+                                         generations_back_shared):
+        node.suspected_mother = None
+        node.suspected_mother_id = None
+        node.suspected_father = None
+        node.suspected_father_id = None
+
+def _make_directory(directory, clobber):
+    if not exists(directory):
+        makedirs(directory)
+    elif clobber:
+        rmtree(directory)
+        makedirs(directory)
+
+def shard_directory(directory, shard):
+    """
+    Returns the directory shard writes to within directory.
+    """
+    return join(directory, SHARD_DIRECTORY.format(shard))
+
+def shard_iterations(iterations, num_shards, shard):
+    """
+    Returns the number of iterations of shard when iterations are
+    split between num_shards shards.
+    """
+    return iterations // num_shards + (shard < iterations % num_shards)
+
+def shared_to_shard(population, labeled_nodes, genome_generator,
+                    recombinators, directory, shard, num_shards,
+                    clobber = True, iterations = 1000,
+                    generations_back_shared = 7, min_segment_length = 0,
+                    non_paternity = 0.0, rng = None, replicates = 1,
+                    keep_samples = False):
+    """
+    Runs shard's part of the iterations of generate_classifier split
+    num_shards ways, with shared_to_directory, in shard_directory of
+    directory. Each shard is independent of the others, so shards can
+    be run by different processes or machines and combined with
+    merge_shards. If rng is given, shard draws from the shard-th of
+    num_shards streams spawned from the simulation stream
+    generate_classifier would use. The shard's checkpoint records
+    shard, num_shards and the total iterations, for merge_shards to
+    check.
+    """
+    assert 0 <= shard < num_shards
+    simulation_rng, _ = spawn(rng, 2)
+    shard_rng = spawn(simulation_rng, num_shards)[shard]
+    directory = shard_directory(directory, shard)
+    _make_directory(directory, clobber)
+    shared_to_directory(population, labeled_nodes, genome_generator,
+                        recombinators, directory, clobber = clobber,
+                        iterations = shard_iterations(iterations, num_shards,
+                                                      shard),
+                        min_segment_length = min_segment_length,
+                        generations_back_shared = generations_back_shared,
+                        non_paternity = non_paternity, rng = shard_rng,
+                        replicates = replicates,
+                        keep_samples = keep_samples,
+                        run_parameters = {"shard": shard,
+                                          "num_shards": num_shards,
+                                          "total_iterations": iterations})
+
+def merge_shards(directory, num_shards):
+    """
+    Combines the completed shards in directory written by
+    shared_to_shard, so that directory holds a checkpoint with the
+    statistics of every iteration, and any samples the shards kept,
+    for classifier_from_directory. Raises ValueError unless shards 0
+    to num_shards - 1 of the same run of num_shards shards are all
+    present and complete.
+    """
+    checkpoints = []
+    for shard in range(num_shards):
+        checkpoint = Checkpoint.load(shard_directory(directory, shard))
+        if checkpoint is None:
+            raise ValueError("Shard {} has no checkpoint.".format(shard))
+        shard_parameters = checkpoint.parameters
+        if (shard_parameters.get("shard") != shard or
+            shard_parameters.get("num_shards") != num_shards):
+            error_string = "Directory of shard {} is not shard {} of {}."
+            raise ValueError(error_string.format(shard, shard, num_shards))
+        if checkpoint.completed_iterations < shard_parameters["iterations"]:
+            raise ValueError("Shard {} is not complete.".format(shard))
+        checkpoints.append(checkpoint)
+    first = checkpoints[0]
+    parameters = _merged_parameters(first.parameters)
+    for shard, checkpoint in enumerate(checkpoints):
+        if (checkpoint.labeled_nodes != first.labeled_nodes or
+            _merged_parameters(checkpoint.parameters) != parameters):
+            error_string = "Shard {} is from a different run."
+            raise ValueError(error_string.format(shard))
+    completed_iterations = sum(checkpoint.completed_iterations
+                               for checkpoint in checkpoints)
+    if completed_iterations != parameters["iterations"]:
+        error_string = "Shards completed {} of {} iterations."
+        raise ValueError(error_string.format(completed_iterations,
+                                             parameters["iterations"]))
+    statistics = PairStatistics(first.statistics.unlabeled,
+                                first.statistics.labeled)
+    store = SampleStore.create(directory, first.labeled_nodes)
+    first_iteration = 0
+    with store:
+        for shard, checkpoint in enumerate(checkpoints):
+            statistics.merge(checkpoint.statistics)
+            _append_store(store,
+                          SampleStore(shard_directory(directory, shard)),
+                          checkpoint.num_samples, first_iteration)
+            first_iteration += checkpoint.completed_iterations
+        store.sync()
+    merged = Checkpoint(first.labeled_nodes, parameters, statistics, None)
+    merged.commit(directory, parameters["iterations"], len(store))
+
+def _merged_parameters(shard_parameters):
+    """
+    Returns the run parameters of the merged shards, given the
+    parameters of one shard.
+    """
+    parameters = dict(shard_parameters)
+    del parameters["shard"]
+    parameters["iterations"] = parameters.pop("total_iterations")
+    return parameters
+
+def _append_store(store, shard_store, num_rows, first_iteration):
+    """
+    Appends the first num_rows rows of shard_store to store, with
+    first_iteration added to their iteration numbers.
+    """
+    if num_rows == 0:
+        return
+    columns = shard_store.columns()
+    for start in range(0, num_rows, MERGE_CHUNK_ROWS):
+        stop = min(start + MERGE_CHUNK_ROWS, num_rows)
+        store.append(columns["unlabeled"][start:stop],
+                     columns["labeled"][start:stop],
+                     columns["iteration"][start:stop] +
+                     np.uint32(first_iteration),
+                     columns["length"][start:stop])
 
 def shared_to_directory(population, labeled_nodes, genome_generator,
                         recombinators, directory, min_segment_length = 0,
                         clobber = True, iterations = 1000,
                         generations_back_shared = 7,
-                        non_paternity = 0.0):
+                        non_paternity = 0.0, rng = None, replicates = 1,
+                        keep_samples = False, run_parameters = None):
+    """
+    Simulates genomes iterations times, accumulating the hurdle gamma
+    statistics of the shared lengths of the related pairs in a
+    PairStatistics. If keep_samples is True every shared length is
+    also written to a SampleStore in directory.
+    Iterations are simulated replicates at a time with
+    generate_genome_replicates, which shares the per person work
+    between them. If rng is given, the i-th batch of replicates draws
+    from the i-th stream spawned from it, so batches are independent
+    and can be reproduced on their own.
+    Common ancestry more than generations_back_shared generations back
+    is ignored, by simulating the nodes of shared_ancestry_founders as
+    founders. The population is not changed.
+    After every batch the statistics are committed to a Checkpoint in
+    directory. If clobber is False the run resumes after the last
+    committed batch of the checkpoint in directory, with its random
+    state, and gives the same result as an uninterrupted run. Raises
+    ValueError if clobber is False and directory has no checkpoint.
+    run_parameters is a dict of further JSON serializable parameters
+    to record in the checkpoint, which a resumed run must also match.
+    """
 
     labeled_nodes = set(labeled_nodes)
     unlabeled_nodes = chain.from_iterable(generation.members
@@ -320,106 +558,296 @@ def shared_to_directory(population, labeled_nodes, genome_generator,
     pairs = related_pairs(unlabeled_nodes, labeled_nodes, population,
                           generations_back_shared)
     print("{} related pairs.".format(len(pairs)))
-    print("Opening file descriptors.")
-    if clobber:
-        mode = "w"
+    # A fixed order lets a resumed run use the same statistics.
+    pairs.sort(key = lambda pair: (pair[1]._id, pair[0]._id))
+    pair_nodes = set(chain.from_iterable(pairs))
+    founders = shared_ancestry_founders(population, generations_back_shared)
+    unlabeled_ids = np.array([unlabeled._id for unlabeled, _ in pairs],
+                             dtype = np.uint32)
+    labeled_ids = np.array([labeled._id for _, labeled in pairs],
+                           dtype = np.uint32)
+    labeled_node_ids = [node._id for node in labeled_nodes]
+    parameters = {"iterations": iterations,
+                  "replicates": replicates,
+                  "min_segment_length": min_segment_length,
+                  "generations_back_shared": generations_back_shared}
+    if run_parameters is not None:
+        parameters.update(run_parameters)
+    checkpoint = None
+    if not clobber:
+        checkpoint = Checkpoint.load(directory)
+        if checkpoint is None:
+            # Never truncate samples this run did not write.
+            error_string = "No checkpoint in {}, nothing to resume."
+            raise ValueError(error_string.format(directory))
+    if checkpoint is None:
+        checkpoint = Checkpoint(labeled_node_ids, parameters,
+                                PairStatistics(unlabeled_ids, labeled_ids),
+                                rng)
     else:
-        mode = "a"
-    fds = {node: open(join(directory, str(node._id)), mode)
-           for node in labeled_nodes}
+        checkpoint.check(labeled_node_ids, parameters, unlabeled_ids,
+                         labeled_ids)
+        print("Resuming after {} iterations.".format(
+            checkpoint.completed_iterations))
+        rng = checkpoint.rng
+        checkpoint.restore_global_state()
+    statistics = checkpoint.statistics
+    store = SampleStore.create(directory, labeled_node_ids, clobber)
+    # Drop samples written after the last commit.
+    store.truncate(checkpoint.num_samples)
+    if checkpoint.completed_iterations == 0:
+        # Record the labeled nodes and random state before starting.
+        checkpoint.commit(directory, 0, 0)
     suppressor = ParentSuppressor(non_paternity, 0.0)
+    batch_starts = range(0, iterations, replicates)
+    batch_rngs = spawn(rng, len(batch_starts))
     print("Calculating shared lengths.")
-    for i in range(iterations):
-        print("iteration {}".format(i))
-        print("Cleaning genomes.")
-        population.clean_genomes()
-        # print("Perturbing parentage")
-        # suppressor.suppress(population)
-        print("Generating genomes")
-        generate_genomes(population, genome_generator, recombinators, 3,
-                         true_genealogy = False)
-        print("Calculating shared length")
-        _calculate_shared_to_fds(pairs, fds, min_segment_length)
-        # print("Fixing perturbation")
-        # suppressor.unsuppress()
-    for fd in fds.values():
-        fd.close()
-        
-def _calculate_shared_to_fds(pairs, fds, min_segment_length):
-    """
-    Calculate the shared length between the pairs, and store the
-    shared length in the given directory. Each labeled node has a file
-    in the given directory. The files contain tab separated entries,
-    where the first entry is the unlabeled node id, and the second
-    entry is the amount of shared material.
-    """
-    shared_iter = ((unlabeled, labeled,
-                    shared_segment_length_genomes(unlabeled.genome,
-                                                  labeled.genome,
-                                                  min_segment_length))
-                   for unlabeled, labeled in pairs)
-    # for unlabeled, labeled, (avg, count) in shared_iter:
-    for unlabeled, labeled, shared in shared_iter:
-        fd = fds[labeled]
-        # fd.write("{}\t{}\t{}\n".format(unlabeled._id, avg, count))
-        fd.write("{}\t{}\n".format(unlabeled._id, shared))
-
-def classifier_from_directory(directory, id_mapping):
-    distributions = distributions_from_directory(directory, id_mapping)
-    labeled_nodes = set(int(filename) for filename in listdir(directory))
+    with store:
+        for batch_start, batch_rng in zip(batch_starts, batch_rngs):
+            if batch_start < checkpoint.completed_iterations:
+                continue
+            batch_size = min(replicates, iterations - batch_start)
+            print("iterations {} to {}".format(batch_start,
+                                               batch_start + batch_size - 1))
+            # print("Perturbing parentage")
+            # suppressor.suppress(population)
+            print("Generating genomes")
+            # Founder ids only need to be distinct within a batch.
+            genome_generator.reset()
+            simulated = generate_genome_replicates(population, pair_nodes,
+                                                   genome_generator,
+                                                   recombinators, batch_size,
+                                                   true_genealogy = False,
+                                                   rng = batch_rng,
+                                                   founders = founders)
+            print("Calculating shared length")
+            lengths = simulated.shared_lengths(pairs, min_segment_length)
+            noise_rng, = spawn(batch_rng, 1)
+            statistics.add(lengths, noise_rng)
+            if keep_samples:
+                _append_shared(store, unlabeled_ids, labeled_ids, lengths,
+                               batch_start)
+                store.sync()
+            checkpoint.commit(directory, batch_start + batch_size,
+                              len(store))
+            # print("Fixing perturbation")
+            # suppressor.unsuppress()
+
+def _append_shared(store, unlabeled_ids, labeled_ids, lengths,
+                   first_iteration):
+    """
+    Append the shared lengths of the pairs with the given ids to
+    store, where lengths is a pairs x replicates matrix and replicate
+    k is iteration first_iteration + k. Every pair is written for one
+    replicate before the next replicate.
+    """
+    num_replicates = lengths.shape[1]
+    iterations = first_iteration + np.arange(num_replicates)
+    store.append(np.tile(unlabeled_ids, num_replicates),
+                 np.tile(labeled_ids, num_replicates),
+                 np.repeat(iterations, len(unlabeled_ids)),
+                 lengths.T.ravel())
+
+def classifier_from_directory(directory, id_mapping, rng = None,
+                              processes = 1):
+    distributions = distributions_from_directory(directory, id_mapping, rng,
+                                                 processes)
+    checkpoint = Checkpoint.load(directory)
+    if checkpoint is None:
+        labeled_nodes = set(SampleStore(directory).labeled_nodes)
+    else:
+        labeled_nodes = set(checkpoint.labeled_nodes)
     return LengthClassifier(distributions, labeled_nodes)
 
-def distributions_from_directory(directory, id_mapping):
+def distributions_from_directory(directory, id_mapping, rng = None,
+                                 processes = 1):
     """
     Calculate distributions from a directory created by
-    calculate_shared_to_directory.
+    calculate_shared_to_directory. If the directory has a checkpoint
+    the distributions are fit from its pair statistics, which is how
+    shared_to_directory and merge_shards leave every directory, and
+    rng is not used. If processes is more than 1, the pairs are fit
+    FIT_CHUNK_PAIRS at a time by a pool of that many processes, with
+    the same result as with one process.
+
+    Otherwise the directory holds samples without a checkpoint, a
+    legacy layout from before checkpoints, and the stored samples are
+    fit. The pairs are fit FIT_CHUNK_PAIRS at a time with
+    fit_hurdle_gamma_batch, in order of their ids. Each chunk is fit
+    with its own stream seeded from a seed drawn from rng, or from the
+    global np.random state if rng is None, and the chunk's index, so
+    the result does not depend on the order the samples are stored in.
+    If processes is more than 1, the chunks are fit by a pool of that
+    many processes, with the samples in shared memory. For the same
+    rng state, or global state, the result does not depend on the
+    number of processes.
     """
+    assert processes >= 1
+    checkpoint = Checkpoint.load(directory)
+    if checkpoint is not None:
+        if processes == 1:
+            return distributions_from_statistics(checkpoint.statistics,
+                                                 id_mapping)
+        with Pool(processes) as pool:
+            return distributions_from_statistics(checkpoint.statistics,
+                                                 id_mapping, pool)
+    # Drawn even without rng, so that forked workers do not all start
+    # from the same global state.
+    if rng is not None:
+        fit_seed = int(rng.integers(2 ** 63))
+    else:
+        fit_seed = int(np.random.randint(2 ** 63, dtype = np.uint64))
+    columns = SampleStore(directory).columns()
+    pair_keys = ((columns["labeled"].astype(np.uint64) << np.uint64(32)) |
+                 columns["unlabeled"].astype(np.uint64))
+    # A stable sort keeps the samples of each pair in the order they
+    # were written.
+    order = np.argsort(pair_keys, kind = "stable")
+    sorted_keys = pair_keys[order]
+    del pair_keys
+    if len(sorted_keys) == 0:
+        return dict()
+    boundaries = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+    group_starts = np.r_[0, boundaries]
+    group_stops = np.r_[boundaries, len(sorted_keys)]
+    group_keys = sorted_keys[group_starts]
+    del sorted_keys
+    group_unlabeled = (group_keys & np.uint64(0xFFFFFFFF)).tolist()
+    known = np.array([unlabeled in id_mapping
+                      for unlabeled in group_unlabeled], dtype = bool)
+    _warn_unknown(len(known) - np.count_nonzero(known))
+    groups = (group_keys[known], group_starts[known], group_stops[known])
+    if processes == 1:
+        lengths = columns["length"][order]
+        distributions = dict()
+        for chunk in range(_num_chunks(len(groups[0]))):
+            distributions.update(_fit_chunk(lengths, *groups, chunk,
+                                            fit_seed))
+        return distributions
+    with Pool(processes) as pool:
+        return _fit_pairs_parallel(pool, columns["length"], order, *groups,
+                                   fit_seed)
+
+def distributions_from_statistics(statistics, id_mapping, pool = None):
+    """
+    Returns a dict from (unlabeled, labeled) ids to the
+    HurdleGammaParams fit to the PairStatistics statistics, skipping
+    pairs whose unlabeled node is not in id_mapping. If a
+    multiprocessing pool is given, the pairs are fit FIT_CHUNK_PAIRS
+    at a time by its processes.
+    """
+    shapes, scales, zero_probs = statistics.fit(pool, FIT_CHUNK_PAIRS)
     distributions = dict()
-    for labeled_filename in listdir(directory):
-        lengths = defaultdict(list)
-        labeled = int(labeled_filename)
-        with open(join(directory, labeled_filename), "r") as labeled_file:
-            for line in labeled_file:
-                # If the program crashed, the output can be left in an
-                # inconsistent state.
-                try:
-                    unlabeled_id, shared_str = line.split("\t")
-                except ValueError:
-                    warn("Malformed line:\n{}".format(line), stacklevel = 0)
-                    continue
-                unlabeled = int(unlabeled_id)
-                if unlabeled not in id_mapping:
-                    error_string = "No such unlabeled node with id {}."
-                    warn(error_string.format(unlabeled_id), stacklevel = 0)
-                    continue
-                try:
-                    shared_float = float(shared_str)
-                except ValueError:
-                    error_string = "Error formatting value as float: {}."
-                    warn(error_string.format(shared_str), stacklevel = 0)
-                    continue
-                lengths[unlabeled].append(shared_float)
-        for unlabeled, lengths in lengths.items():
-            shape, scale, zero_prob = fit_hurdle_gamma(np.array(lengths,
-                                                                dtype = np.uint32))
-            if shape is None:
-                continue
-            params = HurdleGammaParams(shape, scale, zero_prob)
-            distributions[unlabeled, labeled] = params
+    unknown = 0
+    for unlabeled, labeled, shape, scale, zero_prob \
+        in zip(statistics.unlabeled.tolist(), statistics.labeled.tolist(),
+               shapes.tolist(), scales.tolist(), zero_probs.tolist()):
+        if unlabeled not in id_mapping:
+            unknown += 1
+            continue
+        if isnan(zero_prob):
+            continue
+        distributions[unlabeled, labeled] = HurdleGammaParams(shape, scale,
+                                                              zero_prob)
+    _warn_unknown(unknown)
+    return distributions
+
+def _warn_unknown(unknown):
+    if unknown > 0:
+        warn("Skipped {} pairs with unknown unlabeled nodes.".format(unknown),
+             stacklevel = 0)
+
+def _num_chunks(num_pairs):
+    return (num_pairs + FIT_CHUNK_PAIRS - 1) // FIT_CHUNK_PAIRS
+
+def _fit_chunk(lengths, keys, starts, stops, chunk, fit_seed):
+    """
+    Fits a hurdle gamma distribution to lengths[starts[i]:stops[i]]
+    for each i in the given chunk, returning a dict from
+    (unlabeled, labeled) ids to HurdleGammaParams. keys[i] holds the
+    labeled id in its upper 32 bits and the unlabeled id in its lower
+    32 bits. The chunk draws from a stream seeded by fit_seed and
+    chunk.
+    """
+    chunk_slice = slice(chunk * FIT_CHUNK_PAIRS,
+                        (chunk + 1) * FIT_CHUNK_PAIRS)
+    keys = keys[chunk_slice]
+    starts = starts[chunk_slice]
+    counts = stops[chunk_slice] - starts
+    offsets = np.zeros(len(counts) + 1, dtype = np.int64)
+    np.cumsum(counts, out = offsets[1:])
+    source_i = (np.repeat(starts - offsets[:-1], counts) +
+                np.arange(offsets[-1]))
+    chunk_rng = np.random.default_rng([fit_seed, chunk])
+    shapes, scales, zero_probs = fit_hurdle_gamma_batch(lengths[source_i],
+                                                        offsets, chunk_rng)
+    distributions = dict()
+    for key, shape, scale, zero_prob in zip(keys.tolist(), shapes.tolist(),
+                                            scales.tolist(),
+                                            zero_probs.tolist()):
+        if isnan(zero_prob):
+            continue
+        labeled = key >> 32
+        unlabeled = key & 0xFFFFFFFF
+        distributions[unlabeled, labeled] = HurdleGammaParams(shape, scale,
+                                                              zero_prob)
+    return distributions
+
+def _fit_pairs_parallel(pool, length_column, order, keys, starts, stops,
+                        fit_seed):
+    """
+    Fits every chunk of pairs with pool, returning the merged
+    distributions. The lengths are sorted into shared memory.
+    """
+    if len(keys) == 0:
+        return dict()
+    shared = SharedArrays()
+    try:
+        lengths = shared.create("lengths", len(order), length_column.dtype)
+        np.take(length_column, order, out = lengths)
+        del lengths
+        for name, array in (("keys", keys), ("starts", starts),
+                            ("stops", stops)):
+            shared.share(name, array)
+        tasks = [(shared.specs, chunk, fit_seed)
+                 for chunk in range(_num_chunks(len(keys)))]
+        distributions = dict()
+        for chunk_distributions in pool.imap_unordered(_fit_chunk_shared,
+                                                       tasks):
+            distributions.update(chunk_distributions)
+    finally:
+        shared.close(unlink = True)
+    return distributions
+
+def _fit_chunk_shared(task):
+    """
+    Pool worker that fits one chunk of pairs.
+    """
+    specs, chunk, fit_seed = task
+    shared = SharedArrays.attach(specs)
+    try:
+        arrays = shared.arrays
+        distributions = _fit_chunk(arrays["lengths"], arrays["keys"],
+                                   arrays["starts"], arrays["stops"], chunk,
+                                   fit_seed)
+        del arrays
+    finally:
+        shared.close()
     return distributions
     
 def shared_segment_length_genomes(genome_a, genome_b, minimum_length):
-    lengths = common_segment_lengths(genome_a, genome_b)
-    seg_lengths = (x for x in lengths if x >= minimum_length)
-    return sum(seg_lengths)
+    if not may_share_founder(genome_a, genome_b):
+        return 0
+    return shared_segment_length(genome_a, genome_b, minimum_length)
 
 def shared_stats_genomes(genome_a, genome_b, minimum_length):
-    lengths = [x for x in common_segment_lengths(genome_a, genome_b)
-               if x >= minimum_length]
-    num_segments = len(lengths)
+    if not may_share_founder(genome_a, genome_b):
+        return (0.0, 0)
+    total, num_segments, _ = shared_segment_stats(genome_a, genome_b,
+                                                  minimum_length)
     if num_segments == 0:
         return (0.0, 0)
-    return (sum(lengths) / num_segments, num_segments)
+    return (total / num_segments, num_segments)
     
 def _shared_segment_length(node_a, node_b, minimum_length):
     return shared_segment_length_genomes(node_a.genome, node_b.genome,
@@ -1,9 +1,12 @@
 """# cython: profile=True"""
 import numpy as np
 from array import array
+from collections import namedtuple
 
 cimport numpy as np
 cimport cython
+cimport openmp
+from cython.parallel cimport prange
 
 ### Non vectorized method for calculating common segment lengths.
 
@@ -86,6 +89,549 @@ cpdef list common_homolog_segments(homolog_a, homolog_b):
 
 
 
+### Founder sets, used to skip pairs that cannot share segments.
+
+def founder_set(*homologs):
+    """
+    Returns the founder set of the given homologs, a sorted uint32
+    array of the distinct founder ids in them. Two genomes whose
+    founder sets are disjoint cannot share any segments.
+    """
+    if len(homologs) == 0:
+        return np.empty(0, dtype = np.uint32)
+    return np.unique(np.concatenate([homolog.founder
+                                     for homolog in homologs])) \
+             .astype(np.uint32, copy = False)
+
+def pack_founder_sets(genomes):
+    """
+    Packs the founder sets of the given genomes into a tuple
+    (founders, founder_offsets), where the founder set of the i-th
+    genome is founders[founder_offsets[i]:founder_offsets[i + 1]],
+    for use with shared_segment_length_pairs.
+    """
+    sets = []
+    for genome in genomes:
+        if genome.founders is None:
+            sets.append(founder_set(genome.mother, genome.father))
+        else:
+            sets.append(genome.founders)
+    founder_offsets = np.zeros(len(sets) + 1, dtype = np.int64)
+    np.cumsum([len(founders) for founders in sets],
+              out = founder_offsets[1:])
+    if len(sets) == 0:
+        return (np.empty(0, dtype = np.uint32), founder_offsets)
+    return (np.concatenate(sets).astype(np.uint32, copy = False),
+            founder_offsets)
+
+def packed_founder_sets(founder, offsets):
+    """
+    Returns the founder sets of genomes packed as by pack_genomes,
+    packed as by pack_founder_sets.
+    """
+    founder = np.asarray(founder, dtype = np.uint64)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    num_genomes = (len(offsets) - 1) // 2
+    genome = np.repeat(np.arange(num_genomes, dtype = np.uint64),
+                       offsets[2::2] - offsets[:-1:2])
+    # Unique (genome, founder id) keys, sorted by genome and then id.
+    keys = np.unique((genome << np.uint64(32)) |
+                     founder[:offsets[2 * num_genomes]])
+    founder_offsets = np.zeros(num_genomes + 1, dtype = np.int64)
+    np.cumsum(np.bincount((keys >> np.uint64(32)).astype(np.int64),
+                          minlength = num_genomes),
+              out = founder_offsets[1:])
+    return ((keys & np.uint64(0xFFFFFFFF)).astype(np.uint32),
+            founder_offsets)
+
+def may_share_founder(genome_a, genome_b):
+    """
+    Returns False if the founder sets of the two genomes are disjoint,
+    so they cannot share any segments. Returns True if either genome
+    has no founder set.
+    """
+    founders_a = genome_a.founders
+    founders_b = genome_b.founders
+    if founders_a is None or founders_b is None:
+        return True
+    return _founders_overlap(founders_a, 0, founders_a.shape[0],
+                             founders_b, 0, founders_b.shape[0])
+
+# Merges the two sorted founder sets until a common id is found.
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _founders_overlap(const np.uint32_t[:] founders_a,
+                                   np.int64_t index_a, np.int64_t stop_a,
+                                   const np.uint32_t[:] founders_b,
+                                   np.int64_t index_b,
+                                   np.int64_t stop_b) noexcept nogil:
+    while index_a < stop_a and index_b < stop_b:
+        if founders_a[index_a] == founders_b[index_b]:
+            return True
+        if founders_a[index_a] < founders_b[index_b]:
+            index_a += 1
+        else:
+            index_b += 1
+    return False
+
+### Batched method for calculating shared lengths of one genome
+### against many.
+
+def pack_genomes(genomes):
+    """
+    Packs the given RecombGenomes into contiguous starts and founder
+    arrays. Returns a tuple (starts, founder, offsets), where the
+    mother homolog of the i-th genome occupies
+    starts[offsets[2 * i]:offsets[2 * i + 1]] and the father homolog
+    occupies starts[offsets[2 * i + 1]:offsets[2 * i + 2]], and likewise
+    for founder.
+    """
+    homologs = []
+    for genome in genomes:
+        homologs.append(genome.mother)
+        homologs.append(genome.father)
+    offsets = np.zeros(len(homologs) + 1, dtype = np.int64)
+    np.cumsum([len(homolog.starts) for homolog in homologs],
+              out = offsets[1:])
+    if len(homologs) == 0:
+        empty = np.empty(0, dtype = np.uint32)
+        return (empty, empty.copy(), offsets)
+    starts = np.concatenate([homolog.starts for homolog in homologs])
+    founder = np.concatenate([homolog.founder for homolog in homologs])
+    return (starts.astype(np.uint32, copy = False),
+            founder.astype(np.uint32, copy = False),
+            offsets)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def shared_segment_length_pairs(const np.uint32_t[:] starts,
+                                const np.uint32_t[:] founder,
+                                const np.int64_t[:] offsets,
+                                unsigned long end,
+                                const np.int64_t[:, :] pairs,
+                                unsigned long long minimum_length,
+                                int num_threads = 0,
+                                founder_sets = None):
+    """
+    Given genomes packed with pack_genomes (or the arrays of a
+    GenomeBank) and an n x 2 array of genome index pairs, returns an
+    array with the total length of shared segments at least
+    minimum_length long for each pair. The pairs are split across
+    num_threads threads, or all available cores if num_threads is 0.
+    If founder_sets, the genomes' founder sets packed as by
+    pack_founder_sets, is given, pairs with no founder in common are
+    skipped.
+    """
+    cdef bint check_founders = founder_sets is not None
+    cdef const np.uint32_t[:] founders = None
+    cdef const np.int64_t[:] founder_offsets = None
+    if check_founders:
+        founders, founder_offsets = founder_sets
+    cdef np.int64_t genome_a, genome_b
+    cdef Py_ssize_t num_pairs = pairs.shape[0]
+    _check_pairs(pairs, offsets)
+    cdef Py_ssize_t i
+    lengths = np.zeros(num_pairs, dtype = np.uint64)
+    cdef np.uint64_t[:] lengths_view = lengths
+    if num_threads <= 0:
+        num_threads = openmp.omp_get_max_threads()
+    for i in prange(num_pairs, nogil = True, schedule = "dynamic",
+                    num_threads = num_threads):
+        genome_a = pairs[i, 0]
+        genome_b = pairs[i, 1]
+        if check_founders and not _founders_overlap(
+                founders, founder_offsets[genome_a],
+                founder_offsets[genome_a + 1], founders,
+                founder_offsets[genome_b], founder_offsets[genome_b + 1]):
+            continue
+        lengths_view[i] = _shared_length_packed(starts, founder, offsets,
+                                                genome_a, genome_b,
+                                                end, minimum_length)
+    return lengths
+
+def _check_pairs(pairs, offsets):
+    """
+    Raises IndexError if any of the genome index pairs is out of range
+    for the packed genomes, as the pair kernels do no bounds checks.
+    """
+    num_genomes = (len(offsets) - 1) // 2
+    pairs = np.asarray(pairs)
+    if pairs.size > 0 and (pairs.min() < 0 or pairs.max() >= num_genomes):
+        raise IndexError("Pair index out of range for {} genomes."
+                         .format(num_genomes))
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef unsigned long long _shared_length_packed(const np.uint32_t[:] starts,
+                                              const np.uint32_t[:] founder,
+                                              const np.int64_t[:] offsets,
+                                              np.int64_t genome_a,
+                                              np.int64_t genome_b,
+                                              unsigned long end,
+                                              unsigned long long minimum_length) noexcept nogil:
+    """
+    Sums the shared length over the four homolog pairs of two packed
+    genomes.
+    """
+    cdef np.int64_t a_mother = offsets[2 * genome_a]
+    cdef np.int64_t a_father = offsets[2 * genome_a + 1]
+    cdef np.int64_t a_stop = offsets[2 * genome_a + 2]
+    cdef np.int64_t b_mother = offsets[2 * genome_b]
+    cdef np.int64_t b_father = offsets[2 * genome_b + 1]
+    cdef np.int64_t b_stop = offsets[2 * genome_b + 2]
+    return (_shared_length(starts, founder, a_mother, a_father,
+                           starts, founder, b_mother, b_father,
+                           end, minimum_length) +
+            _shared_length(starts, founder, a_father, a_stop,
+                           starts, founder, b_mother, b_father,
+                           end, minimum_length) +
+            _shared_length(starts, founder, a_mother, a_father,
+                           starts, founder, b_father, b_stop,
+                           end, minimum_length) +
+            _shared_length(starts, founder, a_father, a_stop,
+                           starts, founder, b_father, b_stop,
+                           end, minimum_length))
+
+# Totals of the shared segments at least minimum_length long, after
+# contiguous segments have been merged.
+cdef struct SharedStats:
+    unsigned long long total
+    unsigned long count
+    unsigned long long max_length
+
+def shared_segment_stats(genome_a, genome_b,
+                         unsigned long long minimum_length):
+    """
+    Given two genomes, returns a tuple (total length, number of
+    segments, length of longest segment) over shared segments at least
+    minimum_length long. Segments are the same as those given by
+    common_segment_lengths, but no intermediate lists are built.
+    """
+    cdef SharedStats stats
+    _genome_stats(genome_a, genome_b, minimum_length, &stats)
+    return (stats.total, stats.count, stats.max_length)
+
+def shared_segment_length(genome_a, genome_b,
+                          unsigned long long minimum_length):
+    """
+    Given two genomes, returns the total length of shared segments at
+    least minimum_length long.
+    """
+    cdef SharedStats stats
+    _genome_stats(genome_a, genome_b, minimum_length, &stats)
+    return stats.total
+
+cdef void _genome_stats(genome_a, genome_b,
+                        unsigned long long minimum_length,
+                        SharedStats *stats) except *:
+    cdef const np.uint32_t[:] a_mother_starts = genome_a.mother.starts
+    cdef const np.uint32_t[:] a_mother_founder = genome_a.mother.founder
+    cdef const np.uint32_t[:] a_father_starts = genome_a.father.starts
+    cdef const np.uint32_t[:] a_father_founder = genome_a.father.founder
+    cdef const np.uint32_t[:] b_mother_starts = genome_b.mother.starts
+    cdef const np.uint32_t[:] b_mother_founder = genome_b.mother.founder
+    cdef const np.uint32_t[:] b_father_starts = genome_b.father.starts
+    cdef const np.uint32_t[:] b_father_founder = genome_b.father.founder
+    cdef unsigned long end = genome_a.mother.end
+    stats.total = 0
+    stats.count = 0
+    stats.max_length = 0
+    _accumulate_shared(a_mother_starts, a_mother_founder,
+                       0, a_mother_starts.shape[0],
+                       b_mother_starts, b_mother_founder,
+                       0, b_mother_starts.shape[0],
+                       end, minimum_length, stats)
+    _accumulate_shared(a_father_starts, a_father_founder,
+                       0, a_father_starts.shape[0],
+                       b_mother_starts, b_mother_founder,
+                       0, b_mother_starts.shape[0],
+                       end, minimum_length, stats)
+    _accumulate_shared(a_mother_starts, a_mother_founder,
+                       0, a_mother_starts.shape[0],
+                       b_father_starts, b_father_founder,
+                       0, b_father_starts.shape[0],
+                       end, minimum_length, stats)
+    _accumulate_shared(a_father_starts, a_father_founder,
+                       0, a_father_starts.shape[0],
+                       b_father_starts, b_father_founder,
+                       0, b_father_starts.shape[0],
+                       end, minimum_length, stats)
+
+cdef unsigned long long _shared_length(const np.uint32_t[:] starts_a,
+                                       const np.uint32_t[:] founder_a,
+                                       Py_ssize_t index_a, Py_ssize_t len_a,
+                                       const np.uint32_t[:] starts_b,
+                                       const np.uint32_t[:] founder_b,
+                                       Py_ssize_t index_b, Py_ssize_t len_b,
+                                       unsigned long end,
+                                       unsigned long long minimum_length) noexcept nogil:
+    cdef SharedStats stats
+    stats.total = 0
+    stats.count = 0
+    stats.max_length = 0
+    _accumulate_shared(starts_a, founder_a, index_a, len_a,
+                       starts_b, founder_b, index_b, len_b,
+                       end, minimum_length, &stats)
+    return stats.total
+
+cdef inline void _add_segment(unsigned long long length,
+                              unsigned long long minimum_length,
+                              SharedStats *stats) noexcept nogil:
+    if length < minimum_length:
+        return
+    stats.total += length
+    stats.count += 1
+    if length > stats.max_length:
+        stats.max_length = length
+
+# Same walk as common_homolog_segments, but contiguous shared
+# segments are merged as they are found, and only their totals are
+# kept, so nothing is allocated. It does not need the GIL, so it can
+# be run from shared_segment_length_pairs' worker threads.
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _accumulate_shared(const np.uint32_t[:] starts_a,
+                             const np.uint32_t[:] founder_a,
+                             Py_ssize_t index_a, Py_ssize_t len_a,
+                             const np.uint32_t[:] starts_b,
+                             const np.uint32_t[:] founder_b,
+                             Py_ssize_t index_b, Py_ssize_t len_b,
+                             unsigned long end,
+                             unsigned long long minimum_length,
+                             SharedStats *stats) noexcept nogil:
+    cdef unsigned long a_start, a_stop, b_start, b_stop, start, stop
+    cdef unsigned long run_start = 0, run_stop = 0
+    cdef bint in_run = False
+    while index_a < len_a and index_b < len_b:
+        a_start = starts_a[index_a]
+        if index_a + 1 < len_a:
+            a_stop = starts_a[index_a + 1]
+        else:
+            a_stop = end
+        b_start = starts_b[index_b]
+        if index_b + 1 < len_b:
+            b_stop = starts_b[index_b + 1]
+        else:
+            b_stop = end
+        if founder_a[index_a] == founder_b[index_b]:
+            if a_start > b_start:
+                start = a_start
+            else:
+                start = b_start
+            if a_stop < b_stop:
+                stop = a_stop
+            else:
+                stop = b_stop
+            if in_run and run_stop == start:
+                run_stop = stop
+            else:
+                if in_run:
+                    _add_segment(run_stop - run_start, minimum_length, stats)
+                run_start = start
+                run_stop = stop
+                in_run = True
+        if a_stop == b_stop:
+            index_a += 1
+            index_b += 1
+        elif a_stop > b_stop:
+            index_b += 1
+        else:
+            index_a += 1
+    if in_run:
+        _add_segment(run_stop - run_start, minimum_length, stats)
+
+### Columnar output of shared segments.
+
+# Parallel arrays describing shared segments. pair is the index of the
+# pair of genomes the segment was found in, homolog_pair is
+# 2 * (homolog of the second genome) + (homolog of the first genome),
+# where 0 is the mother and 1 the father homolog, so the codes follow
+# the order used by common_segment_lengths. chromosome is the index
+# into chrom_starts of the segment's chromosome, or None if no
+# chromosome start offsets were given.
+SegmentColumns = namedtuple("SegmentColumns", ["pair", "start", "stop",
+                                               "homolog_pair",
+                                               "chromosome"])
+
+cdef struct SegmentOutput:
+    np.int64_t *pair
+    np.uint32_t *start
+    np.uint32_t *stop
+    np.uint8_t *homolog_pair
+    np.uint8_t *chromosome
+
+def common_segment_columns(genome_a, genome_b, chrom_starts = None):
+    """
+    Given two genomes returns a SegmentColumns with the segments they
+    share. If chrom_starts, the sorted start offsets of the
+    chromosomes (see recomb_genome.chromosome_starts), is given,
+    segments are labeled with their chromosome and are not merged
+    across chromosome boundaries. Otherwise the segments are the same
+    as those given by common_segment_lengths.
+    """
+    starts, founder, offsets = pack_genomes([genome_a, genome_b])
+    pairs = np.array([[0, 1]], dtype = np.int64)
+    return common_segment_columns_pairs(starts, founder, offsets,
+                                        genome_a.mother.end, pairs,
+                                        chrom_starts)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def common_segment_columns_pairs(const np.uint32_t[:] starts,
+                                 const np.uint32_t[:] founder,
+                                 const np.int64_t[:] offsets,
+                                 unsigned long end,
+                                 const np.int64_t[:, :] pairs,
+                                 chrom_starts = None):
+    """
+    Given genomes packed with pack_genomes (or the arrays of a
+    GenomeBank) and an n x 2 array of genome index pairs, returns a
+    SegmentColumns with the segments shared by every pair. See
+    common_segment_columns for chrom_starts.
+    """
+    cdef const np.uint32_t[:] chroms
+    cdef bint use_chroms = chrom_starts is not None
+    if use_chroms:
+        chroms = np.asarray(chrom_starts, dtype = np.uint32)
+    else:
+        chroms = np.zeros(1, dtype = np.uint32)
+    cdef Py_ssize_t i, count = 0
+    _check_pairs(pairs, offsets)
+    # Count the segments, then walk again filling in the columns.
+    for i in range(pairs.shape[0]):
+        count = _pair_segments(starts, founder, offsets, end, pairs, i,
+                               chroms, use_chroms, NULL, count)
+    pair = np.empty(count, dtype = np.int64)
+    start = np.empty(count, dtype = np.uint32)
+    stop = np.empty(count, dtype = np.uint32)
+    homolog_pair = np.empty(count, dtype = np.uint8)
+    chromosome = np.empty(count, dtype = np.uint8)
+    cdef np.int64_t[:] pair_view = pair
+    cdef np.uint32_t[:] start_view = start
+    cdef np.uint32_t[:] stop_view = stop
+    cdef np.uint8_t[:] homolog_pair_view = homolog_pair
+    cdef np.uint8_t[:] chromosome_view = chromosome
+    cdef SegmentOutput output
+    if count > 0:
+        output.pair = &pair_view[0]
+        output.start = &start_view[0]
+        output.stop = &stop_view[0]
+        output.homolog_pair = &homolog_pair_view[0]
+        output.chromosome = &chromosome_view[0]
+        count = 0
+        for i in range(pairs.shape[0]):
+            count = _pair_segments(starts, founder, offsets, end, pairs, i,
+                                   chroms, use_chroms, &output, count)
+    if not use_chroms:
+        chromosome = None
+    return SegmentColumns(pair, start, stop, homolog_pair, chromosome)
+
+cdef Py_ssize_t _pair_segments(const np.uint32_t[:] starts,
+                               const np.uint32_t[:] founder,
+                               const np.int64_t[:] offsets,
+                               unsigned long end,
+                               const np.int64_t[:, :] pairs,
+                               Py_ssize_t pair_i,
+                               const np.uint32_t[:] chroms,
+                               bint use_chroms,
+                               SegmentOutput *output,
+                               Py_ssize_t out_i) noexcept nogil:
+    cdef np.int64_t genome_a = pairs[pair_i, 0]
+    cdef np.int64_t genome_b = pairs[pair_i, 1]
+    cdef np.int64_t homolog_a, homolog_b
+    cdef np.uint8_t code
+    for code in range(4):
+        homolog_a = 2 * genome_a + (code & 1)
+        homolog_b = 2 * genome_b + (code >> 1)
+        out_i = _segment_walk(starts, founder,
+                              offsets[homolog_a], offsets[homolog_a + 1],
+                              offsets[homolog_b], offsets[homolog_b + 1],
+                              end, chroms, use_chroms, pair_i, code,
+                              output, out_i)
+    return out_i
+
+# Same walk as _accumulate_shared, but the merged segments are written
+# to output starting at out_i, or only counted if output is NULL.
+# Returns the index after the last segment.
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _segment_walk(const np.uint32_t[:] starts,
+                              const np.uint32_t[:] founder,
+                              Py_ssize_t index_a, Py_ssize_t len_a,
+                              Py_ssize_t index_b, Py_ssize_t len_b,
+                              unsigned long end,
+                              const np.uint32_t[:] chroms,
+                              bint use_chroms,
+                              Py_ssize_t pair_i,
+                              np.uint8_t code,
+                              SegmentOutput *output,
+                              Py_ssize_t out_i) noexcept nogil:
+    cdef unsigned long a_start, a_stop, b_start, b_stop, start, stop
+    cdef unsigned long run_start = 0, run_stop = 0
+    cdef Py_ssize_t chrom = 0, run_chrom = 0
+    cdef Py_ssize_t num_chroms = chroms.shape[0]
+    cdef bint in_run = False
+    cdef bint boundary
+    while index_a < len_a and index_b < len_b:
+        a_start = starts[index_a]
+        if index_a + 1 < len_a:
+            a_stop = starts[index_a + 1]
+        else:
+            a_stop = end
+        b_start = starts[index_b]
+        if index_b + 1 < len_b:
+            b_stop = starts[index_b + 1]
+        else:
+            b_stop = end
+        if founder[index_a] == founder[index_b]:
+            if a_start > b_start:
+                start = a_start
+            else:
+                start = b_start
+            if a_stop < b_stop:
+                stop = a_stop
+            else:
+                stop = b_stop
+            boundary = False
+            if use_chroms:
+                while chrom + 1 < num_chroms and chroms[chrom + 1] <= start:
+                    chrom += 1
+                boundary = chroms[chrom] == start
+            if in_run and run_stop == start and not boundary:
+                run_stop = stop
+            else:
+                if in_run:
+                    out_i = _write_segment(output, out_i, pair_i, run_start,
+                                           run_stop, code, run_chrom)
+                run_start = start
+                run_stop = stop
+                run_chrom = chrom
+                in_run = True
+        if a_stop == b_stop:
+            index_a += 1
+            index_b += 1
+        elif a_stop > b_stop:
+            index_b += 1
+        else:
+            index_a += 1
+    if in_run:
+        out_i = _write_segment(output, out_i, pair_i, run_start, run_stop,
+                               code, run_chrom)
+    return out_i
+
+cdef inline Py_ssize_t _write_segment(SegmentOutput *output, Py_ssize_t out_i,
+                                      Py_ssize_t pair_i,
+                                      unsigned long start, unsigned long stop,
+                                      np.uint8_t code,
+                                      Py_ssize_t chrom) noexcept nogil:
+    if output != NULL:
+        output.pair[out_i] = pair_i
+        output.start[out_i] = start
+        output.stop[out_i] = stop
+        output.homolog_pair[out_i] = code
+        output.chromosome[out_i] = chrom
+    return out_i + 1
+
 cdef list _lengths(list segments):
     """
     Takes a list of segments and returns a list of lengths.
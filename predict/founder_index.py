@@ -0,0 +1,139 @@
+import numpy as np
+
+from common_segments import pack_genomes
+
+class FounderIndex:
+    """
+    Inverted index from founder id to the (genome, start, stop)
+    intervals carrying that founder's material, across a collection
+    of packed genomes.
+
+    Comparing one genome against the whole collection only looks at
+    intervals of founders the genome carries, so the work done is
+    proportional to the amount of actual sharing rather than to the
+    size of the collection.
+    """
+    def __init__(self, starts, founder, offsets, end):
+        """
+        Takes genomes packed with pack_genomes, or the arrays of a
+        GenomeBank, in which case genome indices are node ids.
+        """
+        num_homologs = len(offsets) - 1
+        self._num_genomes = num_homologs // 2
+        self._end = end
+        homolog_lengths = np.diff(offsets)
+        homolog = np.repeat(np.arange(num_homologs, dtype = np.int64),
+                            homolog_lengths)
+        starts = np.asarray(starts, dtype = np.uint64)
+        # Each interval stops where the next one in its homolog
+        # starts, or at the end of the genome.
+        stops = np.empty_like(starts)
+        stops[:-1] = starts[1:]
+        last_i = offsets[1:][homolog_lengths > 0] - 1
+        stops[last_i] = end
+
+        founder = np.asarray(founder, dtype = np.uint64)
+        sort_i = np.lexsort((starts, founder))
+        self._keys = (founder[sort_i] << np.uint64(32)) | starts[sort_i]
+        self._starts = starts[sort_i]
+        self._stops = stops[sort_i]
+        self._homolog = homolog[sort_i]
+
+        # The longest interval of each founder bounds how far before a
+        # query interval an overlapping interval can start.
+        founder = founder[sort_i]
+        new_block = np.ones(len(founder), dtype = np.bool_)
+        new_block[1:] = founder[1:] != founder[:-1]
+        block_starts = np.flatnonzero(new_block)
+        self._block_founders = founder[block_starts]
+        if len(block_starts) > 0:
+            self._block_max_length = np.maximum.reduceat(self._stops -
+                                                         self._starts,
+                                                         block_starts)
+        else:
+            self._block_max_length = np.empty(0, dtype = np.uint64)
+
+    def shared_lengths(self, genome, minimum_length):
+        """
+        Returns an array with the total length of shared segments at
+        least minimum_length long between genome and each indexed
+        genome. Gives the same values as shared_segment_length with
+        each indexed genome.
+        """
+        lengths = np.zeros(self._num_genomes, dtype = np.uint64)
+        if len(self._keys) == 0:
+            return lengths
+        overlaps = [self._overlaps(homolog, query_homolog)
+                    for query_homolog, homolog
+                    in enumerate((genome.mother, genome.father))]
+        group = np.concatenate([overlap[0] for overlap in overlaps])
+        starts = np.concatenate([overlap[1] for overlap in overlaps])
+        stops = np.concatenate([overlap[2] for overlap in overlaps])
+        if len(group) == 0:
+            return lengths
+        # Merge contiguous segments within each (indexed homolog,
+        # query homolog) pair before applying minimum_length, the
+        # same as common_homolog_segments does.
+        sort_i = np.lexsort((starts, group))
+        group = group[sort_i]
+        starts = starts[sort_i]
+        stops = stops[sort_i]
+        new_run = np.ones(len(group), dtype = np.bool_)
+        new_run[1:] = ((group[1:] != group[:-1]) |
+                       (starts[1:] != stops[:-1]))
+        run_i = np.flatnonzero(new_run)
+        run_lengths = np.add.reduceat(stops - starts, run_i)
+        keep = run_lengths >= minimum_length
+        # group is 2 * indexed homolog + query homolog, and the indexed
+        # homolog is 2 * genome + mother/father.
+        run_genomes = group[run_i][keep] // 4
+        np.add.at(lengths, run_genomes, run_lengths[keep])
+        return lengths
+
+    def _overlaps(self, homolog, query_homolog):
+        """
+        Returns arrays (group, start, stop) of the overlap between
+        each interval of the given homolog and the indexed intervals
+        with the same founder.
+        """
+        query_starts = np.asarray(homolog.starts, dtype = np.uint64)
+        query_stops = np.empty_like(query_starts)
+        query_stops[:-1] = query_starts[1:]
+        query_stops[-1] = self._end
+        query_founder = np.asarray(homolog.founder, dtype = np.uint64)
+
+        block_i = np.searchsorted(self._block_founders, query_founder)
+        block_i[block_i == len(self._block_founders)] = 0
+        present = self._block_founders[block_i] == query_founder
+        max_length = np.where(present, self._block_max_length[block_i], 0)
+        earliest = np.where(query_starts > max_length,
+                            query_starts - max_length, 0)
+        query_keys = query_founder << np.uint64(32)
+        low = np.searchsorted(self._keys, query_keys | earliest)
+        high = np.searchsorted(self._keys, query_keys | query_stops)
+        counts = np.where(present, high - low, 0)
+
+        query_i = np.repeat(np.arange(len(counts)), counts)
+        run_starts = np.cumsum(counts) - counts
+        index_i = (np.arange(counts.sum()) - np.repeat(run_starts, counts) +
+                   np.repeat(low, counts))
+        overlapping = self._stops[index_i] > query_starts[query_i]
+        query_i = query_i[overlapping]
+        index_i = index_i[overlapping]
+        starts = np.maximum(self._starts[index_i], query_starts[query_i])
+        stops = np.minimum(self._stops[index_i], query_stops[query_i])
+        group = 2 * self._homolog[index_i] + query_homolog
+        return (group, starts, stops)
+
+def founder_index_from_genomes(genomes):
+    """
+    Returns a FounderIndex over the given genomes, which are indexed
+    in the order given.
+    """
+    genomes = list(genomes)
+    starts, founder, offsets = pack_genomes(genomes)
+    if len(genomes) > 0:
+        end = genomes[0].mother.end
+    else:
+        end = 0
+    return FounderIndex(starts, founder, offsets, end)
@@ -5,19 +5,23 @@ from warnings import warn
 import numpy as np
 from scipy.special import digamma, polygamma
 
+from random_streams import numpy_random
+
 SUFFICIENT_DATA_POINTS = 5
 
 
-def fit_gamma(data):
+def fit_gamma(data, rng = None):
     """
     Gamma parameter estimation using the algorithm described in
     http://research.microsoft.com/en-us/um/people/minka/papers/minka-gamma.pdf
     Returns a tuple with (shape, scale) parameters.
+    The noise added to data is drawn from the numpy Generator rng, or
+    the global np.random state if rng is None.
     """
     # data += 1e-8 # Add small number to avoid 0s in the data causing issues.
     # Add small amount of noise to avoid 0s in the data causing issues
     # or all values being identical causing issues.
-    data += np.random.uniform(1e-8, 10000, len(data))
+    data += numpy_random(rng).uniform(1e-8, 10000, len(data))
     data_mean = np.mean(data)
     log_of_mean = log(data_mean)
     mean_of_logs = np.mean(np.log(data))
@@ -35,7 +39,12 @@ def fit_gamma(data):
         shape_reciprocal = tmp_shape_reciprocal
     return (shape, data_mean / shape)
 
-def fit_hurdle_gamma(data):
+def fit_hurdle_gamma(data, rng = None):
+    """
+    Fits a hurdle gamma distribution to data. Returns a tuple with
+    (shape, scale, zero probability) parameters, or a tuple of None
+    if there are too few nonzero values. rng is as for fit_gamma.
+    """
     nonzero = data != 0
     num_nonzero = np.sum(nonzero)
     num_zero = len(data) - num_nonzero
@@ -47,7 +56,7 @@ def fit_hurdle_gamma(data):
     # data += 1e-8 # Add small number to avoid 0s in the data causing issues.
     # Add small amount of noise to avoid 0s in the data causing issues
     # or all values being identical causing issues.
-    data += np.random.uniform(1e-8, 10000, len(data))
+    data += numpy_random(rng).uniform(1e-8, 10000, len(data))
     data_mean = np.mean(data)
     log_of_mean = log(data_mean)
     mean_of_logs = np.mean(np.log(data))
@@ -67,3 +76,82 @@ def fit_hurdle_gamma(data):
     if isnan(shape) or isnan(scale):
         warn("NaN shape or scale value")
     return (shape, scale, prob_zero)
+
+def hurdle_gamma_statistics(values, offsets, rng = None):
+    """
+    Returns the sufficient statistics of a hurdle gamma distribution
+    for each of a ragged collection of samples, where sample i is
+    values[offsets[i]:offsets[i + 1]]. The result is a tuple of arrays
+    (counts, zero counts, sums, sums of logs), where the sums are over
+    the nonzero values. As in fit_hurdle_gamma, noise drawn from rng
+    is added to the nonzero values first.
+    """
+    offsets = np.asarray(offsets, dtype = np.int64)
+    num_samples = len(offsets) - 1
+    counts = np.diff(offsets)
+    sample_ids = np.repeat(np.arange(num_samples), counts)
+    nonzero = values != 0
+    nonzero_ids = sample_ids[nonzero]
+    data = np.array(values[nonzero], dtype = np.float64)
+    data += numpy_random(rng).uniform(1e-8, 10000, len(data))
+    nonzero_counts = np.bincount(nonzero_ids, minlength = num_samples)
+    sums = np.bincount(nonzero_ids, data, minlength = num_samples)
+    log_sums = np.bincount(nonzero_ids, np.log(data),
+                           minlength = num_samples)
+    return (counts, counts - nonzero_counts, sums, log_sums)
+
+def fit_hurdle_gamma_statistics(counts, zero_counts, sums, log_sums):
+    """
+    Fits hurdle gamma distributions to samples with the statistics
+    returned by hurdle_gamma_statistics, running the iteration of
+    fit_gamma for every sample at once. Returns a tuple of arrays
+    (shape, scale, zero probability), which are NaN for samples with
+    too few nonzero values.
+    """
+    counts = np.asarray(counts, dtype = np.float64)
+    num_nonzero = counts - zero_counts
+    sufficient = num_nonzero > SUFFICIENT_DATA_POINTS
+    shape = np.full(len(counts), np.nan)
+    scale = np.full(len(counts), np.nan)
+    prob_zero = np.full(len(counts), np.nan)
+    prob_zero[sufficient] = (np.asarray(zero_counts)[sufficient] /
+                             counts[sufficient])
+    num_nonzero = num_nonzero[sufficient]
+    data_mean = np.asarray(sums)[sufficient] / num_nonzero
+    log_of_mean = np.log(data_mean)
+    mean_of_logs = np.asarray(log_sums)[sufficient] / num_nonzero
+    log_diff = mean_of_logs - log_of_mean
+    fit_shape = 0.5 / (log_of_mean - mean_of_logs)
+    shape_reciprocal = 1 / fit_shape
+    # Indices of the samples still iterating.
+    active = np.arange(len(fit_shape))
+    while len(active) > 0:
+        active_shape = fit_shape[active]
+        active_reciprocal = shape_reciprocal[active]
+        numerator = (log_diff[active] + np.log(active_shape) -
+                     digamma(active_shape))
+        denominator = ((active_shape ** 2) *
+                       (active_reciprocal - polygamma(1, active_shape)))
+        tmp_shape_reciprocal = active_reciprocal + numerator / denominator
+        tmp_shape = 1 / tmp_shape_reciprocal
+        difference = np.abs(tmp_shape - active_shape)
+        fit_shape[active] = tmp_shape
+        shape_reciprocal[active] = tmp_shape_reciprocal
+        # NaN differences stop, as in fit_gamma.
+        active = active[difference > 0.000005]
+    shape[sufficient] = fit_shape
+    scale[sufficient] = data_mean / fit_shape
+    if np.any(np.isnan(shape[sufficient]) | np.isnan(scale[sufficient])):
+        warn("NaN shape or scale value")
+    return (shape, scale, prob_zero)
+
+def fit_hurdle_gamma_batch(values, offsets, rng = None):
+    """
+    Same as calling fit_hurdle_gamma on values[offsets[i]:offsets[i + 1]]
+    for every i, but vectorized over the samples. Returns a tuple of
+    arrays (shape, scale, zero probability), which are NaN where
+    fit_hurdle_gamma would return None.
+    """
+    return fit_hurdle_gamma_statistics(*hurdle_gamma_statistics(values,
+                                                                 offsets,
+                                                                 rng))
@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
-from random import choice
 from pickle import dump, HIGHEST_PROTOCOL
 
 from population import HierarchicalIslandPopulation
 from population_genomes import generate_genomes
+from genome_bank import bank_population_genomes
 from node import NodeGenerator
 from recomb_genome import recombinators_from_directory, RecombGenomeGenerator
 from island_model import tree_from_file
+from random_streams import make_rng, spawn, choice
 from sex import Sex
 
 def isclose(a, b, rel_tol=1e-09, abs_tol=0.0):
@@ -42,6 +43,10 @@ parser.add_argument("--missing_father", "-mf", type = float, default = 0,
 parser.add_argument("--multi_partner_prob", "-m", default = "1.0",
                     help = "Break down on number of partners people will have on average. Comma separated list of numbers between 0 and 1. First number the number of people who have 1 partner, next is 2 partners, etc. Numbers should sum up to 1.")
 
+parser.add_argument("--seed", type = int, default = None,
+                    help = "Seed for the population and genomes. Runs with the same seed produce the same population, whatever the number of processes.")
+parser.add_argument("--processes", type = int, default = 1,
+                    help = "Number of processes to generate genomes with.")
 parser.add_argument("--output_file", default = "population.pickle",
                     help = "Outputs a pickle file containing a Population object to this file. This file will be clobbered if it exists.")
 
@@ -61,23 +66,30 @@ if not isclose(sum(multi_partner_prob), 1.0):
 
 cond_probs = conditionalize_partner_probs(multi_partner_prob)
 
+# The founders, each later generation and the genomes draw from their
+# own streams. Without a seed the global random state is used.
+founder_rng, population_rng, genome_rng = spawn(make_rng(args.seed), 3)
+generation_rngs = spawn(population_rng, args.num_generations - 1)
+
 node_generator = NodeGenerator()
 print("Generating founders")
-founders = [node_generator.generate_node() for _ in range(args.generation_size)]
+founders = [node_generator.generate_node(rng = founder_rng)
+            for _ in range(args.generation_size)]
 
 tree = tree_from_file(args.tree_file)
 leaves = tree.leaves
 for person in founders:
-    tree.add_individual(choice(leaves), person)
+    tree.add_individual(choice(leaves, founder_rng), person)
 population = HierarchicalIslandPopulation(tree)
 
 print("Adding more generations")
-for _ in range(args.num_generations - 1):
+for generation_rng in generation_rngs:
     population.new_generation(non_paternity_rate = args.non_paternity,
                               adoption_rate = args.adoption,
                               multi_partner_probs = cond_probs,
                               unknown_mother_rate = args.missing_mother,
-                              unknown_father_rate = args.missing_father)
+                              unknown_father_rate = args.missing_father,
+                              rng = generation_rng)
 
 if not args.no_genomes:
     print("Loading recombination rates")
@@ -85,7 +97,11 @@ if not args.no_genomes:
     chrom_sizes = recombinators[Sex.Male]._num_bases
     genome_generator = RecombGenomeGenerator(chrom_sizes)
     print("Generating genomes")
-    generate_genomes(population, genome_generator, recombinators, 3)
+    generate_genomes(population, genome_generator, recombinators, 3,
+                     batch = True, processes = args.processes,
+                     rng = genome_rng)
+    # Store the genomes contiguously rather than as per node arrays.
+    bank_population_genomes(population)
 
 if args.output_file:
     with open(args.output_file, "wb") as pickle_file:
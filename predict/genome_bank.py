@@ -0,0 +1,197 @@
+import numpy as np
+
+from diploid import Diploid
+from common_segments import pack_founder_sets, packed_founder_sets
+from recomb_genome import RecombGenome
+
+# Stands in for nodes without a genome, which have an empty founder set.
+_NO_GENOME = RecombGenome(None, None, np.empty(0, dtype = np.uint32))
+
+class GenomeBank:
+    """
+    Stores the genomes of a population in contiguous arrays, rather
+    than as separate starts and founder arrays for every homolog.
+
+    The homologs are stored in compressed sparse row form. The mother
+    homolog of node i occupies starts[offsets[2 * i]:offsets[2 * i + 1]]
+    and the father homolog occupies
+    starts[offsets[2 * i + 1]:offsets[2 * i + 2]], and likewise for
+    founder. Nodes without a genome have empty homologs. The founder
+    set of node i is founders[founder_offsets[i]:founder_offsets[i + 1]],
+    empty for nodes without a genome.
+    """
+    def __init__(self, genomes):
+        """
+        genomes is a dict mapping node id to a RecombGenome.
+        """
+        if len(genomes) > 0:
+            size = max(genomes.keys()) + 1
+            self._end = next(iter(genomes.values())).mother.end
+        else:
+            size = 0
+            self._end = 0
+        lengths = np.zeros(2 * size, dtype = np.int64)
+        for node_id, genome in genomes.items():
+            lengths[2 * node_id] = len(genome.mother.starts)
+            lengths[2 * node_id + 1] = len(genome.father.starts)
+        offsets = np.zeros(2 * size + 1, dtype = np.int64)
+        np.cumsum(lengths, out = offsets[1:])
+        starts = np.empty(offsets[-1], dtype = np.uint32)
+        founder = np.empty(offsets[-1], dtype = np.uint32)
+        for node_id, genome in genomes.items():
+            for homolog_i, homolog in ((2 * node_id, genome.mother),
+                                       (2 * node_id + 1, genome.father)):
+                start = offsets[homolog_i]
+                stop = offsets[homolog_i + 1]
+                starts[start:stop] = homolog.starts
+                founder[start:stop] = homolog.founder
+        self._starts = starts
+        self._founder = founder
+        self._offsets = offsets
+        self._founders, self._founder_offsets \
+            = pack_founder_sets(genomes.get(node_id, _NO_GENOME)
+                                for node_id in range(size))
+        self._has_genome = np.zeros(size, dtype = np.bool_)
+        self._has_genome[list(genomes.keys())] = True
+
+    @classmethod
+    def from_packed(cls, starts, founder, offsets, end):
+        """
+        Returns a bank of genomes packed as by pack_genomes, using the
+        given arrays, where packed genome i is node i. Founder sets
+        are computed when first needed.
+        """
+        bank = cls.__new__(cls)
+        bank._end = end
+        bank._starts = starts
+        bank._founder = founder
+        bank._offsets = offsets
+        bank._founders = None
+        bank._founder_offsets = None
+        bank._has_genome = np.ones((len(offsets) - 1) // 2, dtype = np.bool_)
+        return bank
+
+    def __contains__(self, node_id):
+        return (0 <= node_id < len(self._has_genome) and
+                self._has_genome[node_id])
+
+    def __len__(self):
+        return int(np.sum(self._has_genome))
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def starts(self):
+        return self._starts
+
+    @property
+    def founder(self):
+        return self._founder
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def founder_sets(self):
+        """
+        The founder sets of the nodes, as a tuple (founders,
+        founder_offsets) for shared_segment_length_pairs.
+        """
+        if self._founders is None:
+            self._founders, self._founder_offsets \
+                = packed_founder_sets(self._founder, self._offsets)
+        return (self._founders, self._founder_offsets)
+
+    def founders(self, node_id):
+        founders, founder_offsets = self.founder_sets
+        return founders[founder_offsets[node_id]:founder_offsets[node_id + 1]]
+
+    def homolog(self, homolog_i):
+        """
+        Returns a Diploid whose arrays are views into this bank.
+        """
+        start = self._offsets[homolog_i]
+        stop = self._offsets[homolog_i + 1]
+        return Diploid(self._starts[start:stop], self._end,
+                       self._founder[start:stop])
+
+    def genome(self, node_id):
+        """
+        Returns a GenomeView for the given node id.
+        """
+        assert node_id in self, "No genome for node {}".format(node_id)
+        return GenomeView(self, node_id)
+
+class GenomeView:
+    """
+    A lightweight stand in for RecombGenome backed by a GenomeBank.
+    The mother and father Diploids are only created when accessed.
+    """
+    __slots__ = ("_bank", "_node_id")
+
+    def __init__(self, bank, node_id):
+        self._bank = bank
+        self._node_id = node_id
+
+    @property
+    def bank(self):
+        return self._bank
+
+    @property
+    def node_id(self):
+        return self._node_id
+
+    @property
+    def mother(self):
+        return self._bank.homolog(2 * self._node_id)
+
+    @property
+    def father(self):
+        return self._bank.homolog(2 * self._node_id + 1)
+
+    @property
+    def founders(self):
+        return self._bank.founders(self._node_id)
+
+    def __iter__(self):
+        yield self.mother
+        yield self.father
+
+    def __getstate__(self):
+        return (self._bank, self._node_id)
+
+    def __setstate__(self, state):
+        self._bank, self._node_id = state
+
+def bank_population_genomes(population):
+    """
+    Moves the genomes of population into a single GenomeBank, and
+    replaces each node's genome with a view into that bank. Returns
+    the bank.
+    """
+    genomes = {node._id: node.genome for node in population.members
+               if node.genome is not None}
+    bank = GenomeBank(genomes)
+    for node in population.members:
+        if node.genome is not None:
+            node.genome = bank.genome(node._id)
+    return bank
+
+def take_genomes(starts, founder, offsets, indices):
+    """
+    Returns the genomes with the given indices out of genomes packed
+    as by pack_genomes, packed the same way.
+    """
+    indices = np.asarray(indices, dtype = np.int64)
+    homologs = np.empty(2 * len(indices), dtype = np.int64)
+    homologs[0::2] = 2 * indices
+    homologs[1::2] = 2 * indices + 1
+    lengths = offsets[homologs + 1] - offsets[homologs]
+    new_offsets = np.zeros(len(homologs) + 1, dtype = np.int64)
+    np.cumsum(lengths, out = new_offsets[1:])
+    source_i = (np.repeat(offsets[homologs] - new_offsets[:-1], lengths) +
+                np.arange(new_offsets[-1]))
+    return (starts[source_i], founder[source_i], new_offsets)
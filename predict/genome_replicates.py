@@ -0,0 +1,225 @@
+from collections import Counter
+
+import numpy as np
+
+from sex import Sex
+from common_segments import packed_founder_sets, shared_segment_length_pairs
+from genome_bank import take_genomes
+from population_genomes import mate_packed, ancestral_closure, _parents
+from random_streams import spawn
+
+class GenomeReplicates:
+    """
+    A number of independent genome replicates for each of a list of
+    nodes, packed as by pack_genomes. Replicate k of nodes[i] is
+    packed genome i * replicates + k.
+    """
+    def __init__(self, nodes, replicates, starts, founder, offsets, end):
+        self._nodes = list(nodes)
+        self._node_index = {node: i for i, node in enumerate(self._nodes)}
+        self._replicates = replicates
+        self._starts = starts
+        self._founder = founder
+        self._offsets = offsets
+        self._end = end
+        self._founder_sets = None
+
+    @property
+    def nodes(self):
+        return list(self._nodes)
+
+    @property
+    def replicates(self):
+        return self._replicates
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def starts(self):
+        return self._starts
+
+    @property
+    def founder(self):
+        return self._founder
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    def index(self, node, replicate = 0):
+        """
+        Returns the packed genome index of the given replicate of node.
+        """
+        assert 0 <= replicate < self._replicates
+        return self._node_index[node] * self._replicates + replicate
+
+    def shared_lengths(self, pairs, minimum_length, num_threads = 0):
+        """
+        Returns a len(pairs) x replicates matrix, where entry (i, k) is
+        the total length of shared segments at least minimum_length
+        long between replicate k of both nodes of pairs[i].
+        Replicates of different nodes are only compared to the same
+        replicate, as they come from the same simulated population.
+        """
+        if self._founder_sets is None:
+            self._founder_sets = packed_founder_sets(self._founder,
+                                                     self._offsets)
+        node_a = np.array([self._node_index[a] for a, _ in pairs],
+                          dtype = np.int64)
+        node_b = np.array([self._node_index[b] for _, b in pairs],
+                          dtype = np.int64)
+        genome_pairs = np.empty((len(pairs), self._replicates, 2),
+                                dtype = np.int64)
+        genome_pairs[:, :, 0] = _genome_indices(node_a, self._replicates) \
+            .reshape(-1, self._replicates)
+        genome_pairs[:, :, 1] = _genome_indices(node_b, self._replicates) \
+            .reshape(-1, self._replicates)
+        lengths = shared_segment_length_pairs(self._starts, self._founder,
+                                              self._offsets, self._end,
+                                              genome_pairs.reshape(-1, 2),
+                                              minimum_length, num_threads,
+                                              self._founder_sets)
+        return lengths.reshape(len(pairs), self._replicates)
+
+def concatenate_genomes(*packed):
+    """
+    Concatenates tuples (starts, founder, offsets) of packed genomes.
+    """
+    starts = np.concatenate([genomes[0] for genomes in packed])
+    founder = np.concatenate([genomes[1] for genomes in packed])
+    offset_parts = [np.zeros(1, dtype = np.int64)]
+    total = 0
+    for genomes in packed:
+        offset_parts.append(genomes[2][1:] + total)
+        total += genomes[2][-1]
+    return (starts, founder, np.concatenate(offset_parts))
+
+def _genome_indices(rows, replicates):
+    """
+    Returns the packed genome indices of every replicate of the given
+    rows, replicates consecutive genomes to a row.
+    """
+    rows = np.asarray(rows, dtype = np.int64)
+    return (rows[:, None] * replicates +
+            np.arange(replicates, dtype = np.int64)).ravel()
+
+def generate_genome_replicates(population, nodes, generator, recombinators,
+                               replicates, true_genealogy = True,
+                               rng = None, founders = frozenset()):
+    """
+    Simulates replicates independent genomes for each of the given
+    nodes of population, and for the ancestors needed to produce them,
+    returning a GenomeReplicates. The genome attributes of the nodes
+    are neither used nor changed.
+
+    Each generation is mated with a single call to mate_packed for
+    all of its members and replicates, so the per person work in
+    Python is shared by every replicate. Replicate k of a child comes
+    from replicate k of its parents, so every replicate is an
+    independent simulation of the whole population. rng is as for
+    generate_genomes. Nodes in founders get founder genomes whatever
+    their parents, so that no ancestry is shared through their
+    ancestors.
+    """
+    assert replicates > 0
+    targets = list(dict.fromkeys(nodes))
+    target_set = set(targets)
+    closure = ancestral_closure(targets, true_genealogy,
+                                skip_genomes = False, founders = founders)
+    pending_children = Counter(parent for node in closure
+                               for parent in set(_parents(node,
+                                                          true_genealogy,
+                                                          founders))
+                               if parent is not None)
+    end = generator._total_length
+    empty = np.empty(0, dtype = np.uint32)
+    # Genomes of the nodes still needed, replicates consecutive
+    # genomes to a row. row_of maps each of those nodes to its row.
+    live = (empty, empty.copy(), np.zeros(1, dtype = np.int64))
+    row_of = dict()
+    generations = population.generations
+    generation_rngs = spawn(rng, len(generations))
+    for generation, generation_rng in zip(generations, generation_rngs):
+        members = [node for node in generation.members if node in closure]
+        if len(members) == 0:
+            continue
+        live_rows = (len(live[2]) - 1) // (2 * replicates)
+        num_founders = 0
+        def new_founder():
+            nonlocal num_founders
+            num_founders += 1
+            return live_rows + num_founders - 1
+        new_rows = dict()
+        children = []
+        mother_rows = []
+        father_rows = []
+        twins = []
+        for person in members:
+            if person.twin is not None and (person.twin in row_of or
+                                            person.twin in new_rows):
+                twins.append(person)
+                continue
+            mother, father = _parents(person, true_genealogy, founders)
+            if mother is None and father is None:
+                new_rows[person] = new_founder()
+                continue
+            if mother is None:
+                mother_rows.append(new_founder())
+            else:
+                mother_rows.append(row_of[mother])
+            if father is None:
+                father_rows.append(new_founder())
+            else:
+                father_rows.append(row_of[father])
+            # Child rows are only known once the founders are counted.
+            new_rows[person] = None
+            children.append(person)
+
+        founder_genomes = generator.generate_packed(num_founders *
+                                                    replicates)
+        parents = concatenate_genomes(live, founder_genomes)
+        if len(children) > 0:
+            mated = mate_packed(*parents, end,
+                                _genome_indices(mother_rows, replicates),
+                                _genome_indices(father_rows, replicates),
+                                recombinators[Sex.Female],
+                                recombinators[Sex.Male],
+                                rng = generation_rng)
+            combined = concatenate_genomes(parents, mated)
+        else:
+            combined = parents
+        first_child_row = live_rows + num_founders
+        for i, person in enumerate(children):
+            new_rows[person] = first_child_row + i
+        row_of.update(new_rows)
+        for person in twins:
+            row_of[person] = row_of[person.twin]
+
+        for node in members:
+            for parent in set(_parents(node, true_genealogy, founders)):
+                if parent is None:
+                    continue
+                pending_children[parent] -= 1
+                if pending_children[parent] == 0 and parent not in target_set:
+                    del row_of[parent]
+        # Drop the rows of nodes that are no longer needed once they
+        # are the majority, rather than copying the rest every
+        # generation.
+        kept_rows = sorted(set(row_of.values()))
+        total_rows = (len(combined[2]) - 1) // (2 * replicates)
+        if 2 * len(kept_rows) < total_rows:
+            new_row = {row: i for i, row in enumerate(kept_rows)}
+            live = take_genomes(*combined,
+                                _genome_indices(kept_rows, replicates))
+            row_of = {node: new_row[row] for node, row in row_of.items()}
+        else:
+            live = combined
+
+    target_rows = [row_of[node] for node in targets]
+    starts, founder, offsets = take_genomes(*live,
+                                            _genome_indices(target_rows,
+                                                            replicates))
+    return GenomeReplicates(targets, replicates, starts, founder, offsets,
+                            end)
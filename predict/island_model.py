@@ -16,7 +16,9 @@ class IslandNode():
         if is_leaf:
             self._individuals = set(members)
         else:
-            self._islands = set(members)
+            # A list rather than a set, so islands are always visited
+            # in the same order.
+            self._islands = list(members)
             for node in members:
                 node._parent = self
 
@@ -27,7 +29,7 @@ class IslandNode():
         self._individuals.remove(individual)
 
     def _add_island(self, island):
-        self._islands.add(island)
+        self._islands.append(island)
         island._parent = self
 
     def __in__(self, individual):
@@ -1,6 +1,7 @@
 from random import choice
 
 from sex import Sex, SEXES
+import random_streams
 
 class NodeGenerator:
     """
@@ -18,7 +19,13 @@ class NodeGenerator:
         
     def generate_node(self, father = None, mother = None,
                       suspected_father = None, suspected_mother = None,
-                      sex = None, twin = None):
+                      sex = None, twin = None, rng = None):
+        """
+        Returns a new node. If sex is not given it is picked with rng,
+        or the global random state if rng is None.
+        """
+        if sex is None:
+            sex = random_streams.choice(SEXES, rng)
         node_id = self._id
         self._id += 1
         if father is not None:
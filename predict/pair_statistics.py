@@ -0,0 +1,103 @@
+import numpy as np
+
+from gamma import hurdle_gamma_statistics, fit_hurdle_gamma_statistics
+
+class PairStatistics:
+    """
+    Running sufficient statistics of the hurdle gamma distribution of
+    shared lengths for a fixed list of (unlabeled, labeled) pairs: the
+    number of samples, the number of zeros, and the sum and sum of
+    logs of the nonzero samples. Memory use depends only on the number
+    of pairs, however many samples are added.
+    """
+    def __init__(self, unlabeled, labeled):
+        self.unlabeled = np.array(unlabeled, dtype = np.uint32)
+        self.labeled = np.array(labeled, dtype = np.uint32)
+        assert self.unlabeled.shape == self.labeled.shape
+        num_pairs = len(self.unlabeled)
+        self.counts = np.zeros(num_pairs, dtype = np.int64)
+        self.zero_counts = np.zeros(num_pairs, dtype = np.int64)
+        self.sums = np.zeros(num_pairs, dtype = np.float64)
+        self.log_sums = np.zeros(num_pairs, dtype = np.float64)
+
+    def __len__(self):
+        return len(self.unlabeled)
+
+    def add(self, lengths, rng = None):
+        """
+        Adds samples to the statistics, where lengths is a
+        len(self) x samples matrix. Noise is added to the nonzero
+        samples as in fit_hurdle_gamma, drawn from rng.
+        """
+        lengths = np.asarray(lengths)
+        assert lengths.shape[0] == len(self)
+        num_samples = lengths.shape[1]
+        offsets = np.arange(len(self) + 1, dtype = np.int64) * num_samples
+        counts, zero_counts, sums, log_sums \
+            = hurdle_gamma_statistics(lengths.ravel(), offsets, rng)
+        self.counts += counts
+        self.zero_counts += zero_counts
+        self.sums += sums
+        self.log_sums += log_sums
+
+    def merge(self, other):
+        """
+        Adds the statistics of other, which must be for the same pairs.
+        """
+        if not (np.array_equal(self.unlabeled, other.unlabeled) and
+                np.array_equal(self.labeled, other.labeled)):
+            raise ValueError("Statistics are for different pairs.")
+        self.counts += other.counts
+        self.zero_counts += other.zero_counts
+        self.sums += other.sums
+        self.log_sums += other.log_sums
+
+    def fit(self, pool = None, chunk_pairs = 4096):
+        """
+        Returns arrays (shape, scale, zero probability) of the hurdle
+        gamma distribution of each pair, as fit_hurdle_gamma_statistics.
+        If a multiprocessing pool is given, the pairs are fit
+        chunk_pairs at a time by its processes. Each pair is fit on
+        its own, so the result is the same as without a pool.
+        """
+        if pool is None:
+            return fit_hurdle_gamma_statistics(self.counts, self.zero_counts,
+                                               self.sums, self.log_sums)
+        chunks = [(self.counts[start:start + chunk_pairs],
+                   self.zero_counts[start:start + chunk_pairs],
+                   self.sums[start:start + chunk_pairs],
+                   self.log_sums[start:start + chunk_pairs])
+                  for start in range(0, len(self), chunk_pairs)]
+        fits = pool.starmap(fit_hurdle_gamma_statistics, chunks)
+        if len(fits) == 0:
+            return fit_hurdle_gamma_statistics(self.counts, self.zero_counts,
+                                               self.sums, self.log_sums)
+        return tuple(np.concatenate(arrays) for arrays in zip(*fits))
+
+    def arrays(self):
+        """
+        Returns a dict of the arrays making up the statistics.
+        """
+        return {"unlabeled": self.unlabeled, "labeled": self.labeled,
+                "counts": self.counts, "zero_counts": self.zero_counts,
+                "sums": self.sums, "log_sums": self.log_sums}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Returns the statistics with the arrays returned by arrays.
+        """
+        statistics = cls(arrays["unlabeled"], arrays["labeled"])
+        statistics.counts[:] = arrays["counts"]
+        statistics.zero_counts[:] = arrays["zero_counts"]
+        statistics.sums[:] = arrays["sums"]
+        statistics.log_sums[:] = arrays["log_sums"]
+        return statistics
+
+    def save(self, filename):
+        np.savez(filename, **self.arrays())
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls.from_arrays(data)
@@ -15,7 +15,8 @@ with open(POPULATION_FILE, "rb") as pickle_file:
     population = pickle.load(pickle_file)
 
 
-lengths = np.array(shared_segment_distribution(population, 5))
+segments = shared_segment_distribution(population, 5)
+lengths = segments.stop.astype(np.int64) - segments.start
 weights = np.ones_like(lengths)/float(len(lengths))
 # plt.hist(lengths, bins = 20, normed = True)
 plt.hist(lengths, bins = 20, weights = weights)
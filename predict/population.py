@@ -1,13 +1,12 @@
 from math import floor
-from random import shuffle, uniform, choice, random, sample
 from itertools import chain
-from types import GeneratorType
 from pickle import Unpickler
 from collections import defaultdict
 
 import json
 
 from random_queue import RandomQueue
+from random_streams import shuffle, uniform, choice, random, sample
 from generation import Generation
 from sex import Sex
 
@@ -104,63 +103,64 @@ class HierarchicalIslandPopulation(Population):
             self._generations.append(Generation(island_tree.individuals))
 
 
-    def _pick_island(self, individual):
+    def _pick_island(self, individual, rng = None):
         island = self._island_tree.get_island(individual)
         # Traverse upward
-        while uniform(0, 1) < island.switch_probability:
+        while uniform(0, 1, rng) < island.switch_probability:
             island = island.parent
             if island.parent is None:
                 break
         # Now drill down into final island.
         while not island.is_leaf:
-            island = choice(list(island.islands))
+            island = choice(list(island.islands), rng)
         return island
 
     def _island_members(self, generation_members):
         """
-        Returns a dictionary mapping islands to sets of individuals
-        from generation_members.
+        Returns a dictionary mapping islands to lists of individuals
+        from generation_members, in the order of generation_members.
         """
-        if isinstance(generation_members, GeneratorType):
-            # If generation_members is a generator, then all the
-            # elements are "used up" on the first leaf. We need to
-            # iterate over the elements of generation_members multiple
-            # time.
-            generation_members = list(generation_members)
-        members = dict()
-        for leaf in self._island_tree.leaves:
-            m = leaf.individuals.intersection(generation_members)
-            members[leaf] = m
+        members = {leaf: [] for leaf in self._island_tree.leaves}
+        for member in generation_members:
+            members[self._island_tree.get_island(member)].append(member)
         return members
 
-    def migrate_generation(self, generation):
+    def migrate_generation(self, generation, rng = None):
         """
         Cause all members of the population to migrate.
         """
         for member in generation.members:
-            island = self._pick_island(member)
+            island = self._pick_island(member, rng)
             self._island_tree.move_individual(member, island)
             
 
     def new_generation(self, size = None, non_paternity_rate = 0,
                        adoption_rate = 0, unknown_mother_rate = 0,
-                       unknown_father_rate = 0, multi_partner_probs = None):
+                       unknown_father_rate = 0, multi_partner_probs = None,
+                       rng = None):
         """
         Generates a new generation of individuals from the previous
         generation. If size is not passed, the new generation will be
         the same size as the previous generation.
+        Every random choice is made with the numpy Generator rng, or
+        with the global random state if rng is None.
         """
         if size is None:
             size = self._generations[-1].size
-        self.migrate_generation(self._generations[-1])
+        self.migrate_generation(self._generations[-1], rng)
         previous_generation = list(self._generations[-1].members)
-        shuffle(previous_generation)
+        shuffle(previous_generation, rng)
         boundary = len(previous_generation) // 2
-        seekers = RandomQueue(previous_generation[:boundary])
-        mates = set(previous_generation[boundary:])
+        seekers = RandomQueue(previous_generation[:boundary], rng)
+        mates = previous_generation[boundary:]
         mate_set = defaultdict(set)
         mate_attempts = defaultdict(int)
-        available_mates = self._island_members(mates)
+        # Dicts are used as ordered sets, because the order of a set
+        # of nodes changes from run to run, and mates are picked by
+        # shuffling it.
+        available_mates = {island: dict.fromkeys(members)
+                           for island, members
+                           in self._island_members(mates).items()}
         pairs = []
         while len(seekers) > 0:
             seeker = seekers.dequeue()
@@ -169,7 +169,7 @@ class HierarchicalIslandPopulation(Population):
             island = self._island_tree.get_island(seeker)
             potential_mates = [mate for mate in available_mates[island]
                                if mate.sex != seeker.sex]
-            shuffle(potential_mates)
+            shuffle(potential_mates, rng)
             for potential_mate in potential_mates:
                 share_mother = (seeker.mother is not None and
                                 potential_mate.mother == seeker.mother)
@@ -182,10 +182,10 @@ class HierarchicalIslandPopulation(Population):
                     existing_mates.add(potential_mate)
                     num_mates = len(existing_mates)
                     if (multi_partner_probs is not None and
-                        multi_partner_probs[num_mates] < random()):
+                        multi_partner_probs[num_mates] < random(rng)):
                         seekers.enqueue(seeker)
                     else:
-                        available_mates[island].remove(potential_mate)
+                        del available_mates[island][potential_mate]
                     break
             mate_attempts[seeker] += 1
         num_twins = int(0.003 * size)
@@ -213,45 +213,47 @@ class HierarchicalIslandPopulation(Population):
             # Child will be based at mate's island
             island = self._island_tree.get_island(mate)
             for i in range(min_children + extra):
-                child = node_generator.generate_node(man, woman)
+                child = node_generator.generate_node(man, woman, rng = rng)
                 new_nodes.append(child)
                 self.island_tree.add_individual(island, child)
 
-        apportioned = apportion(new_nodes, non_paternity_rate, adoption_rate)
+        apportioned = apportion(new_nodes, non_paternity_rate, adoption_rate,
+                                rng = rng)
         non_paternity, adopted = apportioned
         already_error = non_paternity.union(adopted)
-        no_error = list(set(new_nodes) - already_error)
+        # Keep the order of new_nodes so draws are reproducible.
+        no_error = [node for node in new_nodes if node not in already_error]
+        non_paternity = [node for node in new_nodes if node in non_paternity]
+        adopted = [node for node in new_nodes if node in adopted]
 
         # We don't use apportion here, because they are not mutually exclusive
         unknown_mother = sample(no_error,
-                                int(unknown_mother_rate * len(new_nodes)))
+                                int(unknown_mother_rate * len(new_nodes)),
+                                rng)
         unknown_father = sample(no_error,
-                                int(unknown_father_rate * len(new_nodes)))
+                                int(unknown_father_rate * len(new_nodes)),
+                                rng)
         for node in unknown_mother:
             node.set_suspected_mother(None)
         for node in unknown_father:
             node.set_suspected_father(None)
 
         men_by_island = self._island_members(self._generations[-1].men)
-        men_by_island = {island: list(men) for island, men
-                         in men_by_island.items()}
         for node in non_paternity:
             child_island = self._island_tree.get_island(node)
-            suspected_father = choice(men_by_island[child_island])
+            suspected_father = choice(men_by_island[child_island], rng)
             node.set_suspected_father(suspected_father)
 
         women_by_island = self._island_members(self._generations[-1].women)
-        women_by_island = {island: list(women) for island, women
-                           in women_by_island.items()}
         for node in adopted:
             child_island = self._island_tree.get_island(node)
-            suspected_father = choice(men_by_island[child_island])
+            suspected_father = choice(men_by_island[child_island], rng)
             node.set_suspected_father(suspected_father)
-            suspected_mother = choice(women_by_island[child_island])
+            suspected_mother = choice(women_by_island[child_island], rng)
             node.set_suspected_mother(suspected_mother)
 
         # Generate twins. Twins will essentially be copies of their sibling
-        for template_node in sample(new_nodes, num_twins):
+        for template_node in sample(new_nodes, num_twins, rng):
             twin = node_generator.twin_node(template_node)
             island = self._island_tree.get_island(template_node)
             self._island_tree.add_individual(island, twin)
@@ -267,7 +269,7 @@ class HierarchicalIslandPopulation(Population):
     def island_tree(self):
         return self._island_tree
 
-def apportion(original, *rates):
+def apportion(original, *rates, rng = None):
     remainder = list(original)
     assigned = set()
     length = len(original)
@@ -277,7 +279,7 @@ def apportion(original, *rates):
         if rate == 0:
             current_group = set()
         else:
-            current_group = set(sample(remainder, int(length * rate)))
+            current_group = set(sample(remainder, int(length * rate), rng))
         assigned.update(current_group)
         subsets.append(current_group)
         if 0 < len(current_group):
@@ -1,56 +1,71 @@
-from bisect import bisect_left
-from collections import deque
-from random import random
+from collections import deque, Counter
+from itertools import chain
 
 import numpy as np
 
 from sex import Sex
-from recomb_genome import RecombGenome, Diploid, CHROMOSOME_ORDER
+from recomb_genome import RecombGenome, NUM_CHROMS
+from recomb_helper import gamete
+from common_segments import pack_genomes
+from shared_meiosis import SharedArrays, mate_generation, meiosis_pool
+from random_streams import numpy_random, spawn
 
-def _pick_chroms_for_diploid(genome, recombinator):
+# Packed genomes of no founders, for mate_generation.
+_NO_FOUNDERS = (np.empty(0, dtype = np.uint32), np.empty(0, dtype = np.uint32),
+                np.zeros(1, dtype = np.int64))
+
+def _pick_chroms_for_diploid(genome, recombinator, rng = None):
     """
     Takes a genome and returns a diploid chromosome that is the result
     of recombination events and randomly picking a diploid for each
     autosome.
+    Only the transmitted homolog is built, switching between the
+    parent's homologs at each crossover, rather than recombining both
+    homologs and then picking from them.
     """
-    recomb_genome = recombinator.recombination(genome)
-    mother = recomb_genome.mother
-    father = recomb_genome.father
-    starts = []
-    founder = []
-    offsets = recombinator._chrom_start_offset
-    chrom_stop = 0
-    for chrom_name in CHROMOSOME_ORDER:
-        if random() < 0.5:
-            tmp_diploid = mother
-        else:
-            tmp_diploid = father
-
-        chrom_start = bisect_left(tmp_diploid.starts, offsets[chrom_name])
-        if chrom_name != CHROMOSOME_ORDER[-1]:
-            chrom_stop = bisect_left(tmp_diploid.starts,
-                                     offsets[chrom_name + 1],
-                                     chrom_start)
-        else:
-            chrom_stop = len(tmp_diploid.starts)
-        starts.extend(tmp_diploid.starts[chrom_start:chrom_stop])
-        founder.extend(tmp_diploid.founder[chrom_start:chrom_stop])
-    return Diploid(np.array(starts, dtype = np.uint32),
-                   mother.end,
-                   np.array(founder, dtype = np.uint32))
-
+    loci, loci_offsets = recombinator._batch_recombination_locations(1, rng)
+    first_homolog = (numpy_random(rng).random(NUM_CHROMS)
+                     >= 0.5).astype(np.uint8)
+    return gamete(genome.mother, genome.father, first_homolog, loci,
+                  loci_offsets, recombinator._offsets)
 
-def mate(mother, father, mother_recombinator, father_recombinator):
+def mate(mother, father, mother_recombinator, father_recombinator,
+         rng = None):
     """
-    Takes a mother and father, and returns a genome for a child
+    Takes a mother and father, and returns a genome for a child.
+    Meiosis draws from the numpy Generator rng, or the global
+    np.random state if rng is None.
     """
     assert mother is not None
     assert father is not None
-    from_mother = _pick_chroms_for_diploid(mother, mother_recombinator)
-    from_father = _pick_chroms_for_diploid(father, father_recombinator)
+    from_mother = _pick_chroms_for_diploid(mother, mother_recombinator, rng)
+    from_father = _pick_chroms_for_diploid(father, father_recombinator, rng)
     return RecombGenome(from_mother, from_father)
 
-def generate_genomes_ancestors(root_nodes, generator, recombinators):
+def mate_packed(starts, founder, offsets, end, mothers, fathers,
+                mother_recombinator, father_recombinator, rng = None):
+    """
+    Mates many pairs of genomes at once. starts, founder and offsets
+    are genomes packed as by pack_genomes, and mothers and fathers
+    give the index of the mother and father of each child in the
+    packed genomes. Returns the children packed the same way, as a
+    tuple (starts, founder, offsets). The children are the same as
+    mate_generation would make without a pool. rng is as for mate.
+    """
+    assert np.array_equal(mother_recombinator._offsets,
+                          father_recombinator._offsets)
+    parents = SharedArrays(shared = False)
+    parents.arrays.update(starts = starts, founder = founder,
+                          offsets = offsets)
+    recombinators = {Sex.Female: mother_recombinator,
+                     Sex.Male: father_recombinator}
+    children = mate_generation(parents, mothers, fathers,
+                               _NO_FOUNDERS, recombinators, end, rng = rng)
+    arrays = children.store.arrays
+    return (arrays["starts"], arrays["founder"], arrays["offsets"])
+
+def generate_genomes_ancestors(root_nodes, generator, recombinators,
+                               rng = None):
     queue = deque(root_nodes)
     visited = set()
     while len(queue) > 0:
@@ -63,47 +78,305 @@ def generate_genomes_ancestors(root_nodes, generator, recombinators):
                 continue
             person.genome =  mate(person.mother.genome, person.father.genome,
                                   recombinators[Sex.Female],
-                                  recombinators[Sex.Male])
+                                  recombinators[Sex.Male], rng)
         else:
             person.genome = generator.generate()
         queue.extend(person.children)
         visited.add(person)
 
 def generate_genomes(population, generator, recombinators, keep_last = None,
-                     true_genealogy = True):
+                     true_genealogy = True, batch = False, processes = 1,
+                     rng = None):
+    """
+    Generates genomes for every member of population without one.
+    If batch is True, the genomes of a generation are made together
+    by mate_generation rather than by a call to mate for each child,
+    and each generation's genomes are kept packed for the next
+    generation to read its parents from. If processes is more than 1,
+    batch mode is used and each generation's children are split
+    between that many processes, with the packed genomes in shared
+    memory.
+
+    If rng, a numpy Generator, is given, each generation draws from
+    its own stream spawned from rng, so the genomes depend only on
+    the state of rng and not on the global random state. Otherwise
+    the global np.random state is used.
+    """
     assert keep_last is None or keep_last > 0
-    for generation_num, generation in enumerate(population.generations):
-        for person in generation.members:
-            if person.genome is not None:
-                continue
-            if person.twin is not None and person.twin.genome is not None:
-                person.genome = person.twin.genome
-                continue
-            if true_genealogy:
-                mother = person.mother
-                father = person.father
+    assert processes >= 1
+    if processes > 1:
+        with meiosis_pool(processes, recombinators) as pool:
+            _generate_genomes(population, generator, recombinators,
+                              keep_last, true_genealogy, True, pool, rng)
+    else:
+        _generate_genomes(population, generator, recombinators, keep_last,
+                          true_genealogy, batch, None, rng)
+
+def _generate_genomes(population, generator, recombinators, keep_last,
+                      true_genealogy, batch, pool, rng):
+    generations = population.generations
+    generation_rngs = spawn(rng, len(generations))
+    # The PackedGeneration of the last generation, which the next
+    # generation reads its parents from, and its members.
+    previous = None
+    previous_members = []
+    try:
+        for generation_num, generation in enumerate(generations):
+            generation_rng = generation_rngs[generation_num]
+            packed = None
+            if batch:
+                packed = _generate_generation_packed(generation.members,
+                                                     generator, recombinators,
+                                                     true_genealogy, previous,
+                                                     pool, generation_rng)
             else:
-                mother = person.suspected_mother
-                father = person.suspected_father
-            
-            if mother is None and father is None:
-                person.genome = generator.generate()
+                _generate_generation(generation.members, generator,
+                                     recombinators, true_genealogy,
+                                     generation_rng)
+            if keep_last is not None and keep_last <= generation_num:
+                to_delete = population.generations[generation_num - keep_last]
+                for person in to_delete.members:
+                    person.genome = None
+            # Only the genomes still held are kept once it is closed.
+            if previous is not None:
+                previous.close(previous_members)
+            previous = packed
+            previous_members = generation.members
+    finally:
+        if previous is not None:
+            previous.close(previous_members)
+
+def generate_genomes_for(population, nodes, generator, recombinators,
+                         true_genealogy = True, batch = False,
+                         processes = 1, rng = None):
+    """
+    Generates genomes for the given nodes of population, and only for
+    the ancestors needed to produce them, in generation order. Genomes
+    of ancestors that are not in nodes are released as soon as all of
+    their children needing genomes have one. batch, processes and rng
+    are as for generate_genomes.
+    """
+    assert processes >= 1
+    if processes > 1:
+        with meiosis_pool(processes, recombinators) as pool:
+            _generate_genomes_for(population, nodes, generator,
+                                  recombinators, true_genealogy, True, pool,
+                                  rng)
+    else:
+        _generate_genomes_for(population, nodes, generator, recombinators,
+                              true_genealogy, batch, None, rng)
+
+def ancestral_closure(nodes, true_genealogy = True, skip_genomes = True,
+                      founders = frozenset()):
+    """
+    Returns the set of the given nodes and their ancestors that need a
+    genome generated for the given nodes to have genomes. If
+    skip_genomes is True, nodes that already have a genome and their
+    ancestors are not included. Nodes in founders are treated as
+    having no parents.
+    """
+    def needed(node):
+        return not skip_genomes or node.genome is None
+    closure = set()
+    to_visit = [node for node in nodes if needed(node)]
+    while len(to_visit) > 0:
+        node = to_visit.pop()
+        if node in closure:
+            continue
+        closure.add(node)
+        for parent in _parents(node, true_genealogy, founders):
+            if (parent is not None and needed(parent) and
+                parent not in closure):
+                to_visit.append(parent)
+    return closure
+
+def _generate_genomes_for(population, nodes, generator, recombinators,
+                          true_genealogy, batch, pool, rng):
+    targets = set(nodes)
+    closure = ancestral_closure(targets, true_genealogy)
+    # Number of children of each node in the closure that still need a
+    # genome. Nodes outside the closure already had a genome before
+    # this call, so they are never counted or released.
+    pending_children = Counter(parent for node in closure
+                               for parent in set(_parents(node,
+                                                          true_genealogy))
+                               if parent in closure)
+    generations = population.generations
+    # Streams are spawned for every generation, as generate_genomes
+    # does, even for generations without any nodes in the closure.
+    generation_rngs = spawn(rng, len(generations))
+    previous = None
+    previous_members = []
+    try:
+        for generation, generation_rng in zip(generations, generation_rngs):
+            # Keep population order so results match generate_genomes
+            # for the same seed when every node is a target.
+            members = [node for node in generation.members
+                       if node in closure]
+            if len(members) == 0:
                 continue
-            if mother is None:
-                mother_genome = generator.generate()
-            else:
-                mother_genome = mother.genome
-            if father is None:
-                father_genome = generator.generate()
+            packed = None
+            if batch:
+                packed = _generate_generation_packed(members, generator,
+                                                     recombinators,
+                                                     true_genealogy, previous,
+                                                     pool, generation_rng)
             else:
-                father_genome = father.genome
-                
-            assert mother_genome is not None
-            assert father_genome is not None
-            person.genome = mate(mother_genome, father_genome,
-                                 recombinators[Sex.Female],
-                                 recombinators[Sex.Male])
-        if keep_last is not None and keep_last <= generation_num:
-            to_delete = population.generations[generation_num - keep_last]
-            for person in to_delete.members:
-                person.genome = None
+                _generate_generation(members, generator, recombinators,
+                                     true_genealogy, generation_rng)
+            for node in members:
+                for parent in set(_parents(node, true_genealogy)):
+                    if parent not in closure:
+                        continue
+                    pending_children[parent] -= 1
+                    if (pending_children[parent] == 0 and
+                        parent not in targets):
+                        parent.genome = None
+            # Only the genomes still held are kept once it is closed.
+            if previous is not None:
+                previous.close(previous_members)
+            previous = packed
+            previous_members = members
+    finally:
+        if previous is not None:
+            previous.close(previous_members)
+
+def _parents(person, true_genealogy, founders = ()):
+    if person in founders:
+        return (None, None)
+    if true_genealogy:
+        return (person.mother, person.father)
+    return (person.suspected_mother, person.suspected_father)
+
+def _generate_generation(members, generator, recombinators, true_genealogy,
+                         rng = None):
+    for person in members:
+        if person.genome is not None:
+            continue
+        if person.twin is not None and person.twin.genome is not None:
+            person.genome = person.twin.genome
+            continue
+        mother, father = _parents(person, true_genealogy)
+
+        if mother is None and father is None:
+            person.genome = generator.generate()
+            continue
+        if mother is None:
+            mother_genome = generator.generate()
+        else:
+            mother_genome = mother.genome
+        if father is None:
+            father_genome = generator.generate()
+        else:
+            father_genome = father.genome
+
+        assert mother_genome is not None
+        assert father_genome is not None
+        person.genome = mate(mother_genome, father_genome,
+                             recombinators[Sex.Female],
+                             recombinators[Sex.Male], rng)
+
+def _generate_generation_packed(members, generator, recombinators,
+                                true_genealogy, previous = None, pool = None,
+                                rng = None):
+    """
+    Same as _generate_generation, but makes every genome of members
+    at once with mate_generation, split between the processes of
+    pool, a meiosis_pool, if given. Parents are read from the store
+    of previous, the PackedGeneration returned for the generation
+    before, if they are all in it, and are packed otherwise. Returns
+    the PackedGeneration that the genomes of members are views into,
+    or None if no genomes were made.
+    """
+    children = []
+    founders = []
+    founder_genomes = []
+    twins = []
+    mother_genomes = []
+    father_genomes = []
+    pending = set()
+    for person in members:
+        if person.genome is not None:
+            continue
+        if person.twin is not None and (person.twin.genome is not None or
+                                        person.twin in pending):
+            twins.append(person)
+            continue
+        pending.add(person)
+        mother, father = _parents(person, true_genealogy)
+        if mother is None and father is None:
+            # Founder ids are given out in members order, as
+            # _generate_generation does.
+            founders.append(person)
+            founder_genomes.append(generator.generate_packed(1))
+            continue
+        if mother is None:
+            mother_genome = generator.generate()
+        else:
+            mother_genome = mother.genome
+        if father is None:
+            father_genome = generator.generate()
+        else:
+            father_genome = father.genome
+        assert mother_genome is not None
+        assert father_genome is not None
+        mother_genomes.append(mother_genome)
+        father_genomes.append(father_genome)
+        children.append(person)
+
+    generation = None
+    if len(pending) > 0:
+        parents, rows = _parent_rows(mother_genomes + father_genomes,
+                                     previous, pool is not None)
+        new_founders = _concatenate_founders(founder_genomes)
+        try:
+            generation = mate_generation(parents, rows[:len(children)],
+                                         rows[len(children):], new_founders,
+                                         recombinators,
+                                         generator._total_length, pool, rng)
+        finally:
+            if previous is None or parents is not previous.store:
+                parents.close(unlink = True)
+        for row, person in enumerate(chain(children, founders)):
+            person.genome = generation.genome(row)
+    for person in twins:
+        person.genome = person.twin.genome
+    return generation
+
+def _concatenate_founders(genomes):
+    """
+    Packs together a list of single founder genomes, each as returned
+    by generate_packed(1).
+    """
+    if len(genomes) == 0:
+        return _NO_FOUNDERS
+    starts, founder, _ = zip(*genomes)
+    offsets = np.arange(2 * len(genomes) + 1, dtype = np.int64) * NUM_CHROMS
+    return (np.concatenate(starts), np.concatenate(founder), offsets)
+
+def _parent_rows(genomes, previous, shared):
+    """
+    Returns a SharedArrays of packed genomes holding the given
+    genomes, and the row of each genome in it. This is the store of
+    previous if it has every genome, and otherwise new arrays of the
+    genomes packed with pack_genomes, which the caller must close.
+    """
+    if previous is not None:
+        rows = [previous.row(genome) for genome in genomes]
+        if all(row is not None for row in rows):
+            return (previous.store, rows)
+    # Maps a genome's id to its row in unique.
+    index = dict()
+    unique = []
+    rows = []
+    for genome in genomes:
+        key = id(genome)
+        if key not in index:
+            index[key] = len(unique)
+            unique.append(genome)
+        rows.append(index[key])
+    parents = SharedArrays(shared)
+    for name, array in zip(("starts", "founder", "offsets"),
+                           pack_genomes(unique)):
+        parents.share(name, array)
+    return (parents, rows)
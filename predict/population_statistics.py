@@ -4,6 +4,7 @@ from collections import Counter
 
 import numpy as np
 
+from common_segments import pack_genomes, common_segment_columns_pairs
 from util import descendants_of, get_sample_of_cousins
 
 def proportion_within_distance(population, distance, percent_labeled):
@@ -120,11 +121,22 @@ def cdf_num_labeled_within_distance(population, distance, percent_labeled):
     # return (x, y)
     return np.array(list(counter.values()))
 
-def shared_segment_distribution(population, distance):
+def shared_segment_distribution(population, distance,
+                                chrom_starts = None):
+    """
+    Returns a SegmentColumns with the segments shared by a sample of
+    pairs of individuals whose most recent common ancestor is distance
+    generations back. The segment lengths are stop - start.
+    """
     assert distance > 0
-    cousin_pairs = get_sample_of_cousins(population, distance)
-    lengths = []
-    for p_1, p_2 in cousin_pairs:
-            by_autosome = common_segment_lengths(p_1.genome, p_2.genome)
-            lengths.extend(chain.from_iterable(by_autosome.values()))
-    return lengths
+    cousin_pairs = list(get_sample_of_cousins(population, distance))
+    nodes = list(set(chain.from_iterable(cousin_pairs)))
+    node_index = {node: i for i, node in enumerate(nodes)}
+    starts, founder, offsets = pack_genomes(node.genome for node in nodes)
+    pairs = np.array([(node_index[p_1], node_index[p_2])
+                      for p_1, p_2 in cousin_pairs],
+                     dtype = np.int64).reshape(-1, 2)
+    # With no cousin pairs this gives empty columns.
+    end = nodes[0].genome.mother.end if len(nodes) > 0 else 0
+    return common_segment_columns_pairs(starts, founder, offsets, end,
+                                        pairs, chrom_starts)
@@ -1,14 +1,18 @@
-from random import shuffle, randrange
 from collections import Counter
 
+from random_streams import shuffle, randrange
+
 class RandomQueue:
     """
     Randomly returns an element that was previously enqueued.
+    Elements are picked with rng, or the global random state if rng
+    is None.
     """
-    def __init__(self, initial = None):
+    def __init__(self, initial = None, rng = None):
+        self._rng = rng
         if initial is not None:
             self.elements = list(initial)
-            shuffle(self.elements)
+            shuffle(self.elements, rng)
         else:
             self.elements = []
 
@@ -17,7 +21,7 @@ class RandomQueue:
 
     def dequeue(self):
         if len(self.elements) > 1:
-            location = randrange(0, len(self.elements))
+            location = randrange(len(self.elements), self._rng)
             temp = self.elements[-1]
             self.elements[-1] = self.elements[location]
             self.elements[location] = temp
@@ -0,0 +1,80 @@
+"""
+Random draws for the simulation from an explicit numpy.random.Generator.
+
+Every function here takes an rng argument. If rng is None the draw
+comes from the global random or np.random state, as it did before
+generators were threaded through the simulation, so seeding with
+random.seed and np.random.seed keeps working. Independent streams for
+workers, generations or replicates are made with spawn, which uses
+SeedSequence.spawn underneath.
+"""
+import random as _random
+
+import numpy as np
+
+def make_rng(seed):
+    """
+    Returns a Generator for seed, which may be None, an int, a
+    SeedSequence or already a Generator. None gives None, which means
+    the global random state is used.
+    """
+    if seed is None or isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+def spawn(rng, n):
+    """
+    Returns a list of n independent Generators derived from rng. The
+    same rng state always gives the same streams. If rng is None, a
+    list of None is returned.
+    """
+    if rng is None:
+        return [None] * n
+    return rng.spawn(n)
+
+def numpy_random(rng):
+    """
+    Returns an object to call NumPy distribution methods (random,
+    uniform, binomial, ...) on: rng, or the np.random module if rng
+    is None.
+    """
+    if rng is None:
+        return np.random
+    return rng
+
+def random(rng = None):
+    if rng is None:
+        return _random.random()
+    return rng.random()
+
+def uniform(a, b, rng = None):
+    if rng is None:
+        return _random.uniform(a, b)
+    return rng.uniform(a, b)
+
+def randrange(stop, rng = None):
+    if rng is None:
+        return _random.randrange(stop)
+    return int(rng.integers(stop))
+
+def choice(items, rng = None):
+    if rng is None:
+        return _random.choice(items)
+    return items[int(rng.integers(len(items)))]
+
+def shuffle(items, rng = None):
+    """
+    Shuffles the list items in place.
+    """
+    if rng is None:
+        _random.shuffle(items)
+    else:
+        rng.shuffle(items)
+
+def sample(items, k, rng = None):
+    """
+    Returns a list of k distinct elements of the sequence items.
+    """
+    if rng is None:
+        return _random.sample(items, k)
+    return [items[i] for i in rng.choice(len(items), k, replace = False)]
@@ -1,27 +1,49 @@
 import re
 import csv
+import json
 
+from hashlib import sha256
 from itertools import tee
-from os import listdir
-from os.path import isfile, join
-from random import uniform
-from bisect import bisect_left
-from collections import defaultdict, namedtuple
+from os import listdir, replace, stat
+from os.path import basename, isfile, join
+from tempfile import NamedTemporaryFile
+from warnings import warn
+from collections import namedtuple
 from itertools import chain
 
 import numpy as np
 # import pyximport; pyximport.install()
 
-from sex import Sex
+from sex import Sex, SEXES
 from diploid import Diploid
-from recomb_helper import new_sequence
+from recomb_helper import swap_at_locations, sort_segments
+from common_segments import founder_set
+from random_streams import numpy_random
 
 MEGABASE = 10 ** 6
 DECODE_FILENAME = "decode_recombination_data.tab"
+# Compiled map cache written by recombinators_from_directory, per sex.
+CACHE_FILENAME = "recombination_map_{}.npz"
 CHROMOSOME_ORDER = list(range(1, 23))
 NUM_CHROMS = len(CHROMOSOME_ORDER)
 
-RecombGenome = namedtuple("RecombGenome", ["mother", "father"])
+class RecombGenome(namedtuple("RecombGenome", ["mother", "father"])):
+    """
+    A genome made of its mother and father homologs. founders is the
+    founder set of the genome (see common_segments.founder_set). If it
+    is not given it is computed when first used, so that genomes that
+    are never compared do not pay for it.
+    """
+    def __new__(cls, mother, father, founders = None):
+        genome = super().__new__(cls, mother, father)
+        genome._founders = founders
+        return genome
+
+    @property
+    def founders(self):
+        if self._founders is None and self.mother is not None:
+            self._founders = founder_set(self.mother, self.father)
+        return self._founders
 
 class RecombGenomeGenerator():
     def __init__(self, chromosome_lengths):
@@ -32,34 +54,81 @@ class RecombGenomeGenerator():
         self._chrom_start_offset = dict(zip(CHROMOSOME_ORDER[1:],
                                             ordered_cum_bases[:-1]))
         self._chrom_start_offset[1] = 0
+        # Every founder homolog starts a segment at each chromosome
+        # start, so all of them share this read only array.
+        self._founder_starts = chromosome_starts(self._chrom_start_offset)
+        self._founder_starts.flags.writeable = False
         self._genome_id = 0
 
     def generate(self):
-        starts = np.fromiter((self._chrom_start_offset[chrom]
-                              for chrom in CHROMOSOME_ORDER),
-                             dtype = np.uint32, count = NUM_CHROMS)
-        mother_founder = np.empty(NUM_CHROMS, dtype = np.uint32)
-        mother_founder.fill(self._genome_id)
-        father_founder = np.empty(NUM_CHROMS, dtype = np.uint32)
-        father_founder.fill(self._genome_id + 1)
-        mother = Diploid(starts, self._total_length, mother_founder)
-        # XXX: Can the start array be shared across some individuals?
-        father = Diploid(np.array(starts, dtype = np.uint32),
-                         self._total_length, father_founder)
-        
+        """
+        Returns a new founder genome. Both homologs share the
+        generator's read only starts array, and the founder array of
+        each homolog is a read only broadcast of its founder id, so
+        no per founder arrays are allocated.
+        """
+        mother = Diploid(self._founder_starts, self._total_length,
+                         _broadcast_founder(self._genome_id))
+        father = Diploid(self._founder_starts, self._total_length,
+                         _broadcast_founder(self._genome_id + 1))
+        founders = np.arange(self._genome_id, self._genome_id + 2,
+                             dtype = np.uint32)
         self._genome_id += 2
-        return RecombGenome(mother, father)
+        return RecombGenome(mother, father, founders)
+
+    def generate_packed(self, count):
+        """
+        Returns count new founder genomes packed as by pack_genomes,
+        as a tuple (starts, founder, offsets). The genomes have the
+        founder ids that count calls to generate would give them.
+        """
+        num_homologs = 2 * count
+        starts = np.tile(self._founder_starts, num_homologs)
+        founder = np.repeat(np.arange(self._genome_id,
+                                      self._genome_id + num_homologs,
+                                      dtype = np.uint32), NUM_CHROMS)
+        offsets = np.arange(num_homologs + 1, dtype = np.int64) * NUM_CHROMS
+        self._genome_id += num_homologs
+        return (starts, founder, offsets)
 
     def reset(self):
         self._genome_id = 0
 
-def recombinators_from_directory(directory):
+def _broadcast_founder(founder_id):
+    """
+    Returns a read only founder array with founder_id for every
+    chromosome, without storing a value per chromosome.
+    """
+    value = np.array([founder_id], dtype = np.uint32)
+    # A zero stride view of a single value. np.broadcast_to does the
+    # same but is several times slower to construct.
+    founder = np.ndarray((NUM_CHROMS,), dtype = np.uint32, buffer = value,
+                         strides = (0,))
+    founder.flags.writeable = False
+    return founder
+
+def chromosome_starts(chrom_start_offset):
+    """
+    Given the _chrom_start_offset dict of a Recombinator or
+    RecombGenomeGenerator, returns the start offset of each chromosome
+    in CHROMOSOME_ORDER, as used by common_segment_columns.
+    """
+    return np.array([chrom_start_offset[chrom] for chrom in CHROMOSOME_ORDER],
+                    dtype = np.uint32)
+
+def recombinators_from_directory(directory, cache = True):
     """
     Given a directory of files downloaded from, returns a Recombinator
     object for those files.
     Genome maps are from
     http://hapmap.ncbi.nlm.nih.gov/downloads/recombination/
     Sex based centimorgan lengths are from decode doi:10.1038/ng917.
+
+    If cache is True the sex adjusted maps are saved as one .npz file
+    per sex in directory, along with the size, modification time and
+    SHA-256 of each source file. Later calls load the maps from those
+    files instead of parsing the sources, as long as the sources are
+    unchanged.
     """
     chromosomes = dict()
     for filename in listdir(directory):
@@ -68,9 +137,17 @@ def recombinators_from_directory(directory):
             continue
         chromosomes[int(match.group(1))] = join(directory, filename)
     decode_file = join(directory, DECODE_FILENAME)
+    sources = sorted(chromosomes.values()) + [decode_file]
+    if cache:
+        recombinators = _load_cached_recombinators(directory, sources)
+        if recombinators is not None:
+            return recombinators
     if isfile(decode_file):
         sex_data = read_sex_lengths(decode_file)
-    return recombinators_from_hapmap_files(chromosomes, sex_data)
+    recombinators = recombinators_from_hapmap_files(chromosomes, sex_data)
+    if cache:
+        _save_cached_recombinators(directory, sources, recombinators)
+    return recombinators
 
 def recombinators_from_hapmap_files(hapmap_files, sex_lengths = None):
     """
@@ -80,40 +157,39 @@ def recombinators_from_hapmap_files(hapmap_files, sex_lengths = None):
     chrom_data = dict()
     for chrom, filename in hapmap_files.items():
         chrom_data[chrom] = _read_recombination_file(filename)
+    positions, centimorgans, row_offsets = _map_arrays(chrom_data)
     if not sex_lengths:
-        return Recombinator(chrom_data)
+        return Recombinator.from_arrays(positions, centimorgans, row_offsets)
 
     # We may need to interpolate the data to the different rates for
     # the sexes. This may need to be replaced with something more
     # sophisticated later.
-    sex_adjusted_data = defaultdict(dict)
+    recombinators = dict()
     for sex, sex_lengths in sex_lengths.items():
-        for chromosome, length in sex_lengths.items():
-            original_length = chrom_data[chromosome][-1][2]
-            ratio = length / original_length
-            data = chrom_data[chromosome]
-            sex_adjusted_data[sex][chromosome] = _adjust_centimorgans(data,
-                                                                      ratio)
-    return {sex: Recombinator(data) for sex, data in sex_adjusted_data.items()}
-
-def _adjust_centimorgans(rows, multiplier = 1.0):
-    """
-    Adjusts the number of centimorgans in rows by some multiplier.
-    eg if we have the rows
-
-    a 0.05 0
-    b 0.1  0.05
-    c 0.05 0.15
-
-    and we apply a multiplier of 2, then we are doubling the number of
-    centimorgans, giving us.
+        original_lengths = centimorgans[row_offsets[1:] - 1]
+        ratios = np.array([sex_lengths[chrom] for chrom in CHROMOSOME_ORDER],
+                          dtype = np.float64) / original_lengths
+        row_ratios = np.repeat(ratios, np.diff(row_offsets))
+        recombinators[sex] = Recombinator.from_arrays(positions,
+                                                      centimorgans *
+                                                      row_ratios,
+                                                      row_offsets)
+    return recombinators
 
-    a 0.1 0
-    b 0.2 0.1
-    c 0.1 0.3
+def _map_arrays(recombination_data):
     """
-    return [(bp, rate * multiplier, distance * multiplier)
-            for bp, rate, distance in rows]
+    Converts recombination data, a dict from chromosome to the rows
+    of its map, to the arrays (positions, centimorgans, row_offsets)
+    taken by Recombinator.from_arrays.
+    """
+    rows = [recombination_data[chrom] for chrom in CHROMOSOME_ORDER]
+    row_offsets = np.zeros(NUM_CHROMS + 1, dtype = np.int64)
+    np.cumsum([len(data) for data in rows], out = row_offsets[1:])
+    positions = np.fromiter((row[0] for data in rows for row in data),
+                            dtype = np.int64, count = row_offsets[-1])
+    centimorgans = np.fromiter((row[2] for data in rows for row in data),
+                               dtype = np.float64, count = row_offsets[-1])
+    return (positions, centimorgans, row_offsets)
 
 def _read_recombination_file(filename):
     """
@@ -132,6 +208,88 @@ def _read_recombination_file(filename):
             rows.append(row)
     return rows
 
+def _cache_filename(directory, sex):
+    return join(directory, CACHE_FILENAME.format(sex.name.lower()))
+
+def _source_stats(sources):
+    """
+    Returns a dict from the base name of each source file that exists
+    to its (size, modification time in ns).
+    """
+    stats = dict()
+    for source in sources:
+        if isfile(source):
+            source_stat = stat(source)
+            stats[basename(source)] = (source_stat.st_size,
+                                       source_stat.st_mtime_ns)
+    return stats
+
+def _file_hash(filename):
+    digest = sha256()
+    with open(filename, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _load_cached_recombinators(directory, sources):
+    """
+    Returns the recombinators saved by _save_cached_recombinators in
+    directory, or None if there are none or the sources changed.
+    Sources whose size and modification time are unchanged are not
+    hashed again.
+    """
+    recombinators = dict()
+    stats = _source_stats(sources)
+    hashes = dict()
+    for sex in SEXES:
+        try:
+            with np.load(_cache_filename(directory, sex)) as cached:
+                recorded = json.loads(str(cached["sources"]))
+                arrays = (cached["positions"], cached["centimorgans"],
+                          cached["row_offsets"])
+        except (OSError, KeyError, ValueError):
+            return None
+        if set(recorded) != set(stats):
+            return None
+        for name, (size, mtime_ns, digest) in recorded.items():
+            if stats[name] == (size, mtime_ns):
+                continue
+            if name not in hashes:
+                hashes[name] = _file_hash(join(directory, name))
+            if hashes[name] != digest:
+                return None
+        recombinators[sex] = Recombinator.from_arrays(*arrays)
+    return recombinators
+
+def _save_cached_recombinators(directory, sources, recombinators):
+    """
+    Saves the map of each recombinator to its cache file in directory.
+    The cache is skipped with a warning if it cannot be written.
+    """
+    if not isinstance(recombinators, dict):
+        # Without sex specific lengths there is nothing per sex to save.
+        return
+    stats = _source_stats(sources)
+    recorded = {name: (size, mtime_ns, _file_hash(join(directory, name)))
+                for name, (size, mtime_ns) in stats.items()}
+    for sex, recombinator in recombinators.items():
+        positions, centimorgans, row_offsets = recombinator.map_arrays()
+        filename = _cache_filename(directory, sex)
+        try:
+            # Write to a temporary file first so an interrupted write
+            # never leaves a truncated cache behind.
+            with NamedTemporaryFile(dir = directory, suffix = ".npz",
+                                    delete = False) as cache_file:
+                np.savez(cache_file, positions = positions,
+                         centimorgans = centimorgans,
+                         row_offsets = row_offsets,
+                         sources = json.dumps(recorded))
+            replace(cache_file.name, filename)
+        except OSError as error:
+            warn("Could not write recombination cache {}: {}".format(filename,
+                                                                   error))
+            return
+
 def read_sex_lengths(filename):
     """
     Read in file from decode paper that has the centimorgan length of
@@ -168,100 +326,209 @@ class Recombinator():
         recombination_data is list of position, cM / Mb, (cumulative)
         cM values, as given by the hapmap data file.
         """
+        self._set_map(*_map_arrays(recombination_data))
+
+    @classmethod
+    def from_arrays(cls, positions, centimorgans, row_offsets):
+        """
+        Returns a Recombinator for a map given as arrays. The map of
+        chromosome CHROMOSOME_ORDER[i] has the positions and
+        cumulative centimorgans at
+        row_offsets[i]:row_offsets[i + 1] of positions and
+        centimorgans.
+        """
+        recombinator = cls.__new__(cls)
+        recombinator._set_map(positions, centimorgans, row_offsets)
+        return recombinator
+
+    def map_arrays(self):
+        """
+        Returns the map as the arrays (positions, centimorgans,
+        row_offsets) taken by from_arrays.
+        """
+        return (self._positions, self._map_centimorgans, self._row_offsets)
+
+    def _set_map(self, positions, centimorgans, row_offsets):
+        positions = np.asarray(positions, dtype = np.int64)
+        centimorgans = np.asarray(centimorgans, dtype = np.float64)
+        row_offsets = np.asarray(row_offsets, dtype = np.int64)
+        assert len(row_offsets) == NUM_CHROMS + 1
+        self._positions = positions
+        self._map_centimorgans = centimorgans
+        self._row_offsets = row_offsets
+
+        # Per chromosome values, in CHROMOSOME_ORDER.
+        last_row = row_offsets[1:] - 1
+        self._bases = positions[last_row]
+        self._centimorgans = centimorgans[last_row]
+        self._offsets = np.zeros(NUM_CHROMS, dtype = np.int64)
+        np.cumsum(self._bases[:-1], out = self._offsets[1:])
+        self._event_probability = (self._centimorgans * 0.01) / self._bases
         # Maps chromosome to the number of bases in the chromosome
-        self._num_bases = dict()
+        self._num_bases = dict(zip(CHROMOSOME_ORDER, self._bases.tolist()))
         # Maps chromosome to the number of centimorgans in the chromosome
-        self._num_centimorgans = dict()
-        # The end points of each contiguous segment of bases that
-        # share a recombination rate, measured in cumulative
-        # centimorgans.
+        self._num_centimorgans = dict(zip(CHROMOSOME_ORDER,
+                                          self._centimorgans.tolist()))
+        self._chrom_start_offset = dict(zip(CHROMOSOME_ORDER,
+                                            self._offsets.tolist()))
+
+        # The contiguous segments of bases that share a recombination
+        # rate, for all chromosomes in CHROMOSOME_ORDER. Segment i
+        # covers bases _range_start[i] to _range_stop[i] of its
+        # chromosome, and centimorgans _start_points[i] to
+        # _end_points[i]. Centimorgans are cumulative over the
+        # chromosomes, so that _end_points is sorted.
         # For example if the chromosome file has the lines
         # 554484 0.0015000000 0.0007230750
         # 555296 0.0015000000 0.0007242930
         # Then the end point for 554484-555296 will be 0.0007242930
-        self._end_points = dict()
-        # Maps end points to their ranges.
-        self._end_point_range  = dict()
-        for chrom, data in recombination_data.items():
-            self._num_bases[chrom] = data[-1][0]
-            self._num_centimorgans[chrom] = data[-1][2]
-            end_points = [row[2] for row in data[1:]]
-            self._end_points[chrom] = end_points
-            range_lookup = dict()
-            for l_1, l_2 in pairwise(data):
-                pos_1 = l_1[0]
-                pos_2 = l_2[0]
-                end_point = l_2[2]
-                range_lookup[end_point] = (pos_1, pos_2)
-            self._end_point_range[chrom] = range_lookup
-        ordered_cum_bases = np.cumsum([self._num_bases[chrom]
-                                       for chrom in CHROMOSOME_ORDER])
-        self._chrom_start_offset = dict(zip(CHROMOSOME_ORDER[1:],
-                                            ordered_cum_bases[:-1]))
-        self._chrom_start_offset[1] = 0
+        # plus the centimorgans of the preceding chromosomes.
+        self._cm_offsets = np.zeros(NUM_CHROMS, dtype = np.float64)
+        np.cumsum(self._centimorgans[:-1], out = self._cm_offsets[1:])
+        row_cm_offsets = np.repeat(self._cm_offsets, np.diff(row_offsets))
+        # Every row but the first of each chromosome ends a segment.
+        is_first_row = np.zeros(len(positions), dtype = np.bool_)
+        is_first_row[row_offsets[:-1]] = True
+        stop_row = np.flatnonzero(~is_first_row)
+        start_row = stop_row - 1
+        self._range_start = positions[start_row]
+        self._range_stop = positions[stop_row]
+        self._end_points = centimorgans[stop_row] + row_cm_offsets[stop_row]
+        # The first segment of each chromosome starts at 0 cM.
+        self._start_points = np.where(is_first_row[start_row],
+                                      row_cm_offsets[start_row],
+                                      centimorgans[start_row] +
+                                      row_cm_offsets[start_row])
+        # Segments of chromosome i are
+        # _first_segment[i]:_first_segment[i + 1]
+        self._first_segment = row_offsets - np.arange(NUM_CHROMS + 1)
 
-    def _recombination_locations(self, chrom):
+    def _recombination_locations(self, rng = None):
         """
-        Given a chromosome name, returns a list of locations where
-        recombination events could happen based on monte carlo
-        methods.
+        Returns a sorted array of global locations where recombination
+        events occur in all chromosomes, based on monte carlo methods.
+        Every chromosome has an even number of locations, so they can
+        be read as (start, stop) pairs.
 
         This is done by first sampling from a binomial distribution to
-        determine the number of recombination events, then repeatedly
-        selecting values uniformly from 0 to the number of
-        centimorgans in a chromosome to determine where the
-        recombination events occur.
+        determine the number of recombination events in each
+        chromosome, then selecting values uniformly from 0 to the
+        number of centimorgans in the chromosome to determine where
+        the recombination events occur. Values are drawn from the
+        numpy Generator rng, or the global np.random state if rng is
+        None.
+        """
+        rng = numpy_random(rng)
+        recomb_events = rng.binomial(self._bases, self._event_probability)
+        chrom_i = np.repeat(np.arange(NUM_CHROMS), recomb_events)
+        cm_locations = rng.uniform(0, self._centimorgans[chrom_i])
+        cm_locations += self._cm_offsets[chrom_i]
+        # Sorting the cumulative centimorgans keeps the chromosomes
+        # in order.
+        sort_i = np.argsort(cm_locations, kind = "mergesort")
+        return self._loci(chrom_i[sort_i], cm_locations[sort_i])
+
+    def _batch_recombination_locations(self, num_gametes, rng = None):
         """
-        bases = self._num_bases[chrom]
-        centimorgans = self._num_centimorgans[chrom]
-        recomb_events = np.random.binomial(bases,
-                                           (centimorgans * 0.01)/ bases)
-        if recomb_events is 0:
-            return []
-        recomb_locations = [uniform(0, centimorgans)
-                            for _ in range(recomb_events)]
-        recomb_locations.sort()
-        loci = []
-        for location in recomb_locations:
-            index = bisect_left(self._end_points[chrom], location)
-            end_point = self._end_points[chrom][index]
-            start, stop = self._end_point_range[chrom][end_point]
-            if index == 0:
-                start_point = 0.0
-            else:
-                start_point = self._end_points[chrom][index - 1]
-            assert location > start_point
-            # fraction_in is the fraction of the way into this region
-            # the recombination event occurs.
-            fraction_in = (location - start_point) / (end_point - start_point)
-            recomb_spot = int((stop - start) * fraction_in + start)
-            if len(loci) == 0 or recomb_spot != loci[-1]:
-                loci.append(recomb_spot)
+        Samples the recombination events of num_gametes meioses at
+        once. Returns a tuple (loci, loci_offsets), where the sorted
+        global locations of the events in chromosome c of gamete i are
+        loci[loci_offsets[i * NUM_CHROMS + c]:
+             loci_offsets[i * NUM_CHROMS + c + 1]].
+        Unlike _recombination_locations, repeated locations are kept
+        and chromosomes are not padded to an even number of locations.
+        """
+        counts = self._batch_recombination_counts(num_gametes, rng)
+        return self._batch_recombination_loci(counts, rng)
+
+    def _batch_recombination_counts(self, num_gametes, rng = None):
+        """
+        Samples the number of recombination events in each chromosome
+        of num_gametes meioses, as a num_gametes x NUM_CHROMS matrix.
+        """
+        return numpy_random(rng).binomial(self._bases,
+                                          self._event_probability,
+                                          size = (num_gametes, NUM_CHROMS))
+
+    def _batch_recombination_loci(self, counts, rng = None):
+        """
+        Samples the locations of the recombination events of meioses
+        with the given matrix of event counts from
+        _batch_recombination_counts. Returns (loci, loci_offsets) as
+        _batch_recombination_locations does.
+        """
+        rng = numpy_random(rng)
+        num_gametes = len(counts)
+        recomb_events = np.asarray(counts).ravel()
+        loci_offsets = np.zeros(len(recomb_events) + 1, dtype = np.int64)
+        np.cumsum(recomb_events, out = loci_offsets[1:])
+        chrom_i = np.repeat(np.tile(np.arange(NUM_CHROMS), num_gametes),
+                            recomb_events)
+        cm_locations = rng.uniform(0, self._centimorgans[chrom_i])
+        cm_locations += self._cm_offsets[chrom_i]
+        # Events are already grouped by gamete and chromosome, so only
+        # the few events within each group need sorting.
+        sort_segments(cm_locations, loci_offsets)
+        loci = self._interpolate(chrom_i, cm_locations)
+        return (loci, loci_offsets)
+
+    def _loci(self, chrom_i, cm_locations):
+        """
+        Converts sorted cumulative centimorgan locations on the
+        chromosomes with the given indices into global base pair
+        locations, removing repeated locations and padding
+        chromosomes with an odd number of locations with the
+        chromosome's end.
+        """
+        loci = self._interpolate(chrom_i, cm_locations)
+        keep = np.ones(len(loci), dtype = np.bool_)
+        keep[1:] = (loci[1:] != loci[:-1]) | (chrom_i[1:] != chrom_i[:-1])
+        loci = loci[keep]
+        chrom_i = chrom_i[keep]
+        odd = np.flatnonzero(np.bincount(chrom_i, minlength = NUM_CHROMS) % 2)
+        if len(odd) > 0:
+            loci = np.concatenate((loci, self._offsets[odd] + self._bases[odd]))
+            chrom_i = np.concatenate((chrom_i, odd))
+            sort_i = np.lexsort((loci, chrom_i))
+            loci = loci[sort_i]
+        return loci
+
+    def _interpolate(self, chrom_i, cm_locations):
+        """
+        Converts cumulative centimorgan locations on the chromosomes
+        with the given indices into global base pair locations.
+        """
+        index = np.searchsorted(self._end_points, cm_locations)
+        # Floating point error could otherwise put a location at a
+        # chromosome boundary in the neighbouring chromosome.
+        index = np.clip(index, self._first_segment[chrom_i],
+                        self._first_segment[chrom_i + 1] - 1)
+        start_point = self._start_points[index]
+        width = self._end_points[index] - start_point
+        # fraction_in is the fraction of the way into this region
+        # the recombination event occurs.
+        fraction_in = np.divide(cm_locations - start_point, width,
+                                out = np.zeros_like(width),
+                                where = width > 0)
+        start = self._range_start[index]
+        stop = self._range_stop[index]
+        loci = ((stop - start) * fraction_in + start).astype(np.int64)
+        loci += self._offsets[chrom_i]
         return loci
 
-    def recombination(self, genome):
+    def recombination(self, genome, rng = None):
         """
         Given a RecombGenome, returns a new RecombGenome object that
         is the product of recombination on the given RecombGenome.
         """
         assert genome is not None
-        global_locations = []
-        for chrom_name in CHROMOSOME_ORDER:
-            locations = self._recombination_locations(chrom_name)
-            if len(locations) % 2 == 1:
-                locations.append(self._num_bases[chrom_name])
-            # Adjust the locations for our global genome
-            offset = self._chrom_start_offset[chrom_name]
-            global_locations.extend(location + offset
-                                    for location in locations)
+        global_locations = self._recombination_locations(rng)
         if len(global_locations) == 0:
             return genome
-            
-        mother, father = _swap_at_locations(genome.mother,
-                                            genome.father,
-                                            zip(global_locations[::2],
-                                                global_locations[1::2]))
-                
+
+        mother, father = swap_at_locations(genome.mother, genome.father,
+                                           global_locations.astype(np.uint32))
+
         return RecombGenome(mother, father)
 
 def _swap_at_locations(mother, father, locations):
@@ -270,35 +537,9 @@ def _swap_at_locations(mother, father, locations):
     Locations is given by basepair locations, rather than centimorgans
     or list index.
     """
-    locations = tuple(locations)
     flat_locations = np.fromiter(chain.from_iterable(locations),
-                                 count = len(locations) * 2,
                                  dtype = np.uint32)
-    new_mother = new_sequence(mother, flat_locations)
-    new_father = new_sequence(father, flat_locations)
-    for start, stop in locations:
-        mother_start_i = bisect_left(new_mother.starts, start)
-        mother_stop_i = bisect_left(new_mother.starts, stop, mother_start_i)
-        father_start_i = bisect_left(new_father.starts, start)
-        father_stop_i = bisect_left(new_father.starts, stop, father_start_i)
-        temp_mother = new_mother.starts[mother_start_i:mother_stop_i]
-        temp_father = new_father.starts[father_start_i:father_stop_i]
-        new_mother.starts[mother_start_i:mother_stop_i], \
-            new_father.starts[father_start_i:father_stop_i] = (temp_father,
-                                                               temp_mother)
-
-        temp_mother = new_mother.founder[mother_start_i:mother_stop_i]
-        temp_father = new_father.founder[father_start_i:father_stop_i]
-        new_mother.founder[mother_start_i:mother_stop_i], \
-            new_father.founder[father_start_i:father_stop_i] = (temp_father,
-                                                                temp_mother)
-    return_mother = Diploid(np.array(new_mother.starts, dtype = np.uint32),
-                            mother.end,
-                            np.array(new_mother.founder, dtype = np.uint32))
-    return_father = Diploid(np.array(new_father.starts, dtype = np.uint32),
-                            father.end,
-                            np.array(new_father.founder, dtype = np.uint32))
-    return (return_mother, return_father)
+    return swap_at_locations(mother, father, flat_locations)
         
 def _check_diploid_bounds(diploid):
     """This a useful function for finding bugs in diploid generation."""
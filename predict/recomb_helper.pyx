@@ -1,4 +1,3 @@
-# cython: profile=True
 
 from diploid import Diploid
 
@@ -7,7 +6,9 @@ import numpy as np
 cimport numpy as np
 cimport cython
 
-def new_sequence(diploid, np.ndarray[np.uint32_t, ndim=1] locations):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def new_sequence(diploid, const np.uint32_t[:] locations):
     """
     Return a new sequence, broken up at the given start, stop locations.
     Eg the sequence starts:  0  10 20
@@ -19,41 +20,415 @@ def new_sequence(diploid, np.ndarray[np.uint32_t, ndim=1] locations):
     sort which only keeps unique values in output starts array, but
     with modifications to handle the founder array.
     """
-    if locations.shape[0] == 0:
-        return Diploid(diploid.starts.tolist(), diploid.end,
-                       diploid.founder.tolist())
-    cdef np.ndarray[np.uint32_t, ndim=1] starts = diploid.starts
-    cdef np.ndarray[np.uint32_t, ndim=1] founder = diploid.founder
-    cdef unsigned long break_index, break_location
-    cdef list new_starts = []
-    cdef list new_founder = []
-    cdef unsigned long starts_i, locations_i
-    cdef unsigned long total_len, locations_len, starts_len
-    cdef unsigned long start_loci, break_loci
-    if locations.shape[0] > 0 and locations[-1] == diploid.end:
-        locations = locations[:-1]
+    cdef const np.uint32_t[:] starts = diploid.starts
+    cdef const np.uint32_t[:] founder = diploid.founder
+    cdef Py_ssize_t starts_i, locations_i, out_i
+    cdef Py_ssize_t locations_len = locations.shape[0]
+    cdef Py_ssize_t starts_len = starts.shape[0]
+    if locations_len > 0 and locations[locations_len - 1] == diploid.end:
+        locations_len -= 1
+    new_starts = np.empty(starts_len + locations_len, dtype = np.uint32)
+    new_founder = np.empty(starts_len + locations_len, dtype = np.uint32)
+    cdef np.uint32_t[:] new_starts_view = new_starts
+    cdef np.uint32_t[:] new_founder_view = new_founder
     starts_i = 0
     locations_i = 0
-    founder_i = 0
-    total_i = 0
-    locations_len = locations.shape[0]
-    starts_len = starts.shape[0]
-    total_len = starts_len + locations_len
-    while (starts_i + locations_i) < total_len:
+    out_i = 0
+    while starts_i < starts_len or locations_i < locations_len:
         if (locations_len == locations_i or
             (starts_len != starts_i and
              starts[starts_i] < locations[locations_i])):
-            new_starts.append(starts[starts_i])
-            new_founder.append(founder[starts_i])
+            new_starts_view[out_i] = starts[starts_i]
+            new_founder_view[out_i] = founder[starts_i]
             starts_i += 1
         elif (starts_len == starts_i or
               starts[starts_i] > locations[locations_i]):
-            new_starts.append(locations[locations_i])
-            new_founder.append(founder[starts_i - 1])
+            new_starts_view[out_i] = locations[locations_i]
+            new_founder_view[out_i] = founder[starts_i - 1]
             locations_i += 1
         else: # starts[starts_i] == locations[locations_i])
-            new_starts.append(starts[starts_i])
-            new_founder.append(founder[starts_i])
+            new_starts_view[out_i] = starts[starts_i]
+            new_founder_view[out_i] = founder[starts_i]
             starts_i += 1
             locations_i += 1
-    return Diploid(new_starts, diploid.end, new_founder)
+        out_i += 1
+    return Diploid(new_starts[:out_i], diploid.end, new_founder[:out_i])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def swap_at_locations(mother, father, const np.uint32_t[:] locations):
+    """
+    Breaks both homologs at the given sorted locations, and swaps the
+    intervals between locations[0] and locations[1], locations[2] and
+    locations[3], and so on. Returns the new (mother, father) homologs
+    as Diploids of uint32 arrays.
+
+    Equivalent to breaking both homologs with new_sequence and then
+    swapping the intervals, but without creating zero length
+    intervals for repeated locations.
+    """
+    cdef const np.uint32_t[:] mother_starts = mother.starts
+    cdef const np.uint32_t[:] mother_founder = mother.founder
+    cdef const np.uint32_t[:] father_starts = father.starts
+    cdef const np.uint32_t[:] father_founder = father.founder
+    cdef unsigned long end = mother.end
+    cdef Py_ssize_t mother_len, father_len
+    mother_len = _swapped(mother_starts, mother_founder, father_starts,
+                          father_founder, locations, end, NULL, NULL)
+    father_len = _swapped(father_starts, father_founder, mother_starts,
+                          mother_founder, locations, end, NULL, NULL)
+    new_mother_starts = np.empty(mother_len, dtype = np.uint32)
+    new_mother_founder = np.empty(mother_len, dtype = np.uint32)
+    new_father_starts = np.empty(father_len, dtype = np.uint32)
+    new_father_founder = np.empty(father_len, dtype = np.uint32)
+    cdef np.uint32_t[:] out_starts, out_founder
+    if mother_len > 0:
+        out_starts = new_mother_starts
+        out_founder = new_mother_founder
+        _swapped(mother_starts, mother_founder, father_starts,
+                 father_founder, locations, end,
+                 &out_starts[0], &out_founder[0])
+    if father_len > 0:
+        out_starts = new_father_starts
+        out_founder = new_father_founder
+        _swapped(father_starts, father_founder, mother_starts,
+                 mother_founder, locations, end,
+                 &out_starts[0], &out_founder[0])
+    return (Diploid(new_mother_starts, mother.end, new_mother_founder),
+            Diploid(new_father_starts, father.end, new_father_founder))
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _swapped(const np.uint32_t[:] starts,
+                         const np.uint32_t[:] founder,
+                         const np.uint32_t[:] other_starts,
+                         const np.uint32_t[:] other_founder,
+                         const np.uint32_t[:] locations, unsigned long end,
+                         np.uint32_t *out_starts,
+                         np.uint32_t *out_founder) noexcept nogil:
+    """
+    Writes the intervals of the homolog given by starts and founder
+    after swapping with the other homolog at locations, unless
+    out_starts is NULL. Returns the number of intervals.
+    """
+    cdef Py_ssize_t count = 0
+    cdef Py_ssize_t locations_i = 0
+    cdef unsigned long position = 0
+    cdef unsigned long segment_stop
+    cdef bint swapped = False
+    if starts.shape[0] == 0:
+        return 0
+    position = starts[0]
+    while position < end:
+        if locations_i < locations.shape[0]:
+            segment_stop = locations[locations_i]
+            locations_i += 1
+        else:
+            segment_stop = end
+        if segment_stop > position:
+            if swapped:
+                count = _copy_intervals(other_starts, other_founder, 0,
+                                        other_starts.shape[0], position,
+                                        segment_stop, out_starts,
+                                        out_founder, count)
+            else:
+                count = _copy_intervals(starts, founder, 0, starts.shape[0],
+                                        position, segment_stop, out_starts,
+                                        out_founder, count)
+            position = segment_stop
+        swapped = not swapped
+    return count
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _copy_intervals(const np.uint32_t[:] starts,
+                                const np.uint32_t[:] founder,
+                                Py_ssize_t homolog_start,
+                                Py_ssize_t homolog_stop,
+                                unsigned long position,
+                                unsigned long segment_stop,
+                                np.uint32_t *out_starts,
+                                np.uint32_t *out_founder,
+                                Py_ssize_t count) noexcept nogil:
+    """
+    Writes the intervals of starts[homolog_start:homolog_stop] covering
+    position to segment_stop, the first one starting at position, at
+    index count of out_starts and out_founder unless they are NULL.
+    Returns count plus the number of intervals.
+    """
+    cdef Py_ssize_t j = _last_at_most(starts, homolog_start, homolog_stop,
+                                      position)
+    if out_starts != NULL:
+        out_starts[count] = position
+        out_founder[count] = founder[j]
+    count += 1
+    j += 1
+    while j < homolog_stop and starts[j] < segment_stop:
+        if out_starts != NULL:
+            out_starts[count] = starts[j]
+            out_founder[count] = founder[j]
+        count += 1
+        j += 1
+    return count
+
+### Batched meiosis on packed genomes.
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def gametes_packed(const np.uint32_t[:] starts, const np.uint32_t[:] founder,
+                   const np.int64_t[:] offsets, const np.int64_t[:] parents,
+                   const np.uint8_t[:, :] first_homolog,
+                   const np.int64_t[:] loci,
+                   const np.int64_t[:, :] loci_start,
+                   const np.int64_t[:, :] loci_stop,
+                   const np.int64_t[:] chrom_starts, unsigned long end):
+    """
+    Produces one gamete homolog from each of the given parent genomes,
+    packed as pack_genomes does (starts, founder, offsets).
+
+    parents gives the index of the parent of each gamete in the packed
+    (starts, founder, offsets) genomes. For gamete i and chromosome c,
+    the gamete starts with the parent's mother homolog if
+    first_homolog[i, c] is 0 and the father homolog if it is 1, and
+    switches homolog at each of the crossover locations
+    loci[loci_start[i, c]:loci_stop[i, c]], which must be sorted.
+    chrom_starts gives the global start of each chromosome, and end
+    the end of the genome.
+
+    This is equivalent to swapping the parent's homologs between pairs
+    of crossover locations, then picking one of the homologs for each
+    chromosome, as Recombinator.recombination and
+    population_genomes._pick_chroms_for_diploid do.
+    """
+    cdef Py_ssize_t num_gametes = parents.shape[0]
+    gamete_offsets = np.zeros(num_gametes + 1, dtype = np.int64)
+    cdef np.int64_t[:] gamete_offsets_view = gamete_offsets
+    cdef Py_ssize_t i
+    # Count the intervals of each gamete, then write them.
+    for i in range(num_gametes):
+        gamete_offsets_view[i + 1] = (gamete_offsets_view[i] +
+                                      _packed_gamete(starts, founder,
+                                                     offsets, parents[i],
+                                                     first_homolog[i], loci,
+                                                     loci_start[i],
+                                                     loci_stop[i],
+                                                     chrom_starts, end,
+                                                     NULL, NULL))
+    gamete_starts = np.empty(gamete_offsets_view[num_gametes],
+                             dtype = np.uint32)
+    gamete_founder = np.empty(gamete_offsets_view[num_gametes],
+                              dtype = np.uint32)
+    cdef np.uint32_t[:] starts_view = gamete_starts
+    cdef np.uint32_t[:] founder_view = gamete_founder
+    if gamete_offsets_view[num_gametes] > 0:
+        for i in range(num_gametes):
+            _packed_gamete(starts, founder, offsets, parents[i],
+                           first_homolog[i], loci, loci_start[i],
+                           loci_stop[i], chrom_starts, end,
+                           &starts_view[gamete_offsets_view[i]],
+                           &founder_view[gamete_offsets_view[i]])
+    return (gamete_starts, gamete_founder, gamete_offsets)
+
+def gamete_bounds(const np.int64_t[:] offsets, parents, loci_start,
+                  loci_stop):
+    """
+    Returns an upper bound on the number of intervals in each gamete
+    produced by gametes_packed with the same arguments. A gamete has
+    at most one interval per crossover and chromosome on top of the
+    intervals of both of its parent's homologs.
+    """
+    parents = np.asarray(parents, dtype = np.int64)
+    offsets_array = np.asarray(offsets)
+    parent_lengths = offsets_array[2 * parents + 2] - offsets_array[2 * parents]
+    num_loci = np.sum(np.asarray(loci_stop) - np.asarray(loci_start), axis = 1)
+    return parent_lengths + num_loci + np.asarray(loci_start).shape[1]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def gametes_packed_into(const np.uint32_t[:] starts,
+                        const np.uint32_t[:] founder,
+                        const np.int64_t[:] offsets,
+                        const np.int64_t[:] parents,
+                        const np.uint8_t[:, :] first_homolog,
+                        const np.int64_t[:] loci,
+                        const np.int64_t[:, :] loci_start,
+                        const np.int64_t[:, :] loci_stop,
+                        const np.int64_t[:] chrom_starts, unsigned long end,
+                        np.uint32_t[:] out_starts, np.uint32_t[:] out_founder,
+                        const np.int64_t[:] out_offsets):
+    """
+    Same as gametes_packed, but writes gamete i to out_starts and
+    out_founder starting at out_offsets[i], which must leave room for
+    at least gamete_bounds intervals. Returns an array with the number
+    of intervals written for each gamete.
+    """
+    cdef Py_ssize_t num_gametes = parents.shape[0]
+    counts = np.empty(num_gametes, dtype = np.int64)
+    cdef np.int64_t[:] counts_view = counts
+    cdef Py_ssize_t i
+    with nogil:
+        for i in range(num_gametes):
+            counts_view[i] = _packed_gamete(starts, founder, offsets,
+                                            parents[i], first_homolog[i],
+                                            loci, loci_start[i],
+                                            loci_stop[i], chrom_starts, end,
+                                            &out_starts[out_offsets[i]],
+                                            &out_founder[out_offsets[i]])
+    return counts
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline Py_ssize_t _packed_gamete(const np.uint32_t[:] starts,
+                                      const np.uint32_t[:] founder,
+                                      const np.int64_t[:] offsets,
+                                      np.int64_t parent,
+                                      const np.uint8_t[:] first_homolog,
+                                      const np.int64_t[:] loci,
+                                      const np.int64_t[:] loci_start,
+                                      const np.int64_t[:] loci_stop,
+                                      const np.int64_t[:] chrom_starts,
+                                      unsigned long end,
+                                      np.uint32_t *out_starts,
+                                      np.uint32_t *out_founder) noexcept nogil:
+    return _gamete(starts, founder, offsets[2 * parent],
+                   offsets[2 * parent + 1], starts, founder,
+                   offsets[2 * parent + 1], offsets[2 * parent + 2],
+                   first_homolog, loci, loci_start, loci_stop, chrom_starts,
+                   end, out_starts, out_founder)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def gamete(mother, father, const np.uint8_t[:] first_homolog,
+           const np.int64_t[:] loci, const np.int64_t[:] loci_offsets,
+           const np.int64_t[:] chrom_starts):
+    """
+    Produces the gamete homolog transmitted by a parent with the given
+    mother and father homologs, as a Diploid of uint32 arrays.
+    Chromosome c starts with the mother homolog if first_homolog[c]
+    is 0 and the father homolog if it is 1, and switches homolog at
+    each of the crossover locations
+    loci[loci_offsets[c]:loci_offsets[c + 1]]. Gives the same result
+    as gametes_packed for a single parent, without packing the
+    parent's homologs.
+    """
+    cdef const np.uint32_t[:] mother_starts = mother.starts
+    cdef const np.uint32_t[:] mother_founder = mother.founder
+    cdef const np.uint32_t[:] father_starts = father.starts
+    cdef const np.uint32_t[:] father_founder = father.founder
+    cdef Py_ssize_t num_chroms = loci_offsets.shape[0] - 1
+    cdef const np.int64_t[:] loci_start = loci_offsets[:num_chroms]
+    cdef const np.int64_t[:] loci_stop = loci_offsets[1:]
+    cdef unsigned long end = mother.end
+    cdef Py_ssize_t count
+    count = _gamete(mother_starts, mother_founder, 0, mother_starts.shape[0],
+                    father_starts, father_founder, 0, father_starts.shape[0],
+                    first_homolog, loci, loci_start, loci_stop, chrom_starts,
+                    end, NULL, NULL)
+    gamete_starts = np.empty(count, dtype = np.uint32)
+    gamete_founder = np.empty(count, dtype = np.uint32)
+    cdef np.uint32_t[:] starts_view = gamete_starts
+    cdef np.uint32_t[:] founder_view = gamete_founder
+    if count > 0:
+        _gamete(mother_starts, mother_founder, 0, mother_starts.shape[0],
+                father_starts, father_founder, 0, father_starts.shape[0],
+                first_homolog, loci, loci_start, loci_stop, chrom_starts,
+                end, &starts_view[0], &founder_view[0])
+    return Diploid(gamete_starts, mother.end, gamete_founder)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef Py_ssize_t _gamete(const np.uint32_t[:] mother_starts,
+                        const np.uint32_t[:] mother_founder,
+                        Py_ssize_t mother_start, Py_ssize_t mother_stop,
+                        const np.uint32_t[:] father_starts,
+                        const np.uint32_t[:] father_founder,
+                        Py_ssize_t father_start, Py_ssize_t father_stop,
+                        const np.uint8_t[:] first_homolog,
+                        const np.int64_t[:] loci,
+                        const np.int64_t[:] loci_start,
+                        const np.int64_t[:] loci_stop,
+                        const np.int64_t[:] chrom_starts, unsigned long end,
+                        np.uint32_t *out_starts,
+                        np.uint32_t *out_founder) noexcept nogil:
+    """
+    Walks the intervals of one gamete, writing them to out_starts and
+    out_founder unless they are NULL. Returns the number of intervals.
+    The parent's mother homolog is
+    mother_starts[mother_start:mother_stop], and likewise for the
+    father homolog and founder.
+    """
+    cdef Py_ssize_t num_chroms = chrom_starts.shape[0]
+    cdef Py_ssize_t count = 0
+    cdef Py_ssize_t c, locus_i
+    cdef unsigned long position, chrom_stop, segment_stop
+    cdef int homolog
+    for c in range(num_chroms):
+        if c + 1 < num_chroms:
+            chrom_stop = chrom_starts[c + 1]
+        else:
+            chrom_stop = end
+        position = chrom_starts[c]
+        homolog = first_homolog[c]
+        locus_i = loci_start[c]
+        while position < chrom_stop:
+            if locus_i < loci_stop[c]:
+                segment_stop = loci[locus_i]
+                locus_i += 1
+            else:
+                segment_stop = chrom_stop
+            if segment_stop > position:
+                if homolog == 0:
+                    count = _copy_intervals(mother_starts, mother_founder,
+                                            mother_start, mother_stop,
+                                            position, segment_stop,
+                                            out_starts, out_founder, count)
+                else:
+                    count = _copy_intervals(father_starts, father_founder,
+                                            father_start, father_stop,
+                                            position, segment_stop,
+                                            out_starts, out_founder, count)
+                position = segment_stop
+            homolog = 1 - homolog
+    return count
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline Py_ssize_t _last_at_most(const np.uint32_t[:] starts,
+                                     Py_ssize_t low, Py_ssize_t high,
+                                     unsigned long position) noexcept nogil:
+    """
+    Returns the index of the last element of starts[low:high] that is
+    at most position. starts[low] must be at most position.
+    """
+    cdef Py_ssize_t middle
+    # Invariant: starts[low] <= position, and starts[high] > position
+    # if high is in range.
+    while high - low > 1:
+        middle = low + (high - low) // 2
+        if starts[middle] <= position:
+            low = middle
+        else:
+            high = middle
+    return low
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def sort_segments(double[:] values, const np.int64_t[:] offsets):
+    """
+    Sorts values[offsets[i]:offsets[i + 1]] in place for every i.
+    Each segment is insertion sorted, as segments of crossovers are
+    only a few elements long. This is much faster than a lexsort by
+    segment and value over the whole array.
+    """
+    cdef Py_ssize_t i, j, k, segment_start
+    cdef double value
+    with nogil:
+        for i in range(offsets.shape[0] - 1):
+            segment_start = offsets[i]
+            for j in range(segment_start + 1, offsets[i + 1]):
+                value = values[j]
+                k = j - 1
+                while k >= segment_start and values[k] > value:
+                    values[k + 1] = values[k]
+                    k -= 1
+                values[k + 1] = value
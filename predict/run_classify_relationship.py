@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
-from random import sample
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 from pickle import dump
-from os import listdir
+from subprocess import call
+import sys
 
 from population import PopulationUnpickler
 from sex import Sex
-from classify_relationship import generate_classifier, related_pairs
+from checkpoint import Checkpoint
+from classify_relationship import (generate_classifier, related_pairs,
+                                   shared_to_shard, merge_shards,
+                                   classifier_from_directory,
+                                   clear_suspected_parents)
 from recomb_genome import recombinators_from_directory, RecombGenomeGenerator
 from to_json import to_json
+from random_streams import make_rng, spawn, sample
 
 parser = ArgumentParser(description = "Generate a classifier which can (hopefully) identify individuals in a population.")
 parser.add_argument("population_file", help = "Pickled file with population")
@@ -20,7 +26,7 @@ parser.add_argument("num_iterations", type = int, default = 1000,
                     help = "Number of samples to collect from empirical distributions")
 parser.add_argument("--recover", "-r", default = False,
                     action="store_true",
-                    help = "work directory from interrupted run.")
+                    help = "Resume the interrupted run in work_dir from its last checkpoint. The other arguments must be the same as for the interrupted run.")
 parser.add_argument("--gen_back", "-g", type = int, default = 7,
                     help = "Ignore common ancestry more than the given number of generations back.")
 parser.add_argument("--num_labeled_nodes", "-n", type = int, default = 0,
@@ -29,16 +35,67 @@ parser.add_argument("--output_pickle", default = "distributions.pickle",
                     help = "File to store distributions in. Pickle format will be used. Default is 'distributions.pickle'")
 parser.add_argument("--non_paternity", "-np", type = float, default = 0.0,
                     help = "Non paternity rate for the adversary to assume.")
+parser.add_argument("--replicates", type = int, default = 1,
+                    help = "Number of iterations to simulate at once. Larger values are faster but use more memory.")
+parser.add_argument("--keep_samples", default = False, action = "store_true",
+                    help = "Keep every simulated shared length in the work directory, not only the statistics the distributions are fit from.")
+parser.add_argument("--processes", type = int, default = 1,
+                    help = "Number of processes to fit distributions with.")
+parser.add_argument("--seed", type = int, default = None,
+                    help = "Seed for picking labeled nodes, simulating and fitting. The same seed gives the same classifier.")
+parser.add_argument("--num_shards", type = int, default = 1,
+                    help = "Split the iterations between this many shards, each simulated by its own process. Requires --seed. Without --shard or --merge, runs every shard locally and then merges them.")
+parser.add_argument("--shard", type = int, default = None,
+                    help = "Only simulate this shard, numbered from 0, in a subdirectory of work_dir. Shards can be run on different machines and their directories copied to one work_dir to be merged.")
+parser.add_argument("--merge", default = False, action = "store_true",
+                    help = "Only merge the completed shards in work_dir and fit the classifier.")
+parser.add_argument("--workers", type = int, default = None,
+                    help = "Number of shards to run at once. Defaults to --num_shards.")
 parser.add_argument("--to_json", default = None,
                     help = "If this flag is present, will instead store the population as json for faster computation in another language")
 
 args = parser.parse_args()
+if args.num_shards < 1:
+    parser.error("num_shards must be >= 1")
+if args.num_shards > 1 and args.seed is None:
+    parser.error("--num_shards requires --seed, so that every shard picks the same labeled nodes.")
+if args.processes < 1:
+    parser.error("processes must be >= 1")
+if args.shard is not None and not 0 <= args.shard < args.num_shards:
+    parser.error("--shard must be between 0 and num_shards - 1")
+labeled_rng, classifier_rng = spawn(make_rng(args.seed), 2)
+
+if args.num_shards > 1 and args.shard is None and not args.merge:
+    print("Running {} shards".format(args.num_shards))
+    commands = [[sys.executable] + sys.argv + ["--shard", str(shard)]
+                for shard in range(args.num_shards)]
+    with ThreadPoolExecutor(args.workers or args.num_shards) as executor:
+        return_codes = list(executor.map(call, commands))
+    failed = [shard for shard, return_code in enumerate(return_codes)
+              if return_code != 0]
+    if len(failed) > 0:
+        sys.exit("Shards {} failed.".format(failed))
+    args.merge = True
 
 print("Loading population")
 with open(args.population_file, "rb") as pickle_file:
     population = PopulationUnpickler(pickle_file).load()
 
-if not args.recover:
+if args.merge:
+    print("Merging shards")
+    merge_shards(args.work_dir, args.num_shards)
+    _, fit_rng = spawn(classifier_rng, 2)
+    classifier = classifier_from_directory(args.work_dir,
+                                           population.id_mapping, fit_rng,
+                                           args.processes)
+    del population
+    print("Pickling classifier")
+    with open(args.output_pickle, "wb") as pickle_file:
+        dump(classifier, pickle_file)
+    sys.exit()
+
+# Shards pick the labeled nodes from the seed, even when recovering.
+if not args.recover or args.num_shards > 1:
     potentially_labeled = list(chain.from_iterable([generation.members
                                                     for generation
                                                     in population.generations[-3:]]))
@@ -46,21 +103,20 @@ if not args.recover:
         num_labeled_nodes = population.size // 100
     else:
         num_labeled_nodes = args.num_labeled_nodes
-    labeled_nodes = sample(potentially_labeled, num_labeled_nodes)
+    labeled_nodes = sample(potentially_labeled, num_labeled_nodes,
+                           labeled_rng)
 else:
     print("Recovering run")
-    labeled_nodes = [population.id_mapping[int(filename)]
-                     for filename in listdir(args.work_dir)]
+    checkpoint = Checkpoint.load(args.work_dir)
+    if checkpoint is None:
+        parser.error("No checkpoint to recover in {}".format(args.work_dir))
+    labeled_nodes = [population.id_mapping[node_id]
+                     for node_id in checkpoint.labeled_nodes]
 
 if args.to_json:
-    num_generations = population.num_generations
-    clear_index = num_generations - args.gen_back
-    to_clear = population.generations[clear_index].members
-    for node in to_clear:
-        node.suspected_mother = None
-        node.suspected_mother_id = None
-        node.suspected_father = None
-        node.suspected_father_id = None
+    # related_pairs ignores the older ancestry itself, but the exported
+    # population includes suspected parents, so they are cleared too.
+    clear_suspected_parents(population, args.gen_back)
     unlabeled_nodes = set(chain.from_iterable(generation.members
                                           for generation
                                           in population.generations[-3:]))
@@ -77,10 +133,23 @@ chrom_sizes = recombinators[Sex.Male]._num_bases
 genome_generator = RecombGenomeGenerator(chrom_sizes)
 
 
-print("Populating length classifier.")
-
 clobber = not (args.recover or args.num_iterations == 0)
 
+if args.shard is not None:
+    print("Simulating shard {} of {}.".format(args.shard, args.num_shards))
+    shared_to_shard(population, labeled_nodes, genome_generator,
+                    recombinators, args.work_dir, args.shard,
+                    args.num_shards, clobber = clobber,
+                    iterations = args.num_iterations,
+                    generations_back_shared = args.gen_back,
+                    min_segment_length = 5000000,
+                    non_paternity = args.non_paternity,
+                    rng = classifier_rng, replicates = args.replicates,
+                    keep_samples = args.keep_samples)
+    sys.exit()
+
+print("Populating length classifier.")
+
 classifier = generate_classifier(population, labeled_nodes,
                                  genome_generator, recombinators,
                                  args.work_dir,
@@ -88,7 +157,11 @@ classifier = generate_classifier(population, labeled_nodes,
                                  clobber = clobber,
                                  generations_back_shared = args.gen_back,
                                  min_segment_length = 5000000,
-                                 non_paternity = args.non_paternity)
+                                 non_paternity = args.non_paternity,
+                                 rng = classifier_rng,
+                                 replicates = args.replicates,
+                                 processes = args.processes,
+                                 keep_samples = args.keep_samples)
 
 del recombinators
 del labeled_nodes
@@ -0,0 +1,138 @@
+from os import fsync, makedirs, remove
+from os.path import exists, getsize, join
+
+import numpy as np
+
+# Columns of a sample store and their types. Each column is a file of
+# raw native endian values named after the column, and row i of the
+# store is entry i of every column. Lengths are 64 bit, as identical
+# twins share both homologs, twice the 32 bit range.
+COLUMNS = (("unlabeled", np.uint32),
+           ("labeled", np.uint32),
+           ("iteration", np.uint32),
+           ("length", np.uint64))
+COLUMN_FILENAME = "{}.bin"
+LABELED_NODES_FILENAME = "labeled_nodes.npy"
+
+class SampleStore:
+    """
+    Append only columnar store of simulated shared lengths, kept in a
+    directory. Each row is one sample: the shared length between an
+    unlabeled and a labeled node in one iteration.
+
+    Rows are appended in chunks to one file per column, and read back
+    as memory mapped arrays. If a write was interrupted the columns
+    can have different lengths, in which case only the rows present
+    in every column are read.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+        self._handles = None
+
+    @classmethod
+    def create(cls, directory, labeled_nodes, clobber = True):
+        """
+        Opens the store in directory for appending, creating the
+        directory if needed, and records labeled_nodes, the ids of the
+        labeled nodes. If clobber is True any existing samples are
+        removed.
+        """
+        makedirs(directory, exist_ok = True)
+        store = cls(directory)
+        if clobber:
+            for name, _ in COLUMNS:
+                filename = store._column_filename(name)
+                if exists(filename):
+                    remove(filename)
+        labeled_ids = sorted(labeled_nodes)
+        np.save(join(directory, LABELED_NODES_FILENAME),
+                np.array(labeled_ids, dtype = np.uint32))
+        return store
+
+    def _column_filename(self, name):
+        return join(self._directory, COLUMN_FILENAME.format(name))
+
+    @property
+    def labeled_nodes(self):
+        """
+        Returns the list of labeled node ids given to create.
+        """
+        return np.load(join(self._directory,
+                            LABELED_NODES_FILENAME)).tolist()
+
+    def append(self, unlabeled, labeled, iteration, length):
+        """
+        Appends rows to the store. Each argument is an array with an
+        entry per row, or a single value for every row.
+        """
+        num_rows = max(np.size(values) for values
+                       in (unlabeled, labeled, iteration, length))
+        if self._handles is None:
+            self._handles = [open(self._column_filename(name), "ab")
+                             for name, _ in COLUMNS]
+        for (name, dtype), values, handle in zip(COLUMNS,
+                                                 (unlabeled, labeled,
+                                                  iteration, length),
+                                                 self._handles):
+            values = np.broadcast_to(np.asarray(values), (num_rows,))
+            assert np.all(values <= np.iinfo(dtype).max), \
+                "{} value out of range".format(name)
+            handle.write(values.astype(dtype).tobytes())
+        for handle in self._handles:
+            handle.flush()
+
+    def sync(self):
+        """
+        Makes sure the appended rows are written to disk.
+        """
+        if self._handles is not None:
+            for handle in self._handles:
+                fsync(handle.fileno())
+
+    def truncate(self, num_rows):
+        """
+        Drops every row after the first num_rows, such as the rows
+        appended after the last checkpoint of an interrupted run.
+        """
+        assert num_rows <= len(self)
+        self.close()
+        for name, dtype in COLUMNS:
+            filename = self._column_filename(name)
+            if exists(filename):
+                with open(filename, "r+b") as column_file:
+                    column_file.truncate(num_rows *
+                                         np.dtype(dtype).itemsize)
+
+    def close(self):
+        if self._handles is not None:
+            for handle in self._handles:
+                handle.close()
+            self._handles = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        lengths = []
+        for name, dtype in COLUMNS:
+            filename = self._column_filename(name)
+            if not exists(filename):
+                return 0
+            lengths.append(getsize(filename) // np.dtype(dtype).itemsize)
+        return min(lengths)
+
+    def columns(self):
+        """
+        Returns a dict from column name to a read only memory mapped
+        array of the column.
+        """
+        num_rows = len(self)
+        if num_rows == 0:
+            return {name: np.empty(0, dtype = dtype)
+                    for name, dtype in COLUMNS}
+        return {name: np.memmap(self._column_filename(name), dtype = dtype,
+                                mode = "r", shape = (num_rows,))
+                for name, dtype in COLUMNS}
@@ -0,0 +1,390 @@
+from collections import OrderedDict
+from multiprocessing import Pool, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from genome_bank import GenomeBank, GenomeView, take_genomes
+from random_streams import spawn
+from recomb_genome import NUM_CHROMS
+from recomb_helper import gamete_bounds, gametes_packed_into
+from sex import Sex
+
+# Number of children mate_generation mates in each task. Children are
+# split into shards of this size whatever the number of processes,
+# and each shard draws from its own stream, so the result does not
+# depend on the number of processes.
+SHARD_CHILDREN = 1024
+
+# Number of SharedArrays a meiosis_pool worker keeps attached: the
+# parents, scratch output and result of the generation being mated.
+WORKER_ATTACHED = 3
+
+# The recombinators of a meiosis_pool worker, set when it starts.
+_worker_recombinators = None
+# SharedArrays the worker has attached, by the names of their blocks,
+# least recently used first. Tasks of the same generation reuse them rather than
+# mapping and faulting in the same pages again.
+_worker_attached = OrderedDict()
+
+class SharedArrays:
+    """
+    A set of named NumPy arrays stored in multiprocessing.shared_memory
+    blocks. The specs property can be sent to other processes, which
+    can open the same arrays with SharedArrays.attach.
+    """
+    def __init__(self, shared = True):
+        """
+        If shared is False the arrays are ordinary arrays of this
+        process, so the same code can run without a pool.
+        """
+        self.shared = shared
+        self._blocks = dict()
+        self.arrays = dict()
+
+    def create(self, name, shape, dtype):
+        """
+        Allocates a new shared array and returns it.
+        """
+        dtype = np.dtype(dtype)
+        if not self.shared:
+            array = np.empty(shape, dtype = dtype)
+            self.arrays[name] = array
+            return array
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = SharedMemory(create = True, size = size)
+        self._blocks[name] = block
+        array = np.ndarray(shape, dtype = dtype, buffer = block.buf)
+        self.arrays[name] = array
+        return array
+
+    def share(self, name, array):
+        """
+        Copies array into a new shared array and returns it.
+        """
+        array = np.asarray(array)
+        shared = self.create(name, array.shape, array.dtype)
+        shared[...] = array
+        return shared
+
+    @property
+    def specs(self):
+        return {name: (self._blocks[name].name, array.shape, array.dtype.str)
+                for name, array in self.arrays.items()}
+
+    @classmethod
+    def attach(cls, specs):
+        """
+        Opens the arrays described by specs, created in another process.
+        """
+        shared = cls()
+        for name, (block_name, shape, dtype) in specs.items():
+            block = _attach_block(block_name)
+            shared._blocks[name] = block
+            shared.arrays[name] = np.ndarray(shape, dtype = dtype,
+                                             buffer = block.buf)
+        return shared
+
+    def close(self, unlink = False):
+        # Arrays must be released before their buffers can be closed.
+        self.arrays.clear()
+        for block in self._blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self._blocks.clear()
+
+def _attach_block(name):
+    """
+    Opens an existing shared memory block without registering it with
+    this process's resource tracker. The creating process owns the
+    block, and a tracked block would be unlinked when this process
+    exits.
+    """
+    try:
+        return SharedMemory(name = name, track = False)
+    except TypeError:
+        # Before Python 3.13 attached blocks are always tracked.
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return SharedMemory(name = name)
+        finally:
+            resource_tracker.register = register
+
+class PackedGeneration:
+    """
+    The genomes mate_generation made for a generation, packed as by
+    pack_genomes in store, a SharedArrays with arrays starts, founder
+    and offsets. With a pool the store is in shared memory, so the
+    workers mating the next generation read their parents from it
+    directly. bank is a GenomeBank viewing the store, which the
+    members' genomes are views into.
+    """
+    def __init__(self, store, end):
+        self.store = store
+        self._end = end
+        arrays = store.arrays
+        self.bank = GenomeBank.from_packed(arrays["starts"],
+                                           arrays["founder"],
+                                           arrays["offsets"], end)
+
+    def __len__(self):
+        return (len(self.store.arrays["offsets"]) - 1) // 2
+
+    def genome(self, row):
+        return self.bank.genome(row)
+
+    def row(self, genome):
+        """
+        Returns the row of genome in the store, or None if genome is
+        not one of its genomes.
+        """
+        if isinstance(genome, GenomeView) and genome.bank is self.bank:
+            return genome.node_id
+        return None
+
+    def close(self, nodes = ()):
+        """
+        Releases the store, once the next generation has been mated
+        from it. If the store is shared, the genomes that nodes still
+        hold from it are first copied to a private bank of only those
+        rows, and the nodes are given views into that bank.
+        """
+        if self.store.shared:
+            self._keep(nodes)
+        self.store.close(unlink = True)
+
+    def _keep(self, nodes):
+        held = [(node, self.row(node.genome)) for node in nodes]
+        held = [(node, row) for node, row in held if row is not None]
+        # Maps each kept row to its row in the new bank.
+        new_row = dict()
+        for _, row in held:
+            new_row.setdefault(row, len(new_row))
+        arrays = self.store.arrays
+        kept = take_genomes(arrays["starts"], arrays["founder"],
+                            arrays["offsets"], list(new_row))
+        # Replacing the bank and the nodes' views drops the last
+        # references to the store's buffers.
+        self.bank = GenomeBank.from_packed(*kept, self._end)
+        for node, row in held:
+            node.genome = self.bank.genome(new_row[row])
+
+def meiosis_pool(processes, recombinators):
+    """
+    Returns a pool of processes for mate_generation. Each worker is
+    given recombinators once when it starts, rather than with every
+    task.
+    """
+    return Pool(processes, initializer = _set_worker_recombinators,
+                initargs = (recombinators,))
+
+def _set_worker_recombinators(recombinators):
+    global _worker_recombinators
+    _worker_recombinators = recombinators
+
+def _gamete_crossovers(mother_loci, mother_offsets, father_loci,
+                      father_offsets):
+    """
+    Combines the crossovers of the mother and father gametes of a
+    number of children, as returned by
+    Recombinator._batch_recombination_locations, into the loci,
+    loci_start and loci_stop arguments of gametes_packed. Gamete
+    2 * i is the mother homolog of child i, and gamete 2 * i + 1 is
+    the father homolog.
+    """
+    num_children = (len(mother_offsets) - 1) // NUM_CHROMS
+    loci = np.concatenate((mother_loci, father_loci))
+    loci_start = np.empty((2 * num_children, NUM_CHROMS), dtype = np.int64)
+    loci_start[0::2] = mother_offsets[:-1].reshape(-1, NUM_CHROMS)
+    loci_start[1::2] = (father_offsets[:-1].reshape(-1, NUM_CHROMS) +
+                        len(mother_loci))
+    loci_stop = np.empty_like(loci_start)
+    loci_stop[0::2] = mother_offsets[1:].reshape(-1, NUM_CHROMS)
+    loci_stop[1::2] = (father_offsets[1:].reshape(-1, NUM_CHROMS) +
+                       len(mother_loci))
+    return (loci, loci_start, loci_stop)
+
+def mate_generation(parents, mothers, fathers, founders, recombinators,
+                    end, pool = None, rng = None):
+    """
+    Mates the genomes of rows mothers[i] and fathers[i] of parents, a
+    SharedArrays of genomes packed as by pack_genomes such as the
+    store of a PackedGeneration. Returns a PackedGeneration whose
+    rows are the children, followed by founders, a tuple (starts,
+    founder, offsets) of genomes packed as by pack_genomes.
+
+    The children are mated SHARD_CHILDREN at a time, by the
+    processes of pool, a meiosis_pool, if given, in which case
+    parents must be in shared memory. The number of crossovers on
+    every chromosome is sampled here, so that each child has room for
+    gamete_bounds intervals in a scratch output. Each shard then
+    samples the crossover locations and starting homologs of its
+    children from its own stream, spawned from rng or seeded from the
+    global np.random state if rng is None, and writes their homologs
+    to the scratch output. Once every shard's lengths are known, the
+    shards copy their homologs to the store of the result.
+    """
+    mothers = np.asarray(mothers, dtype = np.int64)
+    fathers = np.asarray(fathers, dtype = np.int64)
+    assert len(mothers) == len(fathers)
+    num_children = len(mothers)
+    shared = pool is not None
+    assert not shared or parents.shared
+    shards = [(lo, min(lo + SHARD_CHILDREN, num_children))
+              for lo in range(0, num_children, SHARD_CHILDREN)]
+    counts_rng, shard_rngs = _shard_streams(rng, len(shards))
+    work = SharedArrays(shared)
+    store = None
+    try:
+        parent_rows = work.create("parents", 2 * num_children, np.int64)
+        parent_rows[0::2] = mothers
+        parent_rows[1::2] = fathers
+        counts = work.create("counts", (2 * num_children, NUM_CHROMS),
+                             np.int64)
+        counts[0::2] = recombinators[Sex.Female] \
+            ._batch_recombination_counts(num_children, counts_rng)
+        counts[1::2] = recombinators[Sex.Male] \
+            ._batch_recombination_counts(num_children, counts_rng)
+        work.share("chrom_starts", recombinators[Sex.Female]._offsets)
+        loci_offsets = np.zeros(counts.size + 1, dtype = np.int64)
+        np.cumsum(counts.ravel(), out = loci_offsets[1:])
+        bounds = gamete_bounds(parents.arrays["offsets"], parent_rows,
+                               loci_offsets[:-1].reshape(-1, NUM_CHROMS),
+                               loci_offsets[1:].reshape(-1, NUM_CHROMS))
+        scratch_offsets = work.create("scratch_offsets",
+                                      2 * num_children + 1, np.int64)
+        scratch_offsets[0] = 0
+        np.cumsum(bounds, out = scratch_offsets[1:])
+        work.create("scratch_starts", scratch_offsets[-1], np.uint32)
+        work.create("scratch_founder", scratch_offsets[-1], np.uint32)
+
+        gamete_counts = np.empty(2 * num_children, dtype = np.int64)
+        if shared:
+            tasks = [(parents.specs, work.specs, end, lo, hi, shard_rng)
+                     for (lo, hi), shard_rng in zip(shards, shard_rngs)]
+            results = pool.imap_unordered(_mate_shard_shared, tasks)
+        else:
+            results = (_mate_shard(parents.arrays, work.arrays,
+                                   recombinators, end, lo, hi, shard_rng)
+                       for (lo, hi), shard_rng in zip(shards, shard_rngs))
+        for lo, hi, shard_counts in results:
+            gamete_counts[2 * lo:2 * hi] = shard_counts
+
+        founder_starts, founder_founder, founder_offsets = founders
+        store = SharedArrays(shared)
+        offsets = store.create("offsets",
+                               2 * num_children + len(founder_offsets),
+                               np.int64)
+        offsets[0] = 0
+        np.cumsum(gamete_counts, out = offsets[1:2 * num_children + 1])
+        children_stop = offsets[2 * num_children]
+        offsets[2 * num_children + 1:] = children_stop + founder_offsets[1:]
+        starts = store.create("starts", offsets[-1], np.uint32)
+        founder = store.create("founder", offsets[-1], np.uint32)
+        starts[children_stop:] = founder_starts
+        founder[children_stop:] = founder_founder
+        del offsets, starts, founder
+        if shared:
+            tasks = [(work.specs, store.specs, lo, hi) for lo, hi in shards]
+            for _ in pool.imap_unordered(_compact_shard_shared, tasks):
+                pass
+        else:
+            for lo, hi in shards:
+                _compact_shard(work.arrays, store.arrays, lo, hi)
+        del parent_rows, counts, scratch_offsets
+    except BaseException:
+        if store is not None:
+            store.close(unlink = True)
+        raise
+    finally:
+        work.close(unlink = True)
+    return PackedGeneration(store, end)
+
+def _shard_streams(rng, num_shards):
+    """
+    Returns the stream mate_generation samples crossover counts from,
+    and a list of a stream for each shard.
+    """
+    if rng is None:
+        # Forked workers would all start from the same global state.
+        seed = int(np.random.randint(2 ** 63, dtype = np.uint64))
+        return (None, [np.random.default_rng([seed, shard])
+                       for shard in range(num_shards)])
+    counts_rng, *shard_rngs = spawn(rng, num_shards + 1)
+    return (counts_rng, shard_rngs)
+
+def _mate_shard(parents, work, recombinators, end, lo, hi, rng):
+    """
+    Mates children lo to hi of mate_generation, writing their homologs
+    to the scratch output in work. Returns (lo, hi, counts), where
+    counts is the number of intervals of each homolog.
+    """
+    counts = work["counts"]
+    mother_loci, mother_offsets = recombinators[Sex.Female] \
+        ._batch_recombination_loci(counts[2 * lo:2 * hi:2], rng)
+    father_loci, father_offsets = recombinators[Sex.Male] \
+        ._batch_recombination_loci(counts[2 * lo + 1:2 * hi:2], rng)
+    loci, loci_start, loci_stop = _gamete_crossovers(mother_loci,
+                                                     mother_offsets,
+                                                     father_loci,
+                                                     father_offsets)
+    first_homolog = (rng.random((2 * (hi - lo), NUM_CHROMS))
+                     >= 0.5).astype(np.uint8)
+    shard_counts = gametes_packed_into(parents["starts"], parents["founder"],
+                                       parents["offsets"],
+                                       work["parents"][2 * lo:2 * hi],
+                                       first_homolog, loci, loci_start,
+                                       loci_stop, work["chrom_starts"], end,
+                                       work["scratch_starts"],
+                                       work["scratch_founder"],
+                                       work["scratch_offsets"][2 * lo:2 * hi])
+    return (lo, hi, shard_counts)
+
+def _compact_shard(work, store, lo, hi):
+    """
+    Copies the homologs of children lo to hi of mate_generation from
+    the scratch output in work to store.
+    """
+    offsets = store["offsets"][2 * lo:2 * hi + 1]
+    lengths = np.diff(offsets)
+    source_i = (np.repeat(work["scratch_offsets"][2 * lo:2 * hi] -
+                          offsets[:-1], lengths) +
+                np.arange(offsets[0], offsets[-1]))
+    store["starts"][offsets[0]:offsets[-1]] = work["scratch_starts"][source_i]
+    store["founder"][offsets[0]:offsets[-1]] = \
+        work["scratch_founder"][source_i]
+
+def _worker_attach(specs):
+    """
+    Returns the arrays of specs, attached in a meiosis_pool worker.
+    Once more than WORKER_ATTACHED SharedArrays are attached, the
+    least recently used is closed, as its generation is done.
+    """
+    key = tuple(sorted(block_name for block_name, _, _ in specs.values()))
+    if key in _worker_attached:
+        _worker_attached.move_to_end(key)
+        return _worker_attached[key].arrays
+    _worker_attached[key] = SharedArrays.attach(specs)
+    if len(_worker_attached) > WORKER_ATTACHED:
+        _, oldest = _worker_attached.popitem(last = False)
+        oldest.close()
+    return _worker_attached[key].arrays
+
+def _mate_shard_shared(task):
+    """
+    Pool worker that runs _mate_shard on arrays in shared memory.
+    """
+    parent_specs, work_specs, end, lo, hi, rng = task
+    return _mate_shard(_worker_attach(parent_specs),
+                       _worker_attach(work_specs), _worker_recombinators,
+                       end, lo, hi, rng)
+
+def _compact_shard_shared(task):
+    """
+    Pool worker that runs _compact_shard on arrays in shared memory.
+    """
+    work_specs, store_specs, lo, hi = task
+    _compact_shard(_worker_attach(work_specs), _worker_attach(store_specs),
+                   lo, hi)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import random
+import unittest
+
+import numpy as np
+
+import classify_relationship
+from checkpoint import Checkpoint
+from classify_relationship import (shared_to_directory, shared_to_shard,
+                                   merge_shards, shard_directory)
+from genome_replicates import generate_genome_replicates
+from sample_store import SampleStore
+from test_population_genomes import (_pedigree, _recombinators,
+                                     _genome_generator)
+
+class Interrupt(Exception):
+    pass
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.recombinators = _recombinators()
+        self.population = _pedigree()
+        child = self.population.generations[2].members[0]
+        mother = self.population.generations[1].members[0]
+        self.labeled_nodes = [child, mother]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _run(self, directory, rng, clobber = True, interrupt_after = None):
+        calls = 0
+        def generate(*args, **kwargs):
+            nonlocal calls
+            if calls == interrupt_after:
+                raise Interrupt()
+            calls += 1
+            return generate_genome_replicates(*args, **kwargs)
+        with patch.object(classify_relationship,
+                          "generate_genome_replicates", generate):
+            shared_to_directory(self.population, self.labeled_nodes,
+                                _genome_generator(self.recombinators),
+                                self.recombinators, directory,
+                                clobber = clobber, iterations = 7,
+                                generations_back_shared = 3, rng = rng,
+                                replicates = 2, keep_samples = True)
+
+    def _assert_same(self, directory_a, directory_b):
+        checkpoint_a = Checkpoint.load(directory_a)
+        checkpoint_b = Checkpoint.load(directory_b)
+        self.assertEqual(checkpoint_a.completed_iterations, 7)
+        self.assertEqual(checkpoint_b.completed_iterations, 7)
+        for name, array in checkpoint_a.statistics.arrays().items():
+            np.testing.assert_array_equal(array,
+                                          checkpoint_b.statistics.arrays()[name])
+        columns_a = SampleStore(directory_a).columns()
+        columns_b = SampleStore(directory_b).columns()
+        self.assertEqual(len(columns_a["length"]),
+                         7 * len(checkpoint_a.statistics))
+        for name, column in columns_a.items():
+            np.testing.assert_array_equal(column, columns_b[name])
+
+    def test_resume_matches_uninterrupted(self):
+        complete = join(self.temp_dir.name, "complete")
+        resumed = join(self.temp_dir.name, "resumed")
+        self._run(complete, np.random.default_rng(3))
+        with self.assertRaises(Interrupt):
+            self._run(resumed, np.random.default_rng(3), interrupt_after = 2)
+        checkpoint = Checkpoint.load(resumed)
+        self.assertEqual(checkpoint.completed_iterations, 4)
+        self.assertEqual(sorted(checkpoint.labeled_nodes),
+                         sorted(node._id for node in self.labeled_nodes))
+        # Samples written after the last commit are dropped on resume.
+        with SampleStore(resumed) as store:
+            store.append(0, 0, 0, 0)
+        # The checkpoint's rng is used, not the one given.
+        self._run(resumed, np.random.default_rng(4), clobber = False)
+        self._assert_same(complete, resumed)
+
+    def test_resume_global_state(self):
+        complete = join(self.temp_dir.name, "complete")
+        resumed = join(self.temp_dir.name, "resumed")
+        random.seed(5)
+        np.random.seed(5)
+        self._run(complete, None)
+        random.seed(5)
+        np.random.seed(5)
+        with self.assertRaises(Interrupt):
+            self._run(resumed, None, interrupt_after = 1)
+        np.random.seed(6)
+        self._run(resumed, None, clobber = False)
+        self._assert_same(complete, resumed)
+
+    def test_nothing_to_resume(self):
+        directory = join(self.temp_dir.name, "work")
+        with SampleStore.create(directory, [1]) as store:
+            store.append(5, 1, 0, 10)
+        with self.assertRaises(ValueError):
+            self._run(directory, None, clobber = False)
+        self.assertEqual(len(SampleStore(directory)), 1)
+
+    def test_different_parameters(self):
+        directory = join(self.temp_dir.name, "work")
+        with self.assertRaises(Interrupt):
+            self._run(directory, None, interrupt_after = 1)
+        with self.assertRaises(ValueError):
+            shared_to_directory(self.population, self.labeled_nodes,
+                                _genome_generator(self.recombinators),
+                                self.recombinators, directory,
+                                clobber = False, iterations = 8,
+                                generations_back_shared = 3, replicates = 2)
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.directory = self.temp_dir.name
+        self.recombinators = _recombinators()
+        self.population = _pedigree()
+        child = self.population.generations[2].members[0]
+        self.labeled_nodes = [child]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _run_shard(self, shard, replicates = 2, num_shards = 2):
+        shared_to_shard(self.population, self.labeled_nodes,
+                        _genome_generator(self.recombinators),
+                        self.recombinators, self.directory, shard, num_shards,
+                        iterations = 5, generations_back_shared = 3,
+                        rng = np.random.default_rng(7),
+                        replicates = replicates,
+                        keep_samples = True)
+
+    def test_merge(self):
+        self._run_shard(0)
+        self._run_shard(1)
+        shards = [Checkpoint.load(shard_directory(self.directory, shard))
+                  for shard in range(2)]
+        self.assertEqual([shard.completed_iterations for shard in shards],
+                         [3, 2])
+        merge_shards(self.directory, 2)
+        merged = Checkpoint.load(self.directory)
+        self.assertEqual(merged.completed_iterations, 5)
+        np.testing.assert_array_equal(merged.statistics.counts,
+                                      5 * np.ones(len(merged.statistics)))
+        np.testing.assert_array_equal(merged.statistics.sums,
+                                      shards[0].statistics.sums +
+                                      shards[1].statistics.sums)
+        columns = SampleStore(self.directory).columns()
+        shard_columns = SampleStore(shard_directory(self.directory,
+                                                    1)).columns()
+        self.assertEqual(merged.num_samples, len(columns["iteration"]))
+        self.assertEqual(sorted(set(columns["iteration"].tolist())),
+                         list(range(5)))
+        shard_rows = len(shard_columns["length"])
+        np.testing.assert_array_equal(columns["length"][-shard_rows:],
+                                      shard_columns["length"])
+
+    def test_merge_incomplete(self):
+        self._run_shard(0)
+        with self.assertRaises(ValueError):
+            merge_shards(self.directory, 2)
+        self._run_shard(1, replicates = 3)
+        with self.assertRaises(ValueError):
+            merge_shards(self.directory, 2)
+
+    def test_merge_missing_shard(self):
+        for shard in range(3):
+            self._run_shard(shard, num_shards = 3)
+        with self.assertRaises(ValueError):
+            merge_shards(self.directory, 2)
+        merge_shards(self.directory, 3)
+        self.assertEqual(Checkpoint.load(self.directory).completed_iterations,
+                         5)
+
+if __name__ == '__main__':
+    unittest.main()
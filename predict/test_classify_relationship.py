@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+from types import SimpleNamespace
+import unittest
+
+from classify_relationship import (related_pairs, shared_ancestry_founders,
+                                   clear_suspected_parents)
+from generation import Generation
+from node import NodeGenerator
+from sex import Sex
+
+class TestRelatedPairs(unittest.TestCase):
+    def setUp(self):
+        """
+        Two cousins sharing grandparents, with a parent of each, and
+        a person unrelated to everyone.
+        """
+        generator = NodeGenerator()
+        grandmother = generator.generate_node(sex = Sex.Female)
+        grandfather = generator.generate_node(sex = Sex.Male)
+        self.mother = generator.generate_node(grandfather, grandmother,
+                                              sex = Sex.Female)
+        self.uncle = generator.generate_node(grandfather, grandmother,
+                                             sex = Sex.Male)
+        father = generator.generate_node(sex = Sex.Male)
+        aunt = generator.generate_node(sex = Sex.Female)
+        self.child = generator.generate_node(father, self.mother)
+        self.cousin = generator.generate_node(self.uncle, aunt)
+        self.unrelated = generator.generate_node()
+        generations = [Generation([grandmother, grandfather]),
+                       Generation([self.mother, self.uncle, father, aunt]),
+                       Generation([self.child, self.cousin,
+                                   self.unrelated])]
+        self.population = SimpleNamespace(generations = generations,
+                                          num_generations = 3)
+        self.unlabeled = [self.child, self.cousin, self.unrelated]
+
+    def test_shared_grandparents(self):
+        pairs = related_pairs(self.unlabeled, [self.cousin, self.mother],
+                              self.population, 3)
+        self.assertEqual(set(pairs), {(self.child, self.cousin),
+                                      (self.child, self.mother),
+                                      (self.cousin, self.mother)})
+
+    def test_cut_off(self):
+        # The grandparents are too far back, so only the mother and
+        # her child are related.
+        pairs = related_pairs(self.unlabeled, [self.cousin, self.mother],
+                              self.population, 2)
+        self.assertEqual(pairs, [(self.child, self.mother)])
+        self.assertIs(self.mother.suspected_mother,
+                      self.population.generations[0].members[0])
+
+    def test_founders(self):
+        self.assertEqual(shared_ancestry_founders(self.population, 2),
+                         set(self.population.generations[1].members))
+        self.assertEqual(shared_ancestry_founders(self.population, 5),
+                         frozenset())
+
+    def test_clear_suspected_parents(self):
+        clear_suspected_parents(self.population, 5)
+        self.assertIs(self.mother.suspected_mother,
+                      self.population.generations[0].members[0])
+        clear_suspected_parents(self.population, 2)
+        self.assertIsNone(self.mother.suspected_mother)
+        self.assertIsNone(self.mother.suspected_father)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,14 @@ from unittest.mock import MagicMock
 import numpy as np
 
 # import pyximport; pyximport.install()
-from common_segments import common_homolog_segments, _consolidate_sequence
+from common_segments import (common_homolog_segments, _consolidate_sequence,
+                             pack_genomes, shared_segment_length,
+                             shared_segment_length_pairs,
+                             shared_segment_stats, founder_set,
+                             may_share_founder, pack_founder_sets,
+                             common_segment_columns,
+                             common_segment_columns_pairs,
+                             packed_founder_sets)
 
 uint32 = np.uint32
 
@@ -123,5 +130,168 @@ class TestConsolidateSequence(unittest.TestCase):
         con = _consolidate_sequence(seq)
         self.assertEqual(con, [(0, 10)])
 
+def _homolog(starts, founder, end = 10):
+    homolog = MagicMock()
+    homolog.starts = np.array(starts, dtype = uint32)
+    homolog.founder = np.array(founder, dtype = uint32)
+    homolog.end = end
+    return homolog
+
+def _genome(mother, father):
+    genome = MagicMock()
+    genome.mother = mother
+    genome.father = father
+    return genome
+
+class TestSharedSegmentLength(unittest.TestCase):
+    def test_pack_offsets(self):
+        a = _genome(_homolog([0], [0]), _homolog([0, 5], [1, 2]))
+        b = _genome(_homolog([0, 2, 4], [3, 4, 5]), _homolog([0], [6]))
+        starts, founder, offsets = pack_genomes([a, b])
+        np.testing.assert_array_equal(offsets, [0, 1, 3, 6, 7])
+        np.testing.assert_array_equal(starts, [0, 0, 5, 0, 2, 4, 0])
+        np.testing.assert_array_equal(founder, [0, 1, 2, 3, 4, 5, 6])
+
+    def test_all_homolog_pairs(self):
+        query = _genome(_homolog([0, 5], [1, 2]), _homolog([0], [3]))
+        same = _genome(_homolog([0, 5], [1, 2]), _homolog([0], [3]))
+        swapped = _genome(_homolog([0], [3]), _homolog([0, 5], [1, 2]))
+        unrelated = _genome(_homolog([0], [4]), _homolog([0], [5]))
+        lengths = [shared_segment_length(query, other, 0)
+                   for other in (same, swapped, unrelated)]
+        self.assertEqual(lengths, [20, 20, 0])
+
+    def test_minimum_length_after_merge(self):
+        # The segments (0, 3) and (3, 6) are merged before the
+        # minimum length is applied.
+        query = _genome(_homolog([0, 3, 6], [1, 1, 2]), _homolog([0], [3]))
+        other = _genome(_homolog([0, 6, 8], [1, 4, 2]), _homolog([0], [5]))
+        self.assertEqual(shared_segment_length(query, other, 3), 6)
+        self.assertEqual(shared_segment_length(query, other, 7), 0)
+
+class TestSharedSegmentStats(unittest.TestCase):
+    def test_merged_segment_stats(self):
+        query = _genome(_homolog([0, 3, 6], [1, 1, 2]), _homolog([0], [3]))
+        other = _genome(_homolog([0, 6, 8], [1, 4, 2]), _homolog([0], [3]))
+        self.assertEqual(shared_segment_stats(query, other, 0),
+                         (18, 3, 10))
+        self.assertEqual(shared_segment_stats(query, other, 3),
+                         (16, 2, 10))
+        self.assertEqual(shared_segment_stats(query, other, 11),
+                         (0, 0, 0))
+
+class TestFounderSet(unittest.TestCase):
+    def test_founder_set(self):
+        founders = founder_set(_homolog([0, 5], [70000, 1]),
+                               _homolog([0, 3], [1, 4100]))
+        np.testing.assert_array_equal(founders, [1, 4100, 70000])
+        self.assertEqual(founders.dtype, np.uint32)
+
+    def test_may_share_founder(self):
+        a = _genome(_homolog([0, 5], [1, 2]), _homolog([0], [3]))
+        b = _genome(_homolog([0], [4]), _homolog([0, 5], [5, 2]))
+        c = _genome(_homolog([0], [6]), _homolog([0], [7]))
+        # Ids equal modulo a power of two are still different founders.
+        d = _genome(_homolog([0], [1 + 4096]), _homolog([0], [3 + 2 ** 20]))
+        for genome in (a, b, c, d):
+            genome.founders = founder_set(genome.mother, genome.father)
+        self.assertTrue(may_share_founder(a, b))
+        self.assertFalse(may_share_founder(a, c))
+        self.assertFalse(may_share_founder(a, d))
+        c.founders = None
+        self.assertTrue(may_share_founder(a, c))
+
+    def test_pairs_skip_disjoint(self):
+        genomes = [_genome(_homolog([0, 5], [1, 2]), _homolog([0], [3])),
+                   _genome(_homolog([0], [4]), _homolog([0, 5], [5, 2])),
+                   _genome(_homolog([0], [6]), _homolog([0], [7]))]
+        for genome in genomes:
+            genome.founders = founder_set(genome.mother, genome.father)
+        packed = pack_genomes(genomes)
+        pairs = np.array([(0, 1), (0, 2)], dtype = np.int64)
+        lengths = shared_segment_length_pairs(*packed, 10, pairs, 0,
+                                              founder_sets =
+                                              pack_founder_sets(genomes))
+        np.testing.assert_array_equal(lengths, [5, 0])
+
+    def test_packed_founder_sets(self):
+        genomes = [_genome(_homolog([0, 5], [1, 2]), _homolog([0], [3])),
+                   _genome(_homolog([0], [4]), _homolog([0, 5], [5, 4100])),
+                   _genome(_homolog([0, 5], [9, 9]), _homolog([0], [9]))]
+        for genome in genomes:
+            genome.founders = None
+        starts, founder, offsets = pack_genomes(genomes)
+        founders, founder_offsets = packed_founder_sets(founder, offsets)
+        expected_founders, expected_offsets = pack_founder_sets(genomes)
+        np.testing.assert_array_equal(founders, expected_founders)
+        np.testing.assert_array_equal(founder_offsets, expected_offsets)
+        np.testing.assert_array_equal(founder_offsets, [0, 3, 6, 7])
+
+class TestSharedSegmentLengthPairs(unittest.TestCase):
+    def test_matches_pairwise(self):
+        genomes = [_genome(_homolog([0, 5], [1, 2]), _homolog([0], [3])),
+                   _genome(_homolog([0], [3]), _homolog([0, 5], [1, 4])),
+                   _genome(_homolog([0, 3, 6], [1, 1, 2]),
+                           _homolog([0], [5]))]
+        starts, founder, offsets = pack_genomes(genomes)
+        pairs = np.array([(0, 1), (0, 2), (1, 2), (2, 2)], dtype = np.int64)
+        founder_sets = packed_founder_sets(founder, offsets)
+        for num_threads, sets in ((1, None), (2, None), (2, founder_sets)):
+            lengths = shared_segment_length_pairs(starts, founder, offsets,
+                                                  10, pairs, 0,
+                                                  num_threads = num_threads,
+                                                  founder_sets = sets)
+            expected = [shared_segment_length(genomes[a], genomes[b], 0)
+                        for a, b in pairs]
+            np.testing.assert_array_equal(lengths, expected)
+
+    def test_index_out_of_range(self):
+        genomes = [_genome(_homolog([0], [1]), _homolog([0], [2]))] * 2
+        starts, founder, offsets = pack_genomes(genomes)
+        for pairs in ([(0, 2)], [(-1, 0)]):
+            pairs = np.array(pairs, dtype = np.int64)
+            with self.assertRaises(IndexError):
+                shared_segment_length_pairs(starts, founder, offsets, 10,
+                                            pairs, 0)
+            with self.assertRaises(IndexError):
+                common_segment_columns_pairs(starts, founder, offsets, 10,
+                                             pairs)
+
+class TestCommonSegmentColumns(unittest.TestCase):
+    def test_homolog_pair_codes(self):
+        a = _genome(_homolog([0, 5], [1, 2]), _homolog([0], [3]))
+        b = _genome(_homolog([0], [3]), _homolog([0, 5], [1, 4]))
+        columns = common_segment_columns(a, b)
+        np.testing.assert_array_equal(columns.start, [0, 0])
+        np.testing.assert_array_equal(columns.stop, [10, 5])
+        np.testing.assert_array_equal(columns.homolog_pair, [1, 2])
+        np.testing.assert_array_equal(columns.pair, [0, 0])
+        self.assertIsNone(columns.chromosome)
+
+    def test_chromosome_boundary(self):
+        a = _genome(_homolog([0, 4], [1, 1]), _homolog([0], [3]))
+        b = _genome(_homolog([0], [1]), _homolog([0], [5]))
+        columns = common_segment_columns(a, b)
+        np.testing.assert_array_equal(columns.start, [0])
+        np.testing.assert_array_equal(columns.stop, [10])
+        chrom_starts = np.array([0, 4], dtype = uint32)
+        columns = common_segment_columns(a, b, chrom_starts)
+        np.testing.assert_array_equal(columns.start, [0, 4])
+        np.testing.assert_array_equal(columns.stop, [4, 10])
+        np.testing.assert_array_equal(columns.chromosome, [0, 1])
+
+    def test_pairs(self):
+        genomes = [_genome(_homolog([0], [1]), _homolog([0], [2])),
+                   _genome(_homolog([0], [2]), _homolog([0], [3])),
+                   _genome(_homolog([0, 5], [3, 4]), _homolog([0], [5]))]
+        starts, founder, offsets = pack_genomes(genomes)
+        pairs = np.array([(0, 1), (0, 2), (1, 2)], dtype = np.int64)
+        columns = common_segment_columns_pairs(starts, founder, offsets, 10,
+                                               pairs)
+        np.testing.assert_array_equal(columns.pair, [0, 2])
+        np.testing.assert_array_equal(columns.start, [0, 0])
+        np.testing.assert_array_equal(columns.stop, [10, 5])
+        np.testing.assert_array_equal(columns.homolog_pair, [1, 1])
+
 if __name__ == '__main__':
     unittest.main()
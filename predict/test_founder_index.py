@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from common_segments import shared_segment_length
+from diploid import Diploid
+from founder_index import founder_index_from_genomes
+from recomb_genome import RecombGenome
+
+uint32 = np.uint32
+
+def _homolog(starts, founder, end = 20):
+    return Diploid(np.array(starts, dtype = uint32), end,
+                   np.array(founder, dtype = uint32))
+
+class TestFounderIndex(unittest.TestCase):
+    def setUp(self):
+        self.genomes = [
+            RecombGenome(_homolog([0, 5, 10], [1, 2, 3]),
+                         _homolog([0, 15], [4, 5])),
+            RecombGenome(_homolog([0, 8], [1, 6]),
+                         _homolog([0, 4, 12], [7, 2, 3])),
+            RecombGenome(_homolog([0], [8]), _homolog([0], [9])),
+            RecombGenome(_homolog([0, 2, 5, 16], [4, 1, 2, 3]),
+                         _homolog([0, 10], [5, 5]))]
+        self.index = founder_index_from_genomes(self.genomes)
+
+    def test_matches_pairwise(self):
+        for minimum_length in (0, 3, 6, 100):
+            for genome in self.genomes:
+                expected = [shared_segment_length(genome, other,
+                                                  minimum_length)
+                            for other in self.genomes]
+                actual = self.index.shared_lengths(genome, minimum_length)
+                np.testing.assert_array_equal(actual, expected)
+
+    def test_merges_contiguous(self):
+        # (0, 5) of founder 1 and (5, 10) of founder 2 are shared with
+        # the first genome's mother and merge into one segment.
+        query = RecombGenome(_homolog([0, 5, 10], [1, 2, 10]),
+                             _homolog([0], [11]))
+        np.testing.assert_array_equal(self.index.shared_lengths(query, 10),
+                                      [10, 0, 0, 0])
+
+    def test_unknown_founders(self):
+        query = RecombGenome(_homolog([0], [100]), _homolog([0], [101]))
+        np.testing.assert_array_equal(self.index.shared_lengths(query, 0),
+                                      [0, 0, 0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
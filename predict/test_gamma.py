@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from gamma import (fit_hurdle_gamma, fit_hurdle_gamma_batch,
+                   hurdle_gamma_statistics, SUFFICIENT_DATA_POINTS)
+
+class TestFitHurdleGammaBatch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        counts = [200, 0, 3, 50, 1000, SUFFICIENT_DATA_POINTS + 1]
+        self.samples = []
+        for count, shape in zip(counts, [0.5, 1, 2, 4, 1.5, 3]):
+            sample = rng.gamma(shape, 1e7, count).astype(np.uint32)
+            sample[rng.random(count) < 0.2] = 0
+            self.samples.append(sample)
+        # Exactly SUFFICIENT_DATA_POINTS nonzero values is too few.
+        self.samples.append(np.array([0] + [10 ** 6] *
+                                     SUFFICIENT_DATA_POINTS,
+                                     dtype = np.uint32))
+        self.values = np.concatenate(self.samples)
+        self.offsets = np.zeros(len(self.samples) + 1, dtype = np.int64)
+        np.cumsum([len(sample) for sample in self.samples],
+                  out = self.offsets[1:])
+
+    def test_matches_scalar(self):
+        rng = np.random.default_rng(1)
+        shapes, scales, zero_probs = fit_hurdle_gamma_batch(self.values,
+                                                            self.offsets, rng)
+        for i, sample in enumerate(self.samples):
+            nonzero = np.count_nonzero(sample)
+            # Noise for each sample is drawn in order from one stream.
+            rng = np.random.default_rng(1)
+            rng.uniform(size = np.count_nonzero(self.values[:self.offsets[i]]))
+            shape, scale, zero_prob = fit_hurdle_gamma(sample, rng)
+            if shape is None:
+                self.assertTrue(np.isnan(shapes[i]))
+                self.assertTrue(np.isnan(scales[i]))
+                self.assertTrue(np.isnan(zero_probs[i]))
+                continue
+            self.assertGreater(nonzero, SUFFICIENT_DATA_POINTS)
+            self.assertAlmostEqual(shapes[i], shape, delta = 1e-5)
+            self.assertAlmostEqual(scales[i] / scale, 1, delta = 1e-5)
+            self.assertEqual(zero_probs[i], zero_prob)
+
+    def test_statistics(self):
+        counts, zeros, sums, log_sums = hurdle_gamma_statistics(self.values,
+                                                                self.offsets)
+        np.testing.assert_array_equal(counts, [len(sample) for sample
+                                               in self.samples])
+        np.testing.assert_array_equal(zeros, [np.sum(sample == 0) for sample
+                                              in self.samples])
+        self.assertEqual(sums[1], 0)
+        self.assertEqual(log_sums[1], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+from pickle import dumps, loads
+import unittest
+
+import numpy as np
+
+from diploid import Diploid
+from genome_bank import GenomeBank
+from recomb_genome import RecombGenome
+
+uint32 = np.uint32
+
+def _genome(mother_starts, mother_founder, father_starts, father_founder):
+    mother = Diploid(np.array(mother_starts, dtype = uint32), 10,
+                     np.array(mother_founder, dtype = uint32))
+    father = Diploid(np.array(father_starts, dtype = uint32), 10,
+                     np.array(father_founder, dtype = uint32))
+    return RecombGenome(mother, father)
+
+class TestGenomeBank(unittest.TestCase):
+    def setUp(self):
+        self.genomes = {0: _genome([0], [0], [0, 5], [1, 2]),
+                        2: _genome([0, 2, 4], [3, 4, 5], [0], [6])}
+        self.bank = GenomeBank(self.genomes)
+
+    def test_offsets_by_node_id(self):
+        np.testing.assert_array_equal(self.bank.offsets,
+                                      [0, 1, 3, 3, 3, 6, 7])
+        np.testing.assert_array_equal(self.bank.starts,
+                                      [0, 0, 5, 0, 2, 4, 0])
+
+    def test_contains(self):
+        self.assertIn(0, self.bank)
+        self.assertNotIn(1, self.bank)
+        self.assertIn(2, self.bank)
+        self.assertNotIn(3, self.bank)
+        self.assertEqual(len(self.bank), 2)
+
+    def test_view_matches_genome(self):
+        for node_id, genome in self.genomes.items():
+            view = self.bank.genome(node_id)
+            for expected, actual in zip(genome, view):
+                np.testing.assert_array_equal(expected.starts, actual.starts)
+                np.testing.assert_array_equal(expected.founder,
+                                              actual.founder)
+                self.assertEqual(expected.end, actual.end)
+
+    def test_pickle_view(self):
+        view = loads(dumps(self.bank.genome(2)))
+        np.testing.assert_array_equal(view.mother.founder, [3, 4, 5])
+        np.testing.assert_array_equal(view.father.founder, [6])
+
+if __name__ == '__main__':
+    unittest.main()
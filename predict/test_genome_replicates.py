@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from common_segments import pack_genomes, shared_segment_length
+from diploid import Diploid
+from genome_replicates import (generate_genome_replicates, take_genomes,
+                               concatenate_genomes)
+from population_genomes import generate_genomes_for
+from recomb_genome import RecombGenome
+from test_population_genomes import (_pedigree, _recombinators,
+                                     _genome_generator)
+
+def _genome(replicates, node, replicate):
+    i = replicates.index(node, replicate)
+    offsets = replicates.offsets
+    homologs = [Diploid(replicates.starts[start:stop], replicates.end,
+                        replicates.founder[start:stop])
+                for start, stop in ((offsets[2 * i], offsets[2 * i + 1]),
+                                    (offsets[2 * i + 1], offsets[2 * i + 2]))]
+    return RecombGenome(*homologs)
+
+def _arrays(genome):
+    return [homolog.tolist() for homolog
+            in (genome.mother.starts, genome.mother.founder,
+                genome.father.starts, genome.father.founder)]
+
+class TestPackedHelpers(unittest.TestCase):
+    def test_take_and_concatenate(self):
+        genomes = [RecombGenome(Diploid(np.array([0, 5], dtype = np.uint32),
+                                        10,
+                                        np.array([i, i], dtype = np.uint32)),
+                                Diploid(np.array([0], dtype = np.uint32), 10,
+                                        np.array([i], dtype = np.uint32)))
+                   for i in range(3)]
+        packed = pack_genomes(genomes)
+        taken = take_genomes(*packed, [2, 0])
+        expected = pack_genomes([genomes[2], genomes[0]])
+        for array, expected_array in zip(taken, expected):
+            np.testing.assert_array_equal(array, expected_array)
+        combined = concatenate_genomes(pack_genomes(genomes[:1]),
+                                       pack_genomes(genomes[1:]))
+        for array, expected_array in zip(combined, packed):
+            np.testing.assert_array_equal(array, expected_array)
+
+class TestGenerateGenomeReplicates(unittest.TestCase):
+    def test_single_replicate_matches_generate_genomes_for(self):
+        recombinators = _recombinators()
+        population = _pedigree()
+        child, twin, unrelated = population.generations[2].members
+        mother = population.generations[1].members[0]
+        targets = [child, twin, mother, unrelated]
+        replicates = generate_genome_replicates(population, targets,
+                                                _genome_generator(recombinators),
+                                                recombinators, 1,
+                                                rng = np.random.default_rng(2))
+        self.assertTrue(all(node.genome is None
+                            for node in population.members))
+        generate_genomes_for(population, targets,
+                             _genome_generator(recombinators), recombinators,
+                             batch = True, rng = np.random.default_rng(2))
+        for node in targets:
+            self.assertEqual(_arrays(_genome(replicates, node, 0)),
+                             _arrays(node.genome))
+
+    def test_shared_lengths(self):
+        recombinators = _recombinators()
+        population = _pedigree()
+        child, twin, unrelated = population.generations[2].members
+        mother, father, other = population.generations[1].members
+        pairs = [(child, mother), (child, twin), (unrelated, father)]
+        nodes = [child, twin, unrelated, mother, father]
+        replicates = generate_genome_replicates(population, nodes,
+                                                _genome_generator(recombinators),
+                                                recombinators, 4,
+                                                rng = np.random.default_rng(2))
+        lengths = replicates.shared_lengths(pairs, 0)
+        self.assertEqual(lengths.shape, (3, 4))
+        for i, (node_a, node_b) in enumerate(pairs):
+            for k in range(4):
+                expected = shared_segment_length(_genome(replicates,
+                                                         node_a, k),
+                                                 _genome(replicates,
+                                                         node_b, k), 0)
+                self.assertEqual(lengths[i, k], expected)
+        # Twins share every replicate's genome, and the unrelated
+        # person shares nothing.
+        np.testing.assert_array_equal(lengths[1], [2 * 440] * 4)
+        np.testing.assert_array_equal(lengths[2], [0] * 4)
+
+    def test_replicates_differ(self):
+        recombinators = _recombinators()
+        population = _pedigree()
+        child = population.generations[2].members[0]
+        replicates = generate_genome_replicates(population, [child],
+                                                _genome_generator(recombinators),
+                                                recombinators, 2)
+        founders = [set(_genome(replicates, child, k).mother.founder.tolist())
+                    for k in range(2)]
+        self.assertTrue(founders[0].isdisjoint(founders[1]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+from multiprocessing import Pool
+from os.path import join
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from checkpoint import Checkpoint
+from classify_relationship import distributions_from_directory
+from gamma import fit_hurdle_gamma_batch
+from pair_statistics import PairStatistics
+
+class TestPairStatistics(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.lengths = rng.gamma(2.0, 1e7, (4, 60)).astype(np.uint32)
+        self.lengths[rng.random((4, 60)) < 0.25] = 0
+        self.lengths[3] = 0
+        self.statistics = PairStatistics([5, 6, 7, 8], [1, 1, 2, 2])
+        # Samples arrive a few iterations at a time.
+        for batch in np.split(self.lengths, 3, axis = 1):
+            self.statistics.add(batch, rng)
+
+    def test_statistics(self):
+        np.testing.assert_array_equal(self.statistics.counts, [60] * 4)
+        np.testing.assert_array_equal(self.statistics.zero_counts,
+                                      np.sum(self.lengths == 0, axis = 1))
+        nonzero_counts = np.sum(self.lengths != 0, axis = 1)
+        # Noise adds less than 10000 to each nonzero sample.
+        difference = (self.statistics.sums -
+                      np.sum(self.lengths, axis = 1, dtype = np.float64))
+        self.assertTrue(np.all(difference >= 0))
+        self.assertTrue(np.all(difference < 10000 * nonzero_counts + 1))
+
+    def test_fit_matches_batch(self):
+        offsets = np.arange(5) * 60
+        expected = fit_hurdle_gamma_batch(self.lengths.ravel(), offsets)
+        for fit, expected_fit in zip(self.statistics.fit(), expected):
+            np.testing.assert_allclose(fit, expected_fit, rtol = 1e-2)
+        self.assertTrue(np.isnan(self.statistics.fit()[0][3]))
+
+    def test_fit_pool(self):
+        expected = self.statistics.fit()
+        with Pool(2) as pool:
+            fits = self.statistics.fit(pool, chunk_pairs = 3)
+        for fit, expected_fit in zip(fits, expected):
+            np.testing.assert_array_equal(fit, expected_fit)
+
+    def test_distributions_from_directory(self):
+        with TemporaryDirectory() as directory:
+            filename = join(directory, "statistics.npz")
+            self.statistics.save(filename)
+            loaded = PairStatistics.load(filename)
+            np.testing.assert_array_equal(loaded.log_sums,
+                                          self.statistics.log_sums)
+            Checkpoint([1, 2], dict(), loaded, None).commit(directory, 60, 0)
+            with self.assertWarns(UserWarning):
+                distributions = distributions_from_directory(directory,
+                                                             {5: None,
+                                                              6: None,
+                                                              8: None})
+            with self.assertWarns(UserWarning):
+                pooled = distributions_from_directory(directory,
+                                                      {5: None, 6: None,
+                                                       8: None},
+                                                      processes = 2)
+        self.assertEqual(pooled, distributions)
+        shapes, scales, zero_probs = self.statistics.fit()
+        self.assertEqual(set(distributions), {(5, 1), (6, 1)})
+        self.assertEqual(distributions[6, 1].shape, shapes[1])
+        self.assertEqual(distributions[6, 1].zero_prob, zero_probs[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+from os.path import abspath, dirname, join
+import unittest
+
+import numpy as np
+
+from island_model import tree_from_file
+from node import NodeGenerator
+from population import HierarchicalIslandPopulation
+from random_streams import spawn, choice
+
+TREE_FILE = join(dirname(abspath(__file__)), "..", "data", "two_islands")
+
+def _population(seed, size = 200, num_generations = 4):
+    """
+    Builds a population the same way generate_population.py does,
+    returning the parents and sex of every member by node id.
+    """
+    founder_rng, population_rng = spawn(np.random.default_rng(seed), 2)
+    node_generator = NodeGenerator()
+    tree = tree_from_file(TREE_FILE)
+    leaves = tree.leaves
+    for _ in range(size):
+        person = node_generator.generate_node(rng = founder_rng)
+        tree.add_individual(choice(leaves, founder_rng), person)
+    population = HierarchicalIslandPopulation(tree)
+    for generation_rng in spawn(population_rng, num_generations - 1):
+        population.new_generation(non_paternity_rate = 0.05,
+                                  adoption_rate = 0.02,
+                                  unknown_mother_rate = 0.01,
+                                  unknown_father_rate = 0.01,
+                                  rng = generation_rng)
+    return [(node._id, node.sex, node._mother_id, node._father_id,
+             node._suspected_mother_id, node._suspected_father_id,
+             node._twin_id)
+            for node in population.members]
+
+class TestNewGenerationRng(unittest.TestCase):
+    def test_same_seed(self):
+        self.assertEqual(_population(1), _population(1))
+
+    def test_different_seed(self):
+        self.assertNotEqual(_population(1), _population(2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+from unittest.mock import MagicMock
+import unittest
+
+import numpy as np
+
+import recomb_genome
+from generation import Generation
+from node import NodeGenerator
+from population_genomes import (generate_genomes, generate_genomes_for,
+                                ancestral_closure)
+from sex import Sex
+
+def _recombinators():
+    """
+    Returns recombinators where every chromosome is 20 bases long.
+    """
+    data = {chrom: [[0, 1.0, 0.0], [10, 1.0, 10.0], [20, 1.0, 20.0]]
+            for chrom in recomb_genome.CHROMOSOME_ORDER}
+    recombinator = recomb_genome.Recombinator(data)
+    return {Sex.Male: recombinator, Sex.Female: recombinator}
+
+def _pedigree():
+    """
+    Returns a population of three generations, where the last
+    generation has one child of two children of the first generation,
+    and one unrelated person.
+    """
+    generator = NodeGenerator()
+    grandmother_1 = generator.generate_node(sex = Sex.Female)
+    grandfather_1 = generator.generate_node(sex = Sex.Male)
+    grandmother_2 = generator.generate_node(sex = Sex.Female)
+    grandfather_2 = generator.generate_node(sex = Sex.Male)
+    other_mother = generator.generate_node(sex = Sex.Female)
+    other_father = generator.generate_node(sex = Sex.Male)
+    mother = generator.generate_node(grandfather_1, grandmother_1,
+                                     sex = Sex.Female)
+    father = generator.generate_node(grandfather_2, grandmother_2,
+                                     sex = Sex.Male)
+    other = generator.generate_node(other_father, other_mother)
+    child = generator.generate_node(father, mother)
+    twin = generator.twin_node(child)
+    unrelated = generator.generate_node()
+    population = MagicMock()
+    population.generations = [Generation([grandmother_1, grandfather_1,
+                                          grandmother_2, grandfather_2,
+                                          other_mother, other_father]),
+                              Generation([mother, father, other]),
+                              Generation([child, twin, unrelated])]
+    population.members = [node for generation in population.generations
+                          for node in generation.members]
+    population.num_generations = len(population.generations)
+    return population
+
+def _genome_generator(recombinators):
+    return recomb_genome.RecombGenomeGenerator(recombinators[Sex.Male]._num_bases)
+
+class TestGenerateGenomesFor(unittest.TestCase):
+    def test_ancestral_closure(self):
+        population = _pedigree()
+        child = population.generations[2].members[0]
+        closure = ancestral_closure([child])
+        expected = set(population.generations[0].members[:4] +
+                       population.generations[1].members[:2] + [child])
+        self.assertEqual(closure, expected)
+
+    def test_only_targets_keep_genomes(self):
+        population = _pedigree()
+        recombinators = _recombinators()
+        child, twin, unrelated = population.generations[2].members
+        mother = population.generations[1].members[0]
+        generate_genomes_for(population, [child, twin, mother],
+                             _genome_generator(recombinators), recombinators,
+                             batch = True)
+        with_genomes = {node for node in population.members
+                        if node.genome is not None}
+        self.assertEqual(with_genomes, {child, twin, mother})
+        self.assertIs(child.genome, twin.genome)
+
+    def test_keeps_existing_genomes(self):
+        population = _pedigree()
+        recombinators = _recombinators()
+        child = population.generations[2].members[0]
+        mother = population.generations[1].members[0]
+        generate_genomes_for(population, [mother],
+                             _genome_generator(recombinators), recombinators)
+        mother_genome = mother.genome
+        generate_genomes_for(population, [child],
+                             _genome_generator(recombinators), recombinators)
+        self.assertIs(mother.genome, mother_genome)
+        self.assertIsNotNone(child.genome)
+
+    def test_matches_generate_genomes(self):
+        recombinators = _recombinators()
+        genomes = []
+        for generate in (generate_genomes, generate_genomes_for):
+            population = _pedigree()
+            np.random.seed(0)
+            if generate is generate_genomes:
+                generate(population, _genome_generator(recombinators),
+                         recombinators, batch = True)
+            else:
+                generate(population, population.members,
+                         _genome_generator(recombinators), recombinators,
+                         batch = True)
+            genomes.append([(node.genome.mother.starts.tolist(),
+                             node.genome.father.founder.tolist())
+                            for node in population.members])
+        self.assertEqual(genomes[0], genomes[1])
+
+def _genomes(population):
+    return [(node.genome.mother.starts.tolist(),
+             node.genome.mother.founder.tolist(),
+             node.genome.father.starts.tolist(),
+             node.genome.father.founder.tolist())
+            for node in population.members]
+
+class TestGenerateGenomesRng(unittest.TestCase):
+    def _generate(self, seed, **kwargs):
+        recombinators = _recombinators()
+        population = _pedigree()
+        generate_genomes(population, _genome_generator(recombinators),
+                         recombinators, rng = np.random.default_rng(seed),
+                         **kwargs)
+        return _genomes(population)
+
+    def test_same_seed(self):
+        for batch in (False, True):
+            first = self._generate(3, batch = batch)
+            # The global state must not matter.
+            np.random.seed(5)
+            np.random.random(7)
+            self.assertEqual(first, self._generate(3, batch = batch))
+
+    def test_different_seed(self):
+        self.assertNotEqual(self._generate(3, batch = True),
+                            self._generate(4, batch = True))
+
+    def test_processes(self):
+        self.assertEqual(self._generate(3, batch = True),
+                         self._generate(3, processes = 2))
+
+    def test_generate_genomes_for(self):
+        recombinators = _recombinators()
+        population = _pedigree()
+        generate_genomes_for(population, population.members,
+                             _genome_generator(recombinators), recombinators,
+                             batch = True, rng = np.random.default_rng(3))
+        self.assertEqual(_genomes(population),
+                         self._generate(3, batch = True))
+
+if __name__ == '__main__':
+    unittest.main()
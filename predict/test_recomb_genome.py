@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 
 from bisect import bisect_left
+from os import listdir
+from os.path import join
+from shutil import copy
+from tempfile import TemporaryDirectory
 from unittest.mock import MagicMock
+import pickle
 import unittest
 
 import numpy as np
 # import pyximport; pyximport.install()
 
 import recomb_genome
-from recomb_helper import new_sequence
+import population_genomes
+from sex import Sex
+from recomb_helper import new_sequence, gametes_packed, gamete
+from common_segments import founder_set
 
 def ar(locs):
     return np.array(locs, dtype = np.uint32)
@@ -25,8 +33,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 10
         diploid.founder = np.array([1], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([5]))
-        self.assertEqual(ret_diploid.starts, [0, 5])
-        self.assertEqual(ret_diploid.founder, [1, 1])
+        np.testing.assert_array_equal(ret_diploid.starts, [0, 5])
+        np.testing.assert_array_equal(ret_diploid.founder, [1, 1])
 
 
     def test_single_element_start(self):
@@ -35,8 +43,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 10
         diploid.founder = np.array([1], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([0]))
-        self.assertEqual(ret_diploid.starts, [0])
-        self.assertEqual(ret_diploid.founder, [1])
+        np.testing.assert_array_equal(ret_diploid.starts, [0])
+        np.testing.assert_array_equal(ret_diploid.founder, [1])
 
     def test_single_element_multiple(self):
         diploid = MagicMock()
@@ -44,8 +52,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 10
         diploid.founder = np.array([1], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([0, 4, 6, 8]))
-        self.assertEqual(ret_diploid.starts, [0, 4, 6, 8])
-        self.assertEqual(ret_diploid.founder, [1, 1, 1, 1])
+        np.testing.assert_array_equal(ret_diploid.starts, [0, 4, 6, 8])
+        np.testing.assert_array_equal(ret_diploid.founder, [1, 1, 1, 1])
 
     def test_end_boundary_two_element(self):
         diploid = MagicMock()
@@ -53,8 +61,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 20
         diploid.founder = np.array([1, 2], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([10]))
-        self.assertEqual(ret_diploid.starts, [0, 10])
-        self.assertEqual(ret_diploid.founder, [1, 2])
+        np.testing.assert_array_equal(ret_diploid.starts, [0, 10])
+        np.testing.assert_array_equal(ret_diploid.founder, [1, 2])
 
     def test_start_boundary_two_element(self):
         diploid = MagicMock()
@@ -62,8 +70,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 20
         diploid.founder = np.array([1, 2], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([0]))
-        self.assertEqual(ret_diploid.starts, [0, 10])
-        self.assertEqual(ret_diploid.founder, [1, 2])
+        np.testing.assert_array_equal(ret_diploid.starts, [0, 10])
+        np.testing.assert_array_equal(ret_diploid.founder, [1, 2])
 
     def test_middle_boundary_two_element(self):
         diploid = MagicMock()
@@ -71,8 +79,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 20
         diploid.founder = np.array([1, 2], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([5]))
-        self.assertEqual(ret_diploid.starts, [0, 5, 10])
-        self.assertEqual(ret_diploid.founder, [1, 1, 2])
+        np.testing.assert_array_equal(ret_diploid.starts, [0, 5, 10])
+        np.testing.assert_array_equal(ret_diploid.founder, [1, 1, 2])
 
     def test_middle_boundary_two_element_multiple_breaks(self):
         diploid = MagicMock()
@@ -80,8 +88,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 20
         diploid.founder = np.array([1, 2], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([5, 15]))
-        self.assertEqual(ret_diploid.starts, [0, 5, 10, 15])
-        self.assertEqual(ret_diploid.founder, [1, 1, 2, 2])
+        np.testing.assert_array_equal(ret_diploid.starts, [0, 5, 10, 15])
+        np.testing.assert_array_equal(ret_diploid.founder, [1, 1, 2, 2])
 
     def test_single_element_end(self):
         diploid = MagicMock()
@@ -89,8 +97,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 10
         diploid.founder = np.array([1], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([10]))
-        self.assertEqual(ret_diploid.starts, [0])
-        self.assertEqual(ret_diploid.founder, [1])
+        np.testing.assert_array_equal(ret_diploid.starts, [0])
+        np.testing.assert_array_equal(ret_diploid.founder, [1])
 
     def test_empty_locations(self):
         diploid = MagicMock()
@@ -98,8 +106,8 @@ class TestNewSequence(unittest.TestCase):
         diploid.end = 10
         diploid.founder = np.array([1], dtype = np.uint32)
         ret_diploid = new_sequence(diploid, ar([]))
-        self.assertEqual(ret_diploid.starts, [0])
-        self.assertEqual(ret_diploid.founder, [1])
+        np.testing.assert_array_equal(ret_diploid.starts, [0])
+        np.testing.assert_array_equal(ret_diploid.founder, [1])
 
 class TestSwapAtLocations(unittest.TestCase):
     def test_single_location_left_boundary(self):
@@ -340,8 +348,245 @@ class TestSwapAtLocations(unittest.TestCase):
                                       np.array([3, 1, 2, 4],
                                                dtype = np.uint32))
 
+    def test_repeated_locations(self):
+        mother = MagicMock()
+        mother.starts = np.array([0, 10], dtype = np.uint32)
+        mother.end = 20
+        mother.founder = np.array([1, 2], dtype = np.uint32)
+        father = MagicMock()
+        father.starts = np.array([0, 10], dtype = np.uint32)
+        father.end = 20
+        father.founder = np.array([3, 4], dtype = np.uint32)
+        locations = [(5, 5), (5, 15)]
+        new_mother, new_father = recomb_genome._swap_at_locations(mother,
+                                                                  father,
+                                                                  locations)
+        self.assertEqual(new_mother.starts.dtype, np.uint32)
+        np.testing.assert_array_equal(new_mother.starts, [0, 5, 10, 15])
+        np.testing.assert_array_equal(new_mother.founder, [1, 3, 4, 2])
+        np.testing.assert_array_equal(new_father.starts, [0, 5, 10, 15])
+        np.testing.assert_array_equal(new_father.founder, [3, 1, 2, 4])
 
 
-    
+def _gametes(parents, first_homolog, loci):
+    """
+    Runs gametes_packed on one parent genome with two chromosomes,
+    starting at 0 and 10, of a genome ending at 20. loci is a list of
+    crossover lists for each gamete and chromosome.
+    """
+    starts = ar([0, 5, 10, 0, 10])
+    founder = ar([1, 2, 3, 4, 5])
+    offsets = np.array([0, 3, 5], dtype = np.int64)
+    flat_loci = np.array([locus for gamete in loci for chrom in gamete
+                          for locus in chrom], dtype = np.int64)
+    counts = [len(chrom) for gamete in loci for chrom in gamete]
+    loci_offsets = np.zeros(len(counts) + 1, dtype = np.int64)
+    np.cumsum(counts, out = loci_offsets[1:])
+    return gametes_packed(starts, founder, offsets,
+                          np.array(parents, dtype = np.int64),
+                          np.array(first_homolog, dtype = np.uint8),
+                          flat_loci, loci_offsets[:-1].reshape(-1, 2),
+                          loci_offsets[1:].reshape(-1, 2),
+                          np.array([0, 10], dtype = np.int64), 20)
+
+class TestGametesPacked(unittest.TestCase):
+    def test_no_crossovers(self):
+        starts, founder, offsets = _gametes([0, 0], [[0, 1], [1, 0]],
+                                            [[[], []], [[], []]])
+        np.testing.assert_array_equal(starts, [0, 5, 10, 0, 10])
+        np.testing.assert_array_equal(founder, [1, 2, 5, 4, 3])
+        np.testing.assert_array_equal(offsets, [0, 3, 5])
+
+    def test_crossover(self):
+        starts, founder, offsets = _gametes([0], [[0, 1]], [[[7], [12]]])
+        np.testing.assert_array_equal(starts, [0, 5, 7, 10, 12])
+        np.testing.assert_array_equal(founder, [1, 2, 4, 5, 3])
+
+    def test_crossover_at_boundary(self):
+        starts, founder, offsets = _gametes([0], [[1, 0]], [[[5], [20]]])
+        np.testing.assert_array_equal(starts, [0, 5, 10])
+        np.testing.assert_array_equal(founder, [4, 2, 3])
+
+    def test_repeated_and_chromosome_start(self):
+        starts, founder, offsets = _gametes([0], [[0, 0]], [[[3, 3], [10]]])
+        np.testing.assert_array_equal(starts, [0, 3, 5, 10])
+        np.testing.assert_array_equal(founder, [1, 1, 2, 5])
+
+    def test_single_gamete(self):
+        mother = MagicMock()
+        mother.starts = ar([0, 5, 10])
+        mother.end = 20
+        mother.founder = ar([1, 2, 3])
+        father = MagicMock()
+        father.starts = ar([0, 10])
+        father.end = 20
+        father.founder = ar([4, 5])
+        loci = np.array([7, 12], dtype = np.int64)
+        loci_offsets = np.array([0, 1, 2], dtype = np.int64)
+        diploid = gamete(mother, father, np.array([0, 1], dtype = np.uint8),
+                         loci, loci_offsets,
+                         np.array([0, 10], dtype = np.int64))
+        starts, founder, offsets = _gametes([0], [[0, 1]], [[[7], [12]]])
+        np.testing.assert_array_equal(diploid.starts, starts)
+        np.testing.assert_array_equal(diploid.founder, founder)
+        self.assertEqual(diploid.end, 20)
+
+
+def _recombinator():
+    """
+    Returns a Recombinator where every chromosome is 20 bases long,
+    with 1 cM in the first 10 bases and 2 cM in the last 10.
+    """
+    data = {chrom: [[0, 0.1, 0.0], [10, 0.1, 1.0], [20, 0.2, 3.0]]
+            for chrom in recomb_genome.CHROMOSOME_ORDER}
+    return recomb_genome.Recombinator(data)
+
+class TestRecombinationLocations(unittest.TestCase):
+    def test_interpolate(self):
+        recombinator = _recombinator()
+        loci = recombinator._loci(np.array([0, 0]), np.array([0.5, 2.0]))
+        np.testing.assert_array_equal(loci, [5, 15])
+
+    def test_chromosome_offset_and_padding(self):
+        recombinator = _recombinator()
+        loci = recombinator._loci(np.array([1]), np.array([3.5]))
+        np.testing.assert_array_equal(loci, [25, 40])
+
+    def test_repeated_locations(self):
+        recombinator = _recombinator()
+        loci = recombinator._loci(np.array([0, 0, 0]),
+                                  np.array([0.5, 0.5, 2.0]))
+        np.testing.assert_array_equal(loci, [5, 15])
+
+    def test_empty(self):
+        recombinator = _recombinator()
+        loci = recombinator._loci(np.array([], dtype = np.int64),
+                                  np.array([], dtype = np.float64))
+        self.assertEqual(len(loci), 0)
+
+    def test_pairs_within_chromosome(self):
+        recombinator = _recombinator()
+        np.random.seed(0)
+        for _ in range(100):
+            loci = recombinator._recombination_locations()
+            self.assertEqual(len(loci) % 2, 0)
+            self.assertTrue(np.all(np.diff(loci) >= 0))
+            starts = loci[::2]
+            stops = loci[1::2]
+            chrom_i = np.searchsorted(recombinator._offsets, starts,
+                                      side = "right") - 1
+            chrom_ends = recombinator._offsets + recombinator._bases
+            self.assertTrue(np.all(stops <= chrom_ends[chrom_i]))
+
+class TestRecombGenomeGenerator(unittest.TestCase):
+    def setUp(self):
+        lengths = {chrom: 20 for chrom in recomb_genome.CHROMOSOME_ORDER}
+        self.generator = recomb_genome.RecombGenomeGenerator(lengths)
+
+    def test_founders_share_starts(self):
+        genome_a = self.generator.generate()
+        genome_b = self.generator.generate()
+        self.assertIs(genome_a.mother.starts, genome_b.father.starts)
+        self.assertFalse(genome_a.mother.starts.flags.writeable)
+        np.testing.assert_array_equal(genome_a.mother.starts,
+                                      np.arange(0, 440, 20))
+        np.testing.assert_array_equal(genome_b.father.founder, [3] * 22)
+        self.assertFalse(genome_b.father.founder.flags.writeable)
+
+    def test_mate_compact_founders(self):
+        """
+        Compact founders give the same children as founders with
+        their own arrays.
+        """
+        mother = self.generator.generate()
+        father = self.generator.generate()
+        expanded = [recomb_genome.RecombGenome(
+                        *[recomb_genome.Diploid(np.array(homolog.starts),
+                                                homolog.end,
+                                                np.array(homolog.founder))
+                          for homolog in (genome.mother, genome.father)])
+                    for genome in (mother, father)]
+        recombinator = _recombinator()
+        children = []
+        for parents in ((mother, father), expanded):
+            np.random.seed(0)
+            child = population_genomes.mate(parents[0], parents[1],
+                                            recombinator, recombinator)
+            children.append([homolog.tolist() for homolog
+                             in (child.mother.starts, child.mother.founder,
+                                 child.father.starts, child.father.founder)])
+        self.assertEqual(children[0], children[1])
+
+    def test_founders(self):
+        mother = self.generator.generate()
+        father = self.generator.generate()
+        np.testing.assert_array_equal(father.founders, [2, 3])
+        np.random.seed(0)
+        child = population_genomes.mate(mother, father, _recombinator(),
+                                        _recombinator())
+        # The founder set of a child is only computed when used.
+        self.assertIsNone(child._founders)
+        np.testing.assert_array_equal(child.founders,
+                                      founder_set(child.mother, child.father))
+        copy = pickle.loads(pickle.dumps(child))
+        np.testing.assert_array_equal(copy.founders, child.founders)
+        np.testing.assert_array_equal(copy.father.starts, child.father.starts)
+
+DECODE_FILE = join("..", "data", "recombination_rates",
+                   recomb_genome.DECODE_FILENAME)
+
+def _write_hapmap(directory, middle = 1000):
+    """
+    Writes a small HapMap style map for every chromosome, and the
+    decode sex lengths, to directory.
+    """
+    for chrom in recomb_genome.CHROMOSOME_ORDER:
+        filename = join(directory, "genetic_map_chr{}_b36.txt".format(chrom))
+        with open(filename, "w") as map_file:
+            map_file.write("position COMBINED_rate(cM/Mb) Genetic_Map(cM)\n")
+            for position, cm in ((100, 0.0), (middle, 0.5), (5000, chrom)):
+                map_file.write("{} 1.0 {}\n".format(position, cm))
+    copy(DECODE_FILE, directory)
+
+def _recombinator_state(recombinator):
+    return {name: value.tolist() if isinstance(value, np.ndarray) else value
+            for name, value in vars(recombinator).items()}
+
+class TestRecombinatorCache(unittest.TestCase):
+    def test_from_arrays_matches_rows(self):
+        recombinator = _recombinator()
+        from_arrays = recomb_genome.Recombinator.from_arrays(
+            *recombinator.map_arrays())
+        self.assertEqual(_recombinator_state(recombinator),
+                         _recombinator_state(from_arrays))
+
+    def test_cache_matches_sources(self):
+        with TemporaryDirectory() as directory:
+            _write_hapmap(directory)
+            uncached = recomb_genome.recombinators_from_directory(directory,
+                                                                  cache = False)
+            self.assertFalse(any(name.endswith(".npz")
+                                 for name in listdir(directory)))
+            built = recomb_genome.recombinators_from_directory(directory)
+            cached = recomb_genome.recombinators_from_directory(directory)
+            for sex in (Sex.Male, Sex.Female):
+                self.assertEqual(_recombinator_state(uncached[sex]),
+                                 _recombinator_state(built[sex]))
+                self.assertEqual(_recombinator_state(uncached[sex]),
+                                 _recombinator_state(cached[sex]))
+
+    def test_changed_source(self):
+        with TemporaryDirectory() as directory:
+            _write_hapmap(directory)
+            recomb_genome.recombinators_from_directory(directory)
+            _write_hapmap(directory, middle = 2000)
+            changed = recomb_genome.recombinators_from_directory(directory)
+            expected = recomb_genome.recombinators_from_directory(directory,
+                                                                  cache = False)
+            for sex in (Sex.Male, Sex.Female):
+                self.assertEqual(changed[sex]._range_stop[0], 2000)
+                self.assertEqual(_recombinator_state(changed[sex]),
+                                 _recombinator_state(expected[sex]))
+
 if __name__ == '__main__':
     unittest.main()
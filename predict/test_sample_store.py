@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+from os.path import join
+from tempfile import TemporaryDirectory
+import unittest
+
+import numpy as np
+
+from classify_relationship import distributions_from_directory
+from sample_store import SampleStore, COLUMN_FILENAME
+
+class TestSampleStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.directory = join(self.temp_dir.name, "work")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_empty(self):
+        store = SampleStore.create(self.directory, [3, 1])
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.labeled_nodes, [1, 3])
+        self.assertEqual(len(store.columns()["length"]), 0)
+
+    def test_append_columns(self):
+        with SampleStore.create(self.directory, [1]) as store:
+            store.append([5, 6], 1, 0, [100, 0])
+            store.append([5, 6], 1, 1, [200, 300])
+        store = SampleStore(self.directory)
+        self.assertEqual(len(store), 4)
+        columns = store.columns()
+        np.testing.assert_array_equal(columns["unlabeled"], [5, 6, 5, 6])
+        np.testing.assert_array_equal(columns["labeled"], [1, 1, 1, 1])
+        np.testing.assert_array_equal(columns["iteration"], [0, 0, 1, 1])
+        np.testing.assert_array_equal(columns["length"], [100, 0, 200, 300])
+
+    def test_twin_length(self):
+        # Twins share both homologs, more than fits in 32 bits.
+        twin_length = 2 * 2881033286
+        with SampleStore.create(self.directory, [1]) as store:
+            store.append(5, 1, 0, np.uint64(twin_length))
+        self.assertEqual(SampleStore(self.directory).columns()["length"][0],
+                         twin_length)
+
+    def test_truncated_column(self):
+        with SampleStore.create(self.directory, [1]) as store:
+            store.append([5, 6, 7], 1, 0, [1, 2, 3])
+        # Simulate a crash part way through writing the length column.
+        length_file = join(self.directory, COLUMN_FILENAME.format("length"))
+        with open(length_file, "r+b") as column_file:
+            column_file.truncate(12)
+        store = SampleStore(self.directory)
+        self.assertEqual(len(store), 1)
+        np.testing.assert_array_equal(store.columns()["unlabeled"], [5])
+
+    def test_clobber(self):
+        with SampleStore.create(self.directory, [1]) as store:
+            store.append(5, 1, 0, 10)
+        with SampleStore.create(self.directory, [1],
+                                clobber = False) as store:
+            store.append(5, 1, 1, 20)
+        self.assertEqual(len(SampleStore(self.directory)), 2)
+        store = SampleStore.create(self.directory, [1])
+        self.assertEqual(len(store), 0)
+
+    def test_distributions(self):
+        lengths = np.random.default_rng(0).gamma(2.0, 1e7, 200) \
+                    .astype(np.uint32)
+        lengths[::4] = 0
+        with SampleStore.create(self.directory, [1, 2]) as store:
+            for iteration, length in enumerate(lengths):
+                store.append([5, 6, 7], [1, 2, 1], iteration,
+                             [length, 0, length])
+        # Node 7 is not in the id mapping, and 6 never shares anything.
+        id_mapping = {5: None, 6: None}
+        rng = np.random.default_rng(1)
+        with self.assertWarns(UserWarning):
+            distributions = distributions_from_directory(self.directory,
+                                                         id_mapping, rng)
+        self.assertEqual(set(distributions), {(5, 1)})
+        self.assertAlmostEqual(distributions[5, 1].zero_prob, 0.25)
+
+    def test_distributions_processes(self):
+        rng = np.random.default_rng(2)
+        with SampleStore.create(self.directory, [1, 2]) as store:
+            for iteration in range(50):
+                lengths = rng.gamma(2.0, 1e7, 40).astype(np.uint32)
+                lengths[rng.random(40) < 0.2] = 0
+                store.append(np.arange(40) % 20, np.arange(40) // 20 + 1,
+                             iteration, lengths)
+        id_mapping = dict.fromkeys(range(20))
+        serial = distributions_from_directory(self.directory, id_mapping,
+                                              np.random.default_rng(3))
+        parallel = distributions_from_directory(self.directory, id_mapping,
+                                                np.random.default_rng(3),
+                                                processes = 3)
+        self.assertEqual(len(serial), 40)
+        self.assertEqual(serial, parallel)
+        np.random.seed(4)
+        serial = distributions_from_directory(self.directory, id_mapping)
+        np.random.seed(4)
+        parallel = distributions_from_directory(self.directory, id_mapping,
+                                                processes = 3)
+        self.assertEqual(serial, parallel)
+
+if __name__ == '__main__':
+    unittest.main()
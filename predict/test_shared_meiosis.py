@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+from unittest.mock import MagicMock
+import unittest
+
+import numpy as np
+
+from recomb_helper import gametes_packed, gamete_bounds
+from sex import Sex
+from shared_meiosis import (SharedArrays, PackedGeneration, mate_generation,
+                            meiosis_pool, SHARD_CHILDREN)
+from test_population_genomes import _recombinators, _genome_generator
+
+def _arguments(num_gametes, seed = 0):
+    """
+    Returns random arguments for gametes_packed over 3 parent genomes
+    with 2 chromosomes, starting at 0 and 100, of a genome ending at
+    200.
+    """
+    random_state = np.random.RandomState(seed)
+    starts = []
+    founder = []
+    offsets = [0]
+    for homolog in range(6):
+        breaks = np.unique(random_state.randint(1, 200, 6))
+        homolog_starts = np.union1d([0, 100], breaks)
+        starts.extend(homolog_starts)
+        founder.extend(random_state.randint(0, 10, len(homolog_starts)))
+        offsets.append(len(starts))
+    counts = random_state.randint(0, 4, (num_gametes, 2))
+    loci = np.concatenate([np.sort(random_state.randint(chrom * 100,
+                                                        chrom * 100 + 101,
+                                                        count))
+                           for count, chrom
+                           in zip(counts.ravel(),
+                                  np.tile([0, 1], num_gametes))])
+    loci_offsets = np.zeros(counts.size + 1, dtype = np.int64)
+    np.cumsum(counts.ravel(), out = loci_offsets[1:])
+    return (np.array(starts, dtype = np.uint32),
+            np.array(founder, dtype = np.uint32),
+            np.array(offsets, dtype = np.int64),
+            random_state.randint(0, 3, num_gametes).astype(np.int64),
+            random_state.randint(0, 2, (num_gametes, 2)).astype(np.uint8),
+            loci.astype(np.int64),
+            loci_offsets[:-1].reshape(-1, 2),
+            loci_offsets[1:].reshape(-1, 2),
+            np.array([0, 100], dtype = np.int64), 200)
+
+def _mate(pool, num_children, seed):
+    """
+    Mates num_children children of random pairs of 4 founders with
+    mate_generation, with 2 new founders after them. Returns the
+    arrays of the result and the packed founders.
+    """
+    recombinators = _recombinators()
+    generator = _genome_generator(recombinators)
+    parents = SharedArrays(pool is not None)
+    for name, array in zip(("starts", "founder", "offsets"),
+                           generator.generate_packed(4)):
+        parents.share(name, array)
+    random_state = np.random.RandomState(seed)
+    mothers = random_state.randint(0, 4, num_children)
+    fathers = random_state.randint(0, 4, num_children)
+    try:
+        generation = mate_generation(parents, mothers, fathers,
+                                     generator.generate_packed(2),
+                                     recombinators, generator._total_length,
+                                     pool, np.random.default_rng(seed))
+    finally:
+        parents.close(unlink = True)
+    arrays = {name: array.copy()
+              for name, array in generation.store.arrays.items()}
+    generation.close()
+    return (arrays, mothers, fathers)
+
+class TestMateGeneration(unittest.TestCase):
+    def test_pool_matches_serial(self):
+        num_children = 2 * SHARD_CHILDREN + 10
+        expected, _, _ = _mate(None, num_children, 3)
+        with meiosis_pool(2, _recombinators()) as pool:
+            result, _, _ = _mate(pool, num_children, 3)
+        for name, array in expected.items():
+            np.testing.assert_array_equal(result[name], array)
+            self.assertEqual(result[name].dtype, array.dtype)
+
+    def test_homologs(self):
+        arrays, mothers, fathers = _mate(None, 20, 4)
+        starts = arrays["starts"]
+        founder = arrays["founder"]
+        offsets = arrays["offsets"]
+        self.assertEqual(len(offsets), 2 * 20 + 1 + 2 * 2)
+        self.assertTrue(np.all(np.diff(offsets) >= 22))
+        for i, (mother, father) in enumerate(zip(mothers, fathers)):
+            for homolog, parent in enumerate((mother, father)):
+                row = 2 * i + homolog
+                homolog_starts = starts[offsets[row]:offsets[row + 1]]
+                self.assertEqual(homolog_starts[0], 0)
+                self.assertTrue(np.all(np.diff(homolog_starts.astype(np.int64))
+                                       > 0))
+                # Founder genome j has founder ids 2 * j and 2 * j + 1.
+                self.assertTrue(set(founder[offsets[row]:offsets[row + 1]])
+                                <= {2 * parent, 2 * parent + 1})
+        # The new founders follow the children.
+        np.testing.assert_array_equal(founder[offsets[40]:],
+                                      np.repeat(np.arange(8, 12), 22))
+
+    def test_no_children(self):
+        arrays, _, _ = _mate(None, 0, 5)
+        np.testing.assert_array_equal(arrays["offsets"],
+                                      np.arange(5) * 22)
+
+class TestPackedGeneration(unittest.TestCase):
+    def test_close_keeps_held_rows(self):
+        generator = _genome_generator(_recombinators())
+        store = SharedArrays()
+        for name, array in zip(("starts", "founder", "offsets"),
+                               generator.generate_packed(3)):
+            store.share(name, array)
+        generation = PackedGeneration(store, generator._total_length)
+        nodes = [MagicMock() for _ in range(4)]
+        for node, row in zip(nodes, (2, 0, 2)):
+            node.genome = generation.genome(row)
+        nodes[3].genome = None
+        generation.close(nodes)
+        self.assertEqual(len(generation.bank), 2)
+        self.assertEqual(nodes[0].genome.mother.founder.tolist(), [4] * 22)
+        self.assertEqual(nodes[1].genome.father.founder.tolist(), [1] * 22)
+        self.assertEqual(nodes[2].genome.node_id, nodes[0].genome.node_id)
+        self.assertIsNone(nodes[3].genome)
+
+class TestGameteBounds(unittest.TestCase):
+    def test_bounds(self):
+        arguments = _arguments(50, seed = 1)
+        starts, founder, offsets, parents, _, _, loci_start, loci_stop, \
+            _, _ = arguments
+        gamete_offsets = gametes_packed(*arguments)[2]
+        bounds = gamete_bounds(offsets, parents, loci_start, loci_stop)
+        self.assertTrue(np.all(np.diff(gamete_offsets) <= bounds))
+
+class TestSharedArrays(unittest.TestCase):
+    def test_attach(self):
+        shared = SharedArrays()
+        try:
+            shared.share("values", np.arange(5, dtype = np.int64))
+            attached = SharedArrays.attach(shared.specs)
+            attached.arrays["values"][0] = 7
+            np.testing.assert_array_equal(shared.arrays["values"],
+                                          [7, 1, 2, 3, 4])
+            attached.close()
+        finally:
+            shared.close(unlink = True)
+
+if __name__ == '__main__':
+    unittest.main()
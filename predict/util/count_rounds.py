@@ -1,25 +1,24 @@
 from argparse import ArgumentParser
-from collections import Counter
-from operator import itemgetter
+from os.path import abspath, dirname
+import sys
 
-from heapq import nsmallest
+import numpy as np
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from sample_store import SampleStore
 
 parser = ArgumentParser(description="Estimate the number of rounds run.")
-parser.add_argument("filename")
+parser.add_argument("directory")
+parser.add_argument("labeled", type = int)
 args = parser.parse_args()
 
-counter = Counter()
-with open(args.filename, "r") as output_file:
-    for line in output_file:
-        try:
-            node, length = line.split()
-        except ValueError:
-            continue
-        counter[node] += 1
-common_node, common_count = list(counter.most_common(1))[0]
-print("Node {} seen {} times".format(common_node, common_count))
+columns = SampleStore(args.directory).columns()
+unlabeled = columns["unlabeled"][columns["labeled"] == args.labeled]
+nodes, counts = np.unique(unlabeled, return_counts = True)
+assert len(nodes) > 0, "No samples for labeled node {}".format(args.labeled)
+common = np.argmax(counts)
+print("Node {} seen {} times".format(nodes[common], counts[common]))
 
 
-uncommon_node, uncommon_count = nsmallest(1, counter.items(),
-                                          key=itemgetter(1))[0]
-print("Node {} seen {} times".format(uncommon_node, uncommon_count))
+uncommon = np.argmin(counts)
+print("Node {} seen {} times".format(nodes[uncommon], counts[uncommon]))
@@ -1,15 +1,15 @@
 from argparse import ArgumentParser
-from os import listdir
-from os.path import join
-from warnings import warn
-from collections import defaultdict
+from os.path import abspath, dirname
 from bisect import bisect_left
 from pickle import dump
-from math import isclose
+import sys
 
 import numpy as np
 from scipy import stats
 
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from sample_store import SampleStore
+
 parser = ArgumentParser("Compare two simulation directories for discrepancies.")
 parser.add_argument("dir1")
 parser.add_argument("dir2")
@@ -17,89 +17,61 @@ parser.add_argument("--dir3")
 parser.add_argument("--subset", action = "store_true", default = False)
 args = parser.parse_args()
 
-def file_to_lengths(full_path):
-    lengths = defaultdict(list)
-    with open(full_path, "r") as labeled_file:
-        for line in labeled_file:
-            # If the program crashed, the output can be left in an
-            # inconsistent state.
-            try:
-                unlabeled_id, shared_str = line.split("\t")
-            except ValueError:
-                warn("Malformed line:\n{}".format(line), stacklevel = 0)
-                continue
-            unlabeled = int(unlabeled_id)
-            if not (0 <= unlabeled <= 10000 * 10):
-                error_string = "No such unlabeled node with id {}."
-                warn(error_string.format(unlabeled_id), stacklevel = 0)
-                continue
-            try:
-                shared_float = float(shared_str)
-            except ValueError:
-                error_string = "Error formatting value as float: {}."
-                warn(error_string.format(shared_str), stacklevel = 0)
-                continue
-            lengths[unlabeled].append(shared_float)
-    return lengths
-
-def get_ks_for_files(file1, file2):
-    lengths_1 = {node_id: np.array(shared)
-                 for node_id, shared
-                 in file_to_lengths(file1).items()}
-    lengths_2 = {node_id: np.array(shared)
-                 for node_id, shared
-                 in file_to_lengths(file2).items()}
-    stat_values = []
-    for node_id in lengths_1:
-        statistic, p_value = stats.ks_2samp(lengths_1[node_id],
-                                            lengths_2[node_id])
-        if isclose(p_value, 0.0):
-            import pdb
-            pdb.set_trace()
-        stat_values.append((statistic, p_value))
-    return stat_values
+def store_to_lengths(directory):
+    """
+    Returns a dict from (unlabeled, labeled) ids to the array of
+    lengths sampled for the pair in the sample store in directory.
+    """
+    columns = SampleStore(directory).columns()
+    pair_keys = ((columns["labeled"].astype(np.uint64) << np.uint64(32)) |
+                 columns["unlabeled"].astype(np.uint64))
+    keys, inverse = np.unique(pair_keys, return_inverse = True)
+    order = np.argsort(inverse, kind = "stable")
+    boundaries = np.flatnonzero(np.diff(inverse[order])) + 1
+    groups = np.split(np.asarray(columns["length"], dtype = np.float64)[order],
+                      boundaries)
+    return {(int(key & np.uint64(0xFFFFFFFF)), int(key >> np.uint64(32))):
+            lengths for key, lengths in zip(keys, groups)}
 
-def get_all_ks(dir1, dir2, files):
+def get_all_ks(lengths_1, lengths_2, pairs):
     ks_data = []
-    for filename in files:
-        current_ks_data = get_ks_for_files(join(dir1, filename),
-                                           join(dir2, filename))
-        ks_data.extend(current_ks_data)
+    for pair in pairs:
+        ks_data.append(stats.ks_2samp(lengths_1[pair], lengths_2[pair]))
     return ks_data
-        
-dir1_files = set(listdir(args.dir1))
-dir2_files = set(listdir(args.dir2))
+
+dir1_lengths = store_to_lengths(args.dir1)
+dir2_lengths = store_to_lengths(args.dir2)
 if args.dir3:
-    dir3_files = set(listdir(args.dir3))
+    dir3_lengths = store_to_lengths(args.dir3)
 else:
-    dir3_files = None
+    dir3_lengths = None
 
-files = dir2_files
+pairs = set(dir2_lengths)
 if args.subset:
-    files = dir1_files.intersection(dir2_files)
-    if dir3_files is not None:
-        files = files.intersection(dir3_files)
-    assert len(files) > 0
-    print("Using subset of size {}".format(len(files)))    
-elif dir1_files != dir2_files:
-    print("Directories 1 and 2 don't have same files")
-    print("Difference is {}".format(dir1_files ^ dir2_files))
+    pairs = pairs.intersection(dir1_lengths)
+    if dir3_lengths is not None:
+        pairs = pairs.intersection(dir3_lengths)
+    assert len(pairs) > 0
+    print("Using subset of size {}".format(len(pairs)))
+elif set(dir1_lengths) != set(dir2_lengths):
+    print("Directories 1 and 2 don't have same pairs")
+    print("Difference is {}".format(set(dir1_lengths) ^ set(dir2_lengths)))
     exit()
-elif dir3_files is not None and dir2_files != dir3_files:
-    print("Directories 2 and 3 don't have same files")
-    print("Difference is {}".format(dir2_files ^ dir3_files))
+elif dir3_lengths is not None and set(dir2_lengths) != set(dir3_lengths):
+    print("Directories 2 and 3 don't have same pairs")
+    print("Difference is {}".format(set(dir2_lengths) ^ set(dir3_lengths)))
     exit()
 
 
-if dir3_files is None:
-    ks_data = get_all_ks(args.dir1, args.dir2, files)
+if dir3_lengths is None:
+    ks_data = get_all_ks(dir1_lengths, dir2_lengths, pairs)
     p_values = sorted([x[1] for x in ks_data])
     loc = bisect_left(p_values, 0.95)
     frac_above = (loc + 1) / len(p_values)
     print("{} of entries have p value of 0.95 or greater".format(frac_above))
 else:
-    dir1_dir2_ks = get_all_ks(args.dir1, args.dir2, files)
-    dir2_dir3_ks = get_all_ks(args.dir2, args.dir3, files)
+    dir1_dir2_ks = get_all_ks(dir1_lengths, dir2_lengths, pairs)
+    dir2_dir3_ks = get_all_ks(dir2_lengths, dir3_lengths, pairs)
     with open("python_ks.pickle", "wb") as pickle_file:
         dump(dir1_dir2_ks, pickle_file)
     with open("rust_python_ks.pickle", "wb") as pickle_file: